@@ -3,7 +3,7 @@ import torch
 import torchaudio
 import gc
 
-from resemble_enhance.enhancer.inference import denoise, enhance
+from resemble_enhance.enhancer.inference import denoise, enhance, warm
 
 if torch.cuda.is_available():
     device = "cuda"
@@ -21,7 +21,7 @@ def _fn(path, solver, nfe, tau,chunk_seconds,chunks_overlap, denoising):
     if path is None:
         return None, None
 
-    solver = solver.lower()
+    solver = solver.lower().replace("-", "_")
     nfe = int(nfe)
     lambd = 0.9 if denoising else 0.1
 
@@ -39,10 +39,13 @@ def _fn(path, solver, nfe, tau,chunk_seconds,chunks_overlap, denoising):
 
 
 def main():
+    # Load the model once up front, every request then reuses it
+    warm(None, device)
+
     inputs: list = [
         gr.Audio(type="filepath", label="Input Audio"),
-        gr.Dropdown(choices=["Midpoint", "RK4", "Euler"], value="Midpoint", label="CFM ODE Solver (Midpoint is recommended)"),
-        gr.Slider(minimum=1, maximum=128, value=64, step=1, label="CFM Number of Function Evaluations (higher values in general yield better quality but may be slower)"),
+        gr.Dropdown(choices=["Midpoint", "RK4", "Euler", "Heun-Euler", "Dopri5"], value="Midpoint", label="CFM ODE Solver (Midpoint is recommended, Heun-Euler and Dopri5 pick their own step sizes)"),
+        gr.Slider(minimum=1, maximum=128, value=64, step=1, label="CFM Number of Function Evaluations (higher values in general yield better quality but may be slower, the upper bound for the adaptive solvers)"),
         gr.Slider(minimum=0, maximum=1, value=0.5, step=0.01, label="CFM Prior Temperature (higher values can improve quality but can reduce stability)"),
         gr.Slider(minimum=1, maximum=40, value=10, step=1, label="Chunk seconds (more secods more VRAM usage)"),
         gr.Slider(minimum=0, maximum=5, value=1, step=0.5, label="Chunk overlap"),
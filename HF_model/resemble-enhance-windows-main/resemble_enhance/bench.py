@@ -0,0 +1,343 @@
+"""
+Benchmark of the inference stack, run as `python -m resemble_enhance.bench > bench.json`.
+
+Each scenario runs in its own spawned process (a fresh allocator, thread pool and peak RSS), loads the model
+through the same path as the CLI, warms it up on one chunk and then times whole-file runs. The output is JSON
+meant to be diffed between versions, by default on a random-init model so that no download is needed.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import os
+import platform
+import queue
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from functools import wraps
+from pathlib import Path
+
+import torch
+
+from . import inference as inference_module
+from .enhancer.enhancer import Enhancer
+from .enhancer.hparams import HParams
+from .enhancer.inference import convert_checkpoint, denoise, enhance, get_denoiser, get_enhancer
+from .enhancer.lcfm.cfm import SOLVER_METHODS
+from .precision import PRECISIONS
+
+logger = logging.getLogger(__name__)
+
+KINDS = ("denoise", "enhance")
+
+STAGES = ("mel", "denoiser", "irmae", "cfm", "vocoder", "merge")
+
+
+def synthetic_run_dir(path, seed=0):
+    """
+    Create (once) a run folder holding a random-init enhancer in CFM mode, in the layout of a trained run.
+
+    Returns:
+        run_dir: path
+    """
+    path = Path(path)
+    ckpt_path = path / "ds" / "G" / "default" / "mp_rank_00_model_states.pt"
+    if ckpt_path.exists():
+        return path
+
+    logger.info(f"Creating a random-init run in {path}")
+    torch.manual_seed(seed)
+    hp = HParams(lcfm_training_mode="cfm")
+    enhancer = Enhancer(hp)
+    ckpt_path.parent.mkdir(parents=True, exist_ok=True)
+    hp.save_if_not_exists(path)
+    tmp_path = ckpt_path.with_name(f".{ckpt_path.name}.tmp")
+    torch.save({"module": enhancer.state_dict()}, tmp_path)
+    os.replace(tmp_path, ckpt_path)
+
+    return path
+
+
+def scenarios(kinds=KINDS, nfes=(8, 32, 64), solvers=SOLVER_METHODS, chunk_seconds=(5, 10, 30), threads=(1, 2, 4, 8)):
+    """
+    Yields:
+        scenario: dict of the arguments of one run, the denoiser has no nfe and solver
+    """
+    for kind in kinds:
+        for chunk in chunk_seconds:
+            for num_threads in threads:
+                if kind == "denoise":
+                    yield dict(kind=kind, chunk_seconds=chunk, threads=num_threads)
+                    continue
+                for solver in solvers:
+                    for nfe in nfes:
+                        yield dict(kind=kind, nfe=nfe, solver=solver, chunk_seconds=chunk, threads=num_threads)
+
+
+def _timed(fn, stage, times):
+    @wraps(fn)
+    def _fn(*args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            times[stage] += time.perf_counter() - start_time
+
+    return _fn
+
+
+def _time_stages_(model, times):
+    """
+    Wrap the entry points of the stages of model, and the merge of the chunks, to add their wall time to times.
+    The stages do not nest, so the remainder of a run is spent in between them (normalization, padding, copies).
+    """
+    if isinstance(model, Enhancer):
+        targets = [
+            (model, "to_mel", "mel"),
+            (model.denoiser, "forward", "denoiser"),
+            (model.lcfm.ae, "encode", "irmae"),
+            (model.lcfm.ae, "decode", "irmae"),
+            (model.lcfm.cfm, "forward", "cfm"),
+            (model.vocoder, "forward", "vocoder"),
+        ]
+    else:
+        targets = [(model, "forward", "denoiser")]
+    targets.append((inference_module, "merge_chunks", "merge"))
+
+    for obj, name, stage in targets:
+        setattr(obj, name, _timed(getattr(obj, name), stage, times))
+
+
+def _count_nfe_(model: Enhancer, counts):
+    """
+    Wrap the CFM of model to add the function evaluations of each of its solves to counts["nfe_used"].
+    """
+    cfm = model.lcfm.cfm
+    forward = cfm.forward
+
+    @wraps(forward)
+    def _forward(*args, **kwargs):
+        o = forward(*args, **kwargs)
+        counts["nfe_used"] += cfm.solver.nfe_used or 0
+        return o
+
+    cfm.forward = _forward
+
+
+def _reset_peak_rss():
+    try:
+        Path("/proc/self/clear_refs").write_text("5")  # Resets VmHWM to the current RSS
+    except OSError:
+        pass
+
+
+def _peak_rss_mb():
+    """
+    Returns:
+        peak: peak resident set size since the last _reset_peak_rss in MB, since the start where it cannot be
+            reset, None where it is not available
+    """
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return maxrss / 2**20  # Bytes on macOS
+    return maxrss / 1024  # KB elsewhere
+
+
+def _count_allocations(fn):
+    """
+    Run fn under the profiler, whose overhead would skew the timings of the other runs.
+
+    Returns:
+        counts: number and total size of the CPU allocations made by fn
+    """
+    from torch.profiler import ProfilerActivity, profile
+
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        fn()
+    try:
+        # Private, but the raw events keep every allocation, prof.events() folds those of an op into it
+        events = prof.profiler.kineto_results.events()
+    except AttributeError:
+        # Only the net memory of each op, so the frees within an op hide its allocations
+        sizes = [e.self_cpu_memory_usage for e in prof.events() if e.self_cpu_memory_usage > 0]
+        return dict(count=len(sizes), mb=sum(sizes) / 2**20, exact=False)
+    sizes = [e.nbytes() for e in events if e.name() == "[memory]" and e.nbytes() > 0]
+    return dict(count=len(sizes), mb=sum(sizes) / 2**20, exact=True)
+
+
+@torch.inference_mode()
+def run_scenario(scenario, run_dir, seconds=60.0, chunks_overlap=1.0, precision="fp32", repeats=1, seed=0):
+    """
+    Args:
+        scenario: one of scenarios()
+        seconds: length of the synthetic input
+    Returns:
+        record: the scenario with its load time, real-time factor, per-stage times of the median run, peak RSS,
+            allocations and the function evaluations of the CFM solver per run
+    """
+    torch.set_num_threads(scenario["threads"])
+    kind = scenario["kind"]
+    record = dict(scenario)
+
+    _reset_peak_rss()
+    start_time = time.perf_counter()
+    if kind == "denoise":
+        model = get_denoiser(run_dir, "cpu", precision=precision)
+    else:
+        model = get_enhancer(run_dir, "cpu", precision=precision)
+    record["load"] = dict(seconds=time.perf_counter() - start_time, peak_rss_mb=_peak_rss_mb())
+
+    sr = model.hp.wav_rate
+    generator = torch.Generator().manual_seed(seed)
+    dwav = 0.1 * torch.randn(int(seconds * sr), generator=generator)
+
+    def run(dwav):
+        kwargs = dict(dwav=dwav, sr=sr, device="cpu", run_dir=run_dir, precision=precision)
+        kwargs.update(chunk_seconds=scenario["chunk_seconds"], chunks_overlap=chunks_overlap)
+        if kind == "denoise":
+            return denoise(**kwargs)
+        return enhance(nfe=scenario["nfe"], solver=scenario["solver"], **kwargs)
+
+    run(dwav[: int(scenario["chunk_seconds"] * sr)])  # Warm-up, also fills the noise and kernel caches
+
+    times = defaultdict(float)
+    _time_stages_(model, times)
+    counts = defaultdict(int)
+    if kind == "enhance":
+        _count_nfe_(model, counts)
+
+    _reset_peak_rss()
+    runs = []
+    for _ in range(repeats):
+        times.clear()
+        start_time = time.perf_counter()
+        run(dwav)
+        runs.append((time.perf_counter() - start_time, dict(times)))
+    peak_rss_mb = _peak_rss_mb()
+
+    # The stage times of the median run, so that they add up to the reported time
+    elapsed, run_times = sorted(runs, key=lambda r: r[0])[(repeats - 1) // 2]
+    stages = {stage: run_times[stage] for stage in STAGES if stage in run_times}
+    stages["other"] = max(0.0, elapsed - sum(stages.values()))
+
+    record["elapsed"] = elapsed
+    record["rtf"] = record["elapsed"] / seconds
+    record["stages"] = stages
+    record["peak_rss_mb"] = peak_rss_mb
+    if kind == "enhance":
+        record["nfe_used"] = counts["nfe_used"] / repeats  # Over all the chunks of a run
+    record["allocations"] = _count_allocations(lambda: run(dwav))
+
+    return record
+
+
+def _worker(scenario, kwargs, results):
+    logging.basicConfig(level=logging.WARNING)
+    try:
+        results.put(run_scenario(scenario, **kwargs))
+    except Exception as e:
+        results.put(dict(scenario, error=repr(e)))
+
+
+def run_spawned(scenario, **kwargs):
+    """
+    Run one scenario in a fresh spawned process, see run_scenario.
+    """
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    worker = ctx.Process(target=_worker, args=(scenario, kwargs, results))
+    worker.start()
+    while True:
+        try:
+            record = results.get(timeout=1)
+            break
+        except queue.Empty:
+            if not worker.is_alive() and results.empty():
+                record = dict(scenario, error=f"Exited with code {worker.exitcode}")
+                break
+    worker.join()
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        "--run_dir",
+        type=Path,
+        default=None,
+        help="Path to the enhancer run folder, if None, use a random-init model created in --work_dir",
+    )
+    parser.add_argument("--work_dir", type=Path, default=Path(tempfile.gettempdir()) / "resemble_enhance_bench")
+    parser.add_argument("--out_path", type=Path, default=None, help="Path of the JSON report, if None, print it")
+    parser.add_argument("--kinds", type=str, nargs="+", default=list(KINDS), choices=list(KINDS))
+    parser.add_argument("--nfe", type=int, nargs="+", default=[8, 32, 64], help="Numbers of function evaluations")
+    parser.add_argument("--solvers", type=str, nargs="+", default=list(SOLVER_METHODS), choices=list(SOLVER_METHODS))
+    parser.add_argument("--chunk_seconds", type=float, nargs="+", default=[5.0, 10.0, 30.0])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8], help="Numbers of torch threads")
+    parser.add_argument("--seconds", type=float, default=60.0, help="Length of the synthetic input")
+    parser.add_argument("--chunks_overlap", type=float, default=1.0, help="Overlap between chunks in seconds")
+    parser.add_argument("--precision", type=str, default="fp32", choices=list(PRECISIONS))
+    parser.add_argument("--repeats", type=int, default=1, help="Timed runs per scenario, the median run is reported")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random-init model and of the input")
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    run_dir = args.run_dir or synthetic_run_dir(args.work_dir / "run", seed=args.seed)
+    convert_checkpoint(run_dir)  # Once up front, the workers then map the same file
+
+    kwargs = dict(
+        run_dir=run_dir,
+        seconds=args.seconds,
+        chunks_overlap=args.chunks_overlap,
+        precision=args.precision,
+        repeats=args.repeats,
+        seed=args.seed,
+    )
+
+    report = dict(
+        meta=dict(
+            torch=torch.__version__,
+            python=platform.python_version(),
+            platform=platform.platform(),
+            processor=platform.processor(),
+            cpu_count=os.cpu_count(),
+            model="random-init" if args.run_dir is None else str(args.run_dir),
+            **{k: v for k, v in kwargs.items() if k != "run_dir"},
+        ),
+        scenarios=[],
+    )
+
+    for scenario in scenarios(args.kinds, args.nfe, args.solvers, args.chunk_seconds, args.threads):
+        record = run_spawned(scenario, **kwargs)
+        if "error" in record:
+            logger.warning(f"{scenario}: {record['error']}")
+        else:
+            peak_rss_mb = record["peak_rss_mb"]
+            peak = "n/a" if peak_rss_mb is None else f"{peak_rss_mb:.0f} MB"
+            logger.info(f"{scenario}: rtf {record['rtf']:.3f}, peak {peak}")
+        report["scenarios"].append(record)
+
+    output = json.dumps(report, indent=2)
+    if args.out_path is None:
+        print(output)
+    else:
+        args.out_path.write_text(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Flat tensor files in the safetensors layout (an 8-byte little-endian header size, a JSON header and the raw data),
+written so that they can be memory-mapped and used in place: the data starts on a page boundary and the tensors
+are sorted by decreasing element size, so every tensor is aligned for its dtype.
+"""
+
+import json
+import mmap
+import os
+import struct
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import torch
+from torch import Tensor, nn
+from torch.nn.utils import parametrize
+
+_DTYPES = {
+    torch.float64: "F64",
+    torch.float32: "F32",
+    torch.float16: "F16",
+    torch.bfloat16: "BF16",
+    torch.int64: "I64",
+    torch.int32: "I32",
+    torch.int16: "I16",
+    torch.int8: "I8",
+    torch.uint8: "U8",
+    torch.bool: "BOOL",
+}
+
+_NAMES = {name: dtype for dtype, name in _DTYPES.items()}
+
+
+def save_flat(tensors: dict[str, Tensor], path, metadata: dict[str, str] | None = None):
+    """
+    Write tensors to path, atomically so that concurrent readers never see a partial file.
+    """
+    path = Path(path)
+    tensors = {k: v.detach().cpu().contiguous() for k, v in tensors.items()}
+    names = sorted(tensors, key=lambda k: (-tensors[k].element_size(), k))
+
+    header = {}
+    offset = 0
+    for name in names:
+        t = tensors[name]
+        nbytes = t.numel() * t.element_size()
+        header[name] = dict(dtype=_DTYPES[t.dtype], shape=list(t.shape), data_offsets=[offset, offset + nbytes])
+        offset += nbytes
+    if metadata:
+        header["__metadata__"] = metadata
+
+    header = json.dumps(header, separators=(",", ":")).encode()
+    header += b" " * (-(8 + len(header)) % mmap.PAGESIZE)  # Whitespace padding is allowed by the format
+
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(struct.pack("<Q", len(header)))
+            f.write(header)
+            for name in names:
+                f.write(tensors[name].reshape(-1).view(torch.uint8).numpy().tobytes())
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def load_flat(path) -> tuple[dict[str, Tensor], dict[str, str]]:
+    """
+    Map a file written by save_flat (or any safetensors file with aligned tensors).
+
+    The mapping is private and copy-on-write: the pages come from the page cache and are shared by every process
+    that maps the same file, as long as they are not written to.
+
+    Returns:
+        tensors: views into the mapping
+        metadata: the __metadata__ of the header
+    """
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    (size,) = struct.unpack("<Q", buffer[:8])
+    header = json.loads(buffer[8 : 8 + size])
+    metadata = header.pop("__metadata__", {})
+
+    data = torch.frombuffer(buffer, dtype=torch.uint8)[8 + size :]
+
+    tensors = {}
+    for name, info in header.items():
+        start, end = info["data_offsets"]
+        tensors[name] = data[start:end].view(_NAMES[info["dtype"]]).view(info["shape"])
+
+    return tensors, metadata
+
+
+_meta_state = threading.local()
+_patch_lock = threading.Lock()
+_register_parameter = None
+
+
+def _register_parameter_maybe_meta(module, name, param):
+    if getattr(_meta_state, "depth", 0) > 0 and param is not None and not param.is_meta:
+        param = nn.Parameter(param.to("meta"), requires_grad=param.requires_grad)
+    _register_parameter(module, name, param)
+
+
+def _patch_register_parameter():
+    """
+    Route nn.Module.register_parameter through _register_parameter_maybe_meta, once for the process. The patch
+    is a no-op outside of meta_parameters, which is tracked per thread.
+    """
+    global _register_parameter
+    with _patch_lock:
+        if _register_parameter is None:
+            _register_parameter = nn.Module.register_parameter
+            nn.Module.register_parameter = _register_parameter_maybe_meta
+
+
+@contextmanager
+def meta_parameters():
+    """
+    Within this context the parameters of new modules are moved to the meta device as they are registered,
+    so that building a module to fill with assign_ costs neither memory nor initialization. Buffers are created
+    as usual, as their construction may not run on meta tensors (e.g. mel filterbanks).
+
+    Only modules built by the current thread are affected, others may build theirs concurrently.
+    """
+    _patch_register_parameter()
+    _meta_state.depth = getattr(_meta_state, "depth", 0) + 1
+    try:
+        yield
+    finally:
+        _meta_state.depth -= 1
+
+
+class _Placeholder(nn.Module):
+    def forward(self, *originals):
+        return torch.empty(0, device="meta")
+
+
+def drop_parametrizations_(module: nn.Module):
+    """
+    Turn the parametrized tensors of module back into plain ones without evaluating the parametrizations, which
+    may not run on the meta device (e.g. weight norm), for assign_ to fill with their folded values.
+    """
+    for submodule in module.modules():
+        if not parametrize.is_parametrized(submodule):
+            continue
+        for name in list(submodule.parametrizations):
+            parametrizations = submodule.parametrizations[name]
+            for i in range(len(parametrizations)):
+                parametrizations[i] = _Placeholder()
+            parametrize.remove_parametrizations(submodule, name)
+    return module
+
+
+def assign_(module: nn.Module, tensors: dict[str, Tensor]):
+    """
+    Make the parameters and buffers of module, including the non-persistent ones, the given tensors without
+    copying them, e.g. to fill a module built under meta_parameters.
+    """
+    missing = []
+    for prefix, submodule in module.named_modules(remove_duplicate=False):
+        prefix = f"{prefix}." if prefix else ""
+        for name, param in submodule._parameters.items():
+            if param is None:
+                continue
+            if prefix + name not in tensors:
+                missing.append(prefix + name)
+                continue
+            submodule._parameters[name] = nn.Parameter(tensors[prefix + name], requires_grad=param.requires_grad)
+        for name, buffer in submodule._buffers.items():
+            if buffer is None:
+                continue
+            if prefix + name not in tensors:
+                missing.append(prefix + name)
+                continue
+            submodule._buffers[name] = tensors[prefix + name]
+    assert not missing, f"Missing tensors: {missing}"
+    return module
@@ -1,10 +1,62 @@
 import logging
+from contextlib import contextmanager
+from functools import lru_cache
 
 import torch
 from torch import Tensor, nn
 
 logger = logging.getLogger(__name__)
 
+_inference_profile = False
+
+
+@contextmanager
+def inference_profile(enabled=True):
+    """
+    Within this context the modules skip their training diagnostics, see diagnostics_enabled.
+    """
+    global _inference_profile
+    previous, _inference_profile = _inference_profile, enabled
+    try:
+        yield
+    finally:
+        _inference_profile = previous
+
+
+def diagnostics_enabled(module: nn.Module | None = None):
+    """
+    Whether to compute training diagnostics (stats dicts, model summaries), which cost host-device syncs.
+
+    They are skipped under the inference profile, and for modules in eval mode under torch.inference_mode,
+    whose outputs cannot be trained on anyway.
+    """
+    if _inference_profile:
+        return False
+    return module is None or module.training or not torch.is_inference_mode_enabled()
+
+
+def randn_per_row(shape, *, device=None, dtype=None, seed=0):
+    """
+    Draw each row of a batch from its own generator seeded with `seed`, so a row gets the same
+    noise no matter how many other rows are in the batch (deterministic sampling during eval).
+
+    The noise only depends on the arguments, so it is cached, and a copy is returned so that the caller may
+    modify it in place.
+    """
+    device = torch.device("cpu" if device is None else device)
+    dtype = torch.get_default_dtype() if dtype is None else dtype
+    return _randn_per_row(tuple(int(n) for n in shape), device, dtype, seed).clone()
+
+
+@lru_cache(maxsize=16)
+def _randn_per_row(shape, device, dtype, seed):
+    g = torch.Generator(device=device)
+    rows = []
+    for _ in range(shape[0]):
+        g.manual_seed(seed)
+        rows.append(torch.randn([1, *shape[1:]], device=device, dtype=dtype, generator=g))
+    return torch.cat(rows)
+
 
 class Normalizer(nn.Module):
     def __init__(self, momentum=0.01, eps=1e-9):
@@ -22,15 +74,15 @@ class Normalizer(nn.Module):
 
     @property
     def running_mean(self):
-        if not self.started:
-            return torch.zeros_like(self.running_mean_unsafe)
-        return self.running_mean_unsafe
+        # Without branching on started, which would sync with the device
+        started = ~torch.isnan(self.running_mean_unsafe)
+        return torch.where(started, self.running_mean_unsafe, torch.zeros_like(self.running_mean_unsafe))
 
     @property
     def running_std(self):
-        if not self.started:
-            return torch.ones_like(self.running_var_unsafe)
-        return (self.running_var_unsafe + self.eps).sqrt()
+        started = ~torch.isnan(self.running_mean_unsafe)
+        std = (self.running_var_unsafe + self.eps).sqrt()
+        return torch.where(started, std, torch.ones_like(std))
 
     @torch.no_grad()
     def _ema(self, a: Tensor, x: Tensor):
@@ -47,7 +99,8 @@ class Normalizer(nn.Module):
     def forward(self, x: Tensor, update=True):
         if self.training and update:
             self.update_(x)
-        self.stats = dict(mean=self.running_mean.item(), std=self.running_std.item())
+        if diagnostics_enabled(self):
+            self.stats = dict(mean=self.running_mean.item(), std=self.running_std.item())
         x = (x - self.running_mean) / self.running_std
         return x
 
@@ -5,11 +5,11 @@ from pathlib import Path
 import numpy as np
 import torch
 import torchaudio
-import torchaudio.functional as AF
 from torch.nn.utils.rnn import pad_sequence
 from torch.utils.data import Dataset as DatasetBase
 
 from ..hparams import HParams
+from ..resample import resample
 from .distorter import Distorter
 from .utils import rglob_audio_files
 
@@ -85,15 +85,7 @@ class Dataset(DatasetBase):
     def _load_wav(self, path, length=None, random_crop=True):
         wav, sr = torchaudio.load(path)
 
-        wav = AF.resample(
-            waveform=wav,
-            orig_freq=sr,
-            new_freq=self.hp.wav_rate,
-            lowpass_filter_width=64,
-            rolloff=0.9475937167399596,
-            resampling_method="sinc_interp_kaiser",
-            beta=14.769656459379492,
-        )
+        wav = resample(wav, orig_freq=sr, new_freq=self.hp.wav_rate)
 
         wav = wav.float().numpy()
 
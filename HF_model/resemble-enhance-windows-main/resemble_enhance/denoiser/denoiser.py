@@ -5,6 +5,7 @@ import torch.nn.functional as F
 from torch import Tensor, nn
 
 from ..melspec import MelSpectrogram
+from ..spectral import SpectralFrontend
 from .hparams import HParams
 from .unet import UNet
 
@@ -16,6 +17,10 @@ def _normalize(x: Tensor) -> Tensor:
 
 
 class Denoiser(nn.Module):
+    # Peak memory of an eval forward pass per input sample in fp32, measured like Enhancer.peak_bytes_per_sample:
+    # 1.4-1.9 KB, rounded up
+    peak_bytes_per_sample = 2 * 1024
+
     @property
     def stft_cfg(self) -> dict:
         hop_size = self.hp.hop_size
@@ -34,10 +39,17 @@ class Denoiser(nn.Module):
         self.hp = hp
         self.net = UNet(input_dim=3, output_dim=3)
         self.mel_fn = MelSpectrogram(hp)
+        self.frontend = SpectralFrontend(**self.stft_cfg)
 
         self.dummy: Tensor
         self.register_buffer("dummy", torch.zeros(1), persistent=False)
 
+    def set_tiling_(self, tile_frames=None, halo_frames=128, batch_size=1):
+        """
+        Run the UNet on tiles of STFT frames in eval, see UNet.set_tiling_.
+        """
+        self.net.set_tiling_(tile_frames, halo_frames=halo_frames, batch_size=batch_size)
+
     def to_mel(self, x: Tensor, drop_last=True):
         """
         Args:
@@ -64,16 +76,7 @@ class Denoiser(nn.Module):
         if x.is_mps:
             x = x.cpu()
 
-        window = torch.hann_window(self.stft_cfg["win_length"], device=x.device)
-        s = torch.stft(x.float(), **self.stft_cfg, window=window, return_complex=True)  # (b f t+1)
-
-        s = s[..., :-1]  # (b f t)
-
-        mag = s.abs()  # (b f t)
-
-        phi = s.angle()  # (b f t)
-        cos = phi.cos()  # (b f t)
-        sin = phi.sin()  # (b f t)
+        mag, cos, sin = self.frontend.magphase(x, drop_last=True)  # (b f t)
 
         mag = mag.to(dtype=dtype, device=device)
         cos = cos.to(dtype=dtype, device=device)
@@ -108,8 +111,7 @@ class Denoiser(nn.Module):
 
         s = F.pad(s, (0, 1), "replicate")  # (b f t+1)
 
-        window = torch.hann_window(self.stft_cfg["win_length"], device=s.device)
-        x = torch.istft(s, **self.stft_cfg, window=window, return_complex=False)
+        x = self.frontend.istft(s)
 
         if x.isnan().any():
             logger.warning("NaN detected in ISTFT output, set to zero.")
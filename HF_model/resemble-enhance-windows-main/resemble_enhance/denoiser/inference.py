@@ -4,13 +4,13 @@ from functools import cache
 import torch
 
 from ..inference import inference
-from .train import Denoiser, HParams
+from .denoiser import Denoiser
+from .hparams import HParams
 
 logger = logging.getLogger(__name__)
 
 
-@cache
-def load_denoiser(run_dir, device):
+def build_denoiser(run_dir, device):
     if run_dir is None:
         return Denoiser(HParams())
     hp = HParams.load(run_dir)
@@ -23,6 +23,10 @@ def load_denoiser(run_dir, device):
     return denoiser
 
 
+# Each enhancer owns its denoiser (see Enhancer.__init__), only standalone usage is cached
+load_denoiser = cache(build_denoiser)
+
+
 @torch.inference_mode()
 def denoise(dwav, sr, run_dir, device):
     denoiser = load_denoiser(run_dir, device)
@@ -1,5 +1,6 @@
+import torch
 import torch.nn.functional as F
-from torch import nn
+from torch import Tensor, nn
 
 
 class PreactResBlock(nn.Sequential):
@@ -77,6 +78,11 @@ class UNet(nn.Module):
             nn.Conv2d(hidden_dim, output_dim, 1),
         )
 
+        # Eval only, see set_tiling_
+        self.tile_frames = None
+        self.halo_frames = 0
+        self.tile_batch_size = 1
+
     @property
     def scale_factor(self):
         return 2 ** len(self.encoder_blocks)
@@ -92,6 +98,55 @@ class UNet(nn.Module):
         wpad = (self.scale_factor - x.shape[3] % self.scale_factor) % self.scale_factor
         return F.pad(x, (0, wpad, 0, hpad))
 
+    def set_tiling_(self, tile_frames=None, halo_frames=128, batch_size=1):
+        """
+        Run the net on tiles of tile_frames along w in eval, each one with halo_frames of context on both sides,
+        so that the activations are bounded by the tile size instead of the input length.
+
+        The convolutions are matched once the halo covers their receptive field, but GroupNorm normalizes over
+        each tile instead of the whole input, so the output is close to the untiled one, not identical, and drifts
+        further from it the more the level of the input changes from one tile to the next.
+
+        Args:
+            tile_frames: width of the tiles, a multiple of scale_factor, None to disable tiling
+            halo_frames: context on each side, a multiple of scale_factor to keep the resampling grid aligned
+            batch_size: number of equal-width tiles per forward pass
+        """
+        for frames in (tile_frames or 0, halo_frames):
+            assert frames % self.scale_factor == 0, f"Expected a multiple of {self.scale_factor}, got {frames}"
+        assert batch_size > 0, f"batch_size must be positive, got {batch_size}"
+        self.tile_frames = tile_frames
+        self.halo_frames = halo_frames
+        self.tile_batch_size = batch_size
+
+    def _tiled_forward(self, x: Tensor):
+        """
+        Args:
+            x: (b c h w), input
+        Returns:
+            o: (b c h w), output stitched from the centers of the tiles
+        """
+        b, w = x.shape[0], x.shape[3]
+        tile, halo = self.tile_frames, self.halo_frames
+
+        # (start, end) of each center and (lo, hi) of its tile, only the edge tiles are clipped
+        groups = {}
+        for start in range(0, w, tile):
+            end = min(start + tile, w)
+            lo, hi = max(0, start - halo), min(w, end + halo)
+            groups.setdefault(hi - lo, []).append((start, end, lo, hi))
+
+        o = x.new_empty(b, self.output_dim, *x.shape[2:])
+
+        for spans in groups.values():
+            for i in range(0, len(spans), self.tile_batch_size):
+                batch = spans[i : i + self.tile_batch_size]
+                tiles = self._forward(torch.cat([x[..., lo:hi] for _, _, lo, hi in batch]))
+                for (start, end, lo, _), tile_o in zip(batch, tiles.split(b)):
+                    o[..., start:end] = tile_o[..., start - lo : end - lo]
+
+        return o
+
     def forward(self, x):
         """
         Args:
@@ -99,6 +154,11 @@ class UNet(nn.Module):
         Returns:
             o: (b c h w), output
         """
+        if self.tile_frames is not None and not self.training and x.shape[3] > self.tile_frames + 2 * self.halo_frames:
+            return self._tiled_forward(x)
+        return self._forward(x)
+
+    def _forward(self, x):
         shape = x.shape
 
         x = self.pad_to_fit(x)
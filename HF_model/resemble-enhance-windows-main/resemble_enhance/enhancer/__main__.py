@@ -1,13 +1,16 @@
 import argparse
+import json
 import random
 import time
 from pathlib import Path
 
 import torch
 import torchaudio
-from tqdm import tqdm
 
-from .inference import denoise, enhance
+from ..precision import PRECISIONS
+from .batch import get_out_path, run_sequential, run_workers
+from .inference import check_precision
+from .lcfm.cfm import SOLVER_METHODS
 
 
 @torch.inference_mode()
@@ -54,14 +57,118 @@ def main():
         "--solver",
         type=str,
         default="midpoint",
-        choices=["midpoint", "rk4", "euler"],
-        help="Numerical solver to use",
+        choices=list(SOLVER_METHODS),
+        help="Numerical solver to use, heun_euler and dopri5 adapt their step size to --atol/--rtol",
     )
     parser.add_argument(
         "--nfe",
         type=int,
         default=64,
-        help="Number of function evaluations",
+        help="Number of function evaluations, the upper bound for the adaptive solvers",
+    )
+    parser.add_argument(
+        "--atol",
+        type=float,
+        default=1e-2,
+        help="Absolute error tolerance of the adaptive solvers",
+    )
+    parser.add_argument(
+        "--rtol",
+        type=float,
+        default=1e-2,
+        help="Relative error tolerance of the adaptive solvers",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=1,
+        help="Number of chunks per forward pass, 0 to pick it from the available memory",
+    )
+    parser.add_argument(
+        "--chunk_seconds",
+        type=float,
+        default=30.0,
+        help="Length of the chunks the audio is split into",
+    )
+    parser.add_argument(
+        "--chunks_overlap",
+        type=float,
+        default=1.0,
+        help="Overlap between consecutive chunks in seconds",
+    )
+    parser.add_argument(
+        "--silence_db",
+        type=float,
+        default=None,
+        help="Skip the model on chunks quieter than this level in dBFS (e.g. -60) and output zeros for them, "
+        "leading and trailing silence of the other chunks is trimmed as well",
+    )
+    parser.add_argument(
+        "--precision",
+        type=str,
+        default="fp32",
+        choices=list(PRECISIONS),
+        help="Inference precision, bf16 needs native support (e.g. avx512_bf16 or AMX on CPU), int8 is CPU only",
+    )
+    parser.add_argument(
+        "--tile_frames",
+        type=int,
+        default=None,
+        help="Run the denoiser on tiles of this many STFT frames (a multiple of 16, e.g. 512) to bound its memory "
+        "on long chunks, the output is close to but not identical to the untiled one",
+    )
+    parser.add_argument(
+        "--cache_conditioning",
+        action="store_true",
+        help="Project the CFM condition once per chunk batch instead of once per function evaluation, "
+        "a few percent faster but needs ~390 MB more memory per 30 s chunk in the batch",
+    )
+    parser.add_argument(
+        "--check_precision",
+        action="store_true",
+        help="Before processing, compare --precision against fp32 on the first file and report the spectral distance",
+    )
+    parser.add_argument(
+        "--mmap",
+        action="store_true",
+        help="Large-file mode: read the input block by block and write into a memory-mapped float32 WAV, "
+        "so memory use does not grow with the file length (--batch_size is ignored)",
+    )
+    parser.add_argument(
+        "--stream_vocoder",
+        action="store_true",
+        help="With --mmap, vocode the crossfaded features of the chunks once with the streaming vocoder instead of "
+        "every chunk with its overlap (not supported with --silence_db)",
+    )
+    parser.add_argument(
+        "--block_seconds",
+        type=float,
+        default=10.0,
+        help="Length of the blocks read from disk in --mmap mode",
+    )
+    parser.add_argument(
+        "--raw_sr",
+        type=int,
+        default=None,
+        help="Sampling rate of headerless .raw float32 input in --mmap mode",
+    )
+    parser.add_argument(
+        "--raw_channels",
+        type=int,
+        default=1,
+        help="Number of interleaved channels of .raw input in --mmap mode",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Number of worker processes, each with its own copy of the model, 0 to process files in this process",
+    )
+    parser.add_argument(
+        "--threads_per_worker",
+        type=int,
+        default=0,
+        help="torch.set_num_threads for each worker, 0 to split the CPU cores evenly",
     )
     parser.add_argument(
         "--parallel_mode",
@@ -71,6 +178,9 @@ def main():
 
     args = parser.parse_args()
 
+    if args.stream_vocoder and args.silence_db is not None:
+        parser.error("--stream_vocoder does not support --silence_db")
+
     device = args.device
 
     if device == "cuda" and not torch.cuda.is_available():
@@ -79,8 +189,6 @@ def main():
 
     start_time = time.perf_counter()
 
-    run_dir = args.run_dir
-
     paths = sorted(args.in_dir.glob(f"**/*{args.suffix}"))
 
     if args.parallel_mode:
@@ -90,39 +198,60 @@ def main():
         print(f"No {args.suffix} files found in the following path: {args.in_dir}")
         return
 
-    pbar = tqdm(paths)
-
-    for path in pbar:
-        out_path = args.out_dir / path.relative_to(args.in_dir)
-        if args.parallel_mode and out_path.exists():
-            continue
-        pbar.set_description(f"Processing {out_path}")
-        dwav, sr = torchaudio.load(path)
-        dwav = dwav.mean(0)
-        if args.denoise_only:
-            hwav, sr = denoise(
-                dwav=dwav,
-                sr=sr,
-                device=device,
-                run_dir=args.run_dir,
-            )
-        else:
-            hwav, sr = enhance(
-                dwav=dwav,
-                sr=sr,
-                device=device,
-                nfe=args.nfe,
-                solver=args.solver,
-                lambd=args.lambd,
-                tau=args.tau,
-                run_dir=run_dir,
-            )
-        out_path.parent.mkdir(parents=True, exist_ok=True)
-        torchaudio.save(out_path, hwav[None], sr)
+    if args.parallel_mode:
+        paths = [path for path in paths if not get_out_path(args, path).exists()]
+        if len(paths) == 0:
+            print(f"Every {args.suffix} file in {args.in_dir} already has an output in {args.out_dir}")
+            return
+
+    if args.check_precision and args.precision != "fp32":
+        dwav, sr = torchaudio.load(paths[0])
+        result = check_precision(
+            dwav.mean(0),
+            sr,
+            device,
+            args.precision,
+            run_dir=args.run_dir,
+            nfe=args.nfe,
+            solver=args.solver,
+            lambd=args.lambd,
+            tau=args.tau,
+        )
+        print(
+            f"{args.precision} vs fp32 on {paths[0]}: spectral distance {result['distance']:.2f} dB, "
+            f"{result['speedup']:.2f}x speedup"
+        )
+
+    if args.workers > 0:
+        records = run_workers(args, paths, device)
+    else:
+        records = run_sequential(args, paths, device)
+
+    # Per-file timings, appended so that several jobs can share the output folder
+    args.out_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = args.out_dir / "manifest.jsonl"
+
+    n_done = n_failed = n_skipped = 0
+    with open(manifest_path, "a") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            if "error" in record:
+                n_failed += 1
+                print(f"Failed to process {record['path']}: {record['error']}")
+            elif record.get("skipped"):
+                n_skipped += 1
+            else:
+                n_done += 1
 
     # Cool emoji effect saying the job is done
     elapsed_time = time.perf_counter() - start_time
-    print(f"🌟 Enhancement done! {len(paths)} files processed in {elapsed_time:.2f}s")
+    print(f"🌟 Enhancement done! {n_done} files processed in {elapsed_time:.2f}s")
+    if n_skipped:
+        print(f"{n_skipped} files were skipped, another job wrote them first")
+    if n_failed:
+        print(f"{n_failed} files failed, see {manifest_path}")
+    print(f"Throughput: {n_done / elapsed_time * 3600:.1f} files/hour, timings in {manifest_path}")
 
 
 if __name__ == "__main__":
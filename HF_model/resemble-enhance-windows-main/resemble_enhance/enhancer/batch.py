@@ -0,0 +1,236 @@
+import multiprocessing as mp
+import os
+import queue
+import time
+
+import torch
+import torchaudio
+from tqdm import tqdm
+
+from ..wavio import MemmapWavWriter, open_blocks, resampled_length
+from .inference import (
+    convert_checkpoint,
+    denoise,
+    denoise_stream,
+    enhance,
+    enhance_stream,
+    get_denoiser,
+    get_enhancer,
+    warm,
+    warm_denoiser,
+)
+
+
+def _process_mmap(args, path, out_path, device, wav_rate):
+    """
+    Returns:
+        length: number of output samples
+    """
+    sr, length, blocks = open_blocks(
+        path,
+        block_seconds=args.block_seconds,
+        raw_sr=args.raw_sr,
+        raw_channels=args.raw_channels,
+    )
+
+    if args.denoise_only:
+        hwavs = denoise_stream(
+            blocks,
+            sr=sr,
+            device=device,
+            run_dir=args.run_dir,
+            chunk_seconds=args.chunk_seconds,
+            chunks_overlap=args.chunks_overlap,
+            silence_db=args.silence_db,
+            precision=args.precision,
+            tile_frames=args.tile_frames,
+        )
+    else:
+        hwavs = enhance_stream(
+            blocks,
+            sr=sr,
+            device=device,
+            nfe=args.nfe,
+            solver=args.solver,
+            lambd=args.lambd,
+            tau=args.tau,
+            atol=args.atol,
+            rtol=args.rtol,
+            run_dir=args.run_dir,
+            chunk_seconds=args.chunk_seconds,
+            chunks_overlap=args.chunks_overlap,
+            silence_db=args.silence_db,
+            precision=args.precision,
+            tile_frames=args.tile_frames,
+            cache_conditioning=args.cache_conditioning,
+            stream_vocoder=args.stream_vocoder,
+        )
+
+    with MemmapWavWriter(out_path, resampled_length(length, sr, wav_rate), wav_rate) as writer:
+        for hwav in hwavs:
+            writer.write(hwav)
+
+    return writer.length
+
+
+def get_out_path(args, path):
+    out_path = args.out_dir / path.relative_to(args.in_dir)
+    if args.mmap:
+        out_path = out_path.with_suffix(".wav")
+    return out_path
+
+
+def _process_file(args, path, out_path, device):
+    """
+    Enhance a single file, the output is written to a temporary file first and renamed into place,
+    so out_path never holds a partial result.
+
+    Returns:
+        duration: length of the output in seconds
+    """
+    batch_size = args.batch_size or None
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = out_path.with_name(f".{out_path.stem}.{os.getpid()}.tmp{out_path.suffix}")
+
+    try:
+        if args.mmap:
+            get_model = get_denoiser if args.denoise_only else get_enhancer
+            wav_rate = get_model(args.run_dir, device, precision=args.precision).hp.wav_rate
+            length = _process_mmap(args, path, tmp_path, device, wav_rate=wav_rate)
+            duration = length / wav_rate
+        else:
+            dwav, sr = torchaudio.load(path)
+            dwav = dwav.mean(0)
+            if args.denoise_only:
+                hwav, sr = denoise(
+                    dwav=dwav,
+                    sr=sr,
+                    device=device,
+                    run_dir=args.run_dir,
+                    batch_size=batch_size,
+                    chunk_seconds=args.chunk_seconds,
+                    chunks_overlap=args.chunks_overlap,
+                    silence_db=args.silence_db,
+                    precision=args.precision,
+                    tile_frames=args.tile_frames,
+                )
+            else:
+                hwav, sr = enhance(
+                    dwav=dwav,
+                    sr=sr,
+                    device=device,
+                    nfe=args.nfe,
+                    solver=args.solver,
+                    lambd=args.lambd,
+                    tau=args.tau,
+                    atol=args.atol,
+                    rtol=args.rtol,
+                    run_dir=args.run_dir,
+                    batch_size=batch_size,
+                    chunk_seconds=args.chunk_seconds,
+                    chunks_overlap=args.chunks_overlap,
+                    silence_db=args.silence_db,
+                    precision=args.precision,
+                    tile_frames=args.tile_frames,
+                    cache_conditioning=args.cache_conditioning,
+                )
+            torchaudio.save(tmp_path, hwav[None], sr)
+            duration = hwav.shape[-1] / sr
+        os.replace(tmp_path, out_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    return duration
+
+
+def _warm(args, device):
+    if args.denoise_only:
+        warm_denoiser(args.run_dir, device, precision=args.precision)
+    else:
+        warm(args.run_dir, device, precision=args.precision)
+
+
+def _run_task(args, path, device, worker):
+    out_path = get_out_path(args, path)
+    record = dict(path=str(path), out_path=str(out_path), worker=worker)
+    if args.parallel_mode and out_path.exists():
+        # Another job finished it since the paths were listed
+        record["skipped"] = True
+        return record
+    start_time = time.perf_counter()
+    try:
+        record["duration"] = _process_file(args, path, out_path, device)
+    except Exception as e:
+        record["error"] = repr(e)
+    record["elapsed"] = time.perf_counter() - start_time
+    return record
+
+
+@torch.inference_mode()
+def _worker(rank, args, device, num_threads, tasks, results):
+    torch.set_num_threads(num_threads)
+    _warm(args, device)
+    results.put(None)  # Ready
+    while (path := tasks.get()) is not None:
+        results.put(_run_task(args, path, device, worker=rank))
+
+
+def run_workers(args, paths, device):
+    """
+    Process paths with args.workers processes, each loads the model once and pulls files from a shared queue.
+
+    This lives outside of __main__.py because spawned processes cannot import a package's __main__.
+    """
+    num_threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // args.workers)
+
+    # Convert once up front, the workers then map the same file and share its pages. The denoiser alone is read
+    # from the checkpoint directly, converting would build the whole enhancer
+    if not args.denoise_only:
+        convert_checkpoint(args.run_dir)
+
+    ctx = mp.get_context("spawn")
+    tasks = ctx.Queue()
+    results = ctx.Queue()
+
+    for path in paths:
+        tasks.put(path)
+    for _ in range(args.workers):
+        tasks.put(None)
+
+    workers = []
+    for rank in range(args.workers):
+        worker_device = device
+        if device == "cuda":
+            worker_device = f"cuda:{rank % torch.cuda.device_count()}"
+        worker = ctx.Process(target=_worker, args=(rank, args, worker_device, num_threads, tasks, results))
+        worker.start()
+        workers.append(worker)
+
+    ready = 0
+    pbar = tqdm(total=len(paths))
+    while pbar.n < len(paths):
+        if not any(worker.is_alive() for worker in workers) and results.empty():
+            raise RuntimeError("All workers exited before the queue was drained")
+        try:
+            record = results.get(timeout=1)
+        except queue.Empty:
+            continue
+        if record is None:
+            ready += 1
+            pbar.set_description(f"{ready}/{args.workers} workers ready")
+            continue
+        pbar.update(1)
+        yield record
+    pbar.close()
+
+    for worker in workers:
+        worker.join()
+
+
+def run_sequential(args, paths, device):
+    _warm(args, device)
+    pbar = tqdm(paths)
+    for path in pbar:
+        pbar.set_description(f"Processing {get_out_path(args, path)}")
+        yield _run_task(args, path, device, worker=0)
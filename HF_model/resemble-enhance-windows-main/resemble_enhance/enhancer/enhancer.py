@@ -1,13 +1,12 @@
 import logging
 
 import matplotlib.pyplot as plt
-import pandas as pd
 import torch
 from torch import Tensor, nn
 from torch.distributions import Beta
 
-from ..common import Normalizer
-from ..denoiser.inference import load_denoiser
+from ..common import Normalizer, diagnostics_enabled
+from ..denoiser.inference import build_denoiser
 from ..melspec import MelSpectrogram
 from ..utils.distributed import global_leader_only
 from ..utils.train_loop import TrainLoop
@@ -32,6 +31,11 @@ def _normalize_wav(x: Tensor):
 
 
 class Enhancer(nn.Module):
+    # Peak memory of an eval forward pass per input sample in fp32, for auto_batch_size. Measured on CPU as the
+    # VmHWM increase over the RSS after a warm-up pass: 3.4-5.0 KB for 5-20 s chunks and batches of 1-2 (shorter
+    # chunks cost more per sample), rounded up
+    peak_bytes_per_sample = 5 * 1024
+
     def __init__(self, hp: HParams):
         super().__init__()
         self.hp = hp
@@ -60,7 +64,7 @@ class Enhancer(nn.Module):
 
         self.mel_fn = MelSpectrogram(hp)
         self.vocoder = UnivNet(self.hp, vocoder_input_dim)
-        self.denoiser = load_denoiser(self.hp.denoiser_run_dir, "cpu")
+        self.denoiser = build_denoiser(self.hp.denoiser_run_dir, "cpu")
         self.normalizer = Normalizer()
 
         self._eval_lambd = 0.0
@@ -72,8 +76,9 @@ class Enhancer(nn.Module):
             pretrained_path = self.hp.enhancer_stage1_run_dir / "ds/G/default/mp_rank_00_model_states.pt"
             self._load_pretrained(pretrained_path)
 
-        logger.info(f"{self.__class__.__name__} summary")
-        logger.info(f"{self.summarize()}")
+        if diagnostics_enabled():
+            logger.info(f"{self.__class__.__name__} summary")
+            logger.info(f"{self.summarize()}")
 
     def _load_pretrained(self, path):
         # Clone is necessary as otherwise it holds a reference to the original model
@@ -86,6 +91,8 @@ class Enhancer(nn.Module):
         logger.info(f"Loaded pretrained model from {path}")
 
     def summarize(self):
+        import pandas as pd
+
         npa_train = lambda m: sum(p.numel() for p in m.parameters() if p.requires_grad)
         npa = lambda m: sum(p.numel() for p in m.parameters())
         rows = []
@@ -130,18 +137,58 @@ class Enhancer(nn.Module):
             return self.denoiser(x, y)
         return x
 
-    def configurate_(self, nfe, solver, lambd, tau):
+    def configurate_(self, nfe, solver, lambd, tau, ts=None, atol=None, rtol=None, cache_conditioning=False):
         """
         Args:
-            nfe: number of function evaluations
+            nfe: number of function evaluations, the upper bound for the adaptive solvers
             solver: solver method
             lambd: denoiser strength [0, 1]
             tau: prior temperature [0, 1]
+            ts: optional custom time steps for the CFM solver, overrides nfe
+            atol: absolute error tolerance of the adaptive solvers, None for the default
+            rtol: relative error tolerance of the adaptive solvers, None for the default
+            cache_conditioning: project the CFM condition once per solve, see CFM.cache_conditioning
         """
-        self.lcfm.cfm.solver.configurate_(nfe, solver)
+        self.lcfm.cfm.solver.configurate_(nfe, solver, ts=ts, atol=atol, rtol=rtol)
+        self.lcfm.cfm.cache_conditioning = cache_conditioning
         self.lcfm.eval_tau_(tau)
         self._eval_lambd = lambd
 
+    def _eval_mels(self, x: Tensor, z: Tensor | None = None):
+        """
+        Args:
+            x: (b t), normalized mix wavs
+            z: (b t), normalized fg distorted wavs
+        Returns:
+            x_mel_original: (b d t), normalized mels of x
+            x_mel_denoised: (b d t), the same mixed with the mels of the denoised x by the eval lambd
+        """
+        lambd = self._eval_lambd
+
+        if self.hp.lcfm_training_mode != "cfm" or lambd == 0:
+            x_mel_original = self.normalizer(self.to_mel(x), update=False)
+            return x_mel_original, x_mel_original
+
+        # One mel and normalizer pass over the input and the denoised wavs
+        x_denoised = self._may_denoise(x, z).to(x)
+        x_mel_original, x_mel_denoised = self.normalizer(self.to_mel(torch.cat([x, x_denoised])), update=False).chunk(2)
+
+        return x_mel_original, lambd * x_mel_denoised + (1 - lambd) * x_mel_original
+
+    def features(self, x: Tensor):
+        """
+        The vocoder input of forward in eval, for running the vocoder separately (see UnivNetStream).
+
+        Args:
+            x: (b t), mix wavs
+        Returns:
+            h: (b d t // hop_size), vocoder features
+        """
+        assert not self.training, "features is only available in eval"
+        x = _normalize_wav(x)
+        x_mel_original, x_mel_denoised = self._eval_mels(x)
+        return self.lcfm(x_mel_denoised, ψ0=x_mel_original)
+
     def forward(self, x: Tensor, y: Tensor | None = None, z: Tensor | None = None):
         """
         Args:
@@ -161,25 +208,18 @@ class Enhancer(nn.Module):
         y = _maybe(_normalize_wav)(y)
         z = _maybe(_normalize_wav)(z)
 
-        x_mel_original = self.normalizer(self.to_mel(x), update=False)  # (b d t)
-
-        if self.hp.lcfm_training_mode == "cfm":
-            if self.training:
-                lambd = Beta(0.2, 0.2).sample(x.shape[:1]).to(x.device)
-                lambd = lambd[:, None, None]
-                x_mel_denoised = self.normalizer(self.to_mel(self._may_denoise(x, z)), update=False)
-                x_mel_denoised = x_mel_denoised.detach()
-                x_mel_denoised = lambd * x_mel_denoised + (1 - lambd) * x_mel_original
-                self._visualize(x_mel_original, x_mel_denoised)
-            else:
-                lambd = self._eval_lambd
-                if lambd == 0:
-                    x_mel_denoised = x_mel_original
-                else:
-                    x_mel_denoised = self.normalizer(self.to_mel(self._may_denoise(x, z)), update=False)
-                    x_mel_denoised = x_mel_denoised.detach()
-                    x_mel_denoised = lambd * x_mel_denoised + (1 - lambd) * x_mel_original
+        if not self.training:
+            x_mel_original, x_mel_denoised = self._eval_mels(x, z)
+        elif self.hp.lcfm_training_mode == "cfm":
+            x_mel_original = self.normalizer(self.to_mel(x), update=False)  # (b d t)
+            lambd = Beta(0.2, 0.2).sample(x.shape[:1]).to(x.device)
+            lambd = lambd[:, None, None]
+            x_mel_denoised = self.normalizer(self.to_mel(self._may_denoise(x, z)), update=False)
+            x_mel_denoised = x_mel_denoised.detach()
+            x_mel_denoised = lambd * x_mel_denoised + (1 - lambd) * x_mel_original
+            self._visualize(x_mel_original, x_mel_denoised)
         else:
+            x_mel_original = self.normalizer(self.to_mel(x), update=False)  # (b d t)
             x_mel_denoised = x_mel_original
 
         y_mel = _maybe(self.to_mel)(y)  # (b d t)
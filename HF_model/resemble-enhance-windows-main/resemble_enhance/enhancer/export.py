@@ -0,0 +1,141 @@
+import argparse
+import json
+import logging
+import time
+import warnings
+from pathlib import Path
+
+import torch
+
+from .inference import _prepare_denoiser, _prepare_enhancer
+from .lcfm.cfm import SOLVER_METHODS
+
+logger = logging.getLogger(__name__)
+
+KINDS = ("denoise", "enhance")
+
+
+def export(
+    out_path,
+    run_dir=None,
+    kind="enhance",
+    device="cpu",
+    chunk_seconds=30.0,
+    overlap_seconds=1.0,
+    batch_size=1,
+    nfe=32,
+    solver="midpoint",
+    lambd=0.5,
+    tau=0.5,
+    npad=441,
+):
+    """
+    Trace the denoiser or the whole enhancer on fixed (batch_size, chunk + npad) chunks into a frozen TorchScript
+    file that resemble_enhance.runtime.ExportedModel runs with torch alone.
+
+    Weight norm is folded and the solver schedule is unrolled into the graph. The eval noise (see randn_per_row)
+    is cached by a warm-up pass, so the trace holds it as a constant and the artifact is deterministic.
+
+    Returns:
+        meta: the metadata stored next to the graph
+    """
+    assert kind in KINDS, f"kind must be in {KINDS}, got {kind}"
+    assert solver in SOLVER_METHODS, f"solver must be in {SOLVER_METHODS}, got {solver}"
+
+    # A private copy, configuring the registry one would change the settings of every other caller in the process
+    if kind == "enhance":
+        model = _prepare_enhancer(run_dir, device, torch.float32, "fp32")
+        model.configurate_(nfe=nfe, solver=solver, lambd=lambd, tau=tau)
+        assert not model.lcfm.cfm.solver.adaptive, f"Adaptive solvers cannot be unrolled, got {solver}"
+    else:
+        model = _prepare_denoiser(run_dir, device, torch.float32, "fp32")
+
+    wav_rate = model.hp.wav_rate
+    chunk_length = int(wav_rate * chunk_seconds)
+    overlap_length = int(wav_rate * overlap_seconds)
+    assert 0 <= overlap_length < chunk_length, "The overlap must be shorter than the chunks"
+
+    x = torch.randn(batch_size, chunk_length + npad, device=device) * 0.1
+
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.simplefilter("ignore", torch.jit.TracerWarning)
+        expected = model(x)  # Also caches the noise
+        start_time = time.perf_counter()
+        traced = torch.jit.trace(model, x, check_trace=False)
+        traced = torch.jit.freeze(traced.eval())
+        logger.info(f"Traced {kind} in {time.perf_counter() - start_time:.1f}s")
+
+    meta = dict(
+        kind=kind,
+        device=str(device),
+        wav_rate=wav_rate,
+        chunk_length=chunk_length,
+        overlap_length=overlap_length,
+        npad=npad,
+        batch_size=batch_size,
+        nfe=nfe if kind == "enhance" else None,
+        solver=solver if kind == "enhance" else None,
+        lambd=lambd if kind == "enhance" else None,
+        tau=tau if kind == "enhance" else None,
+    )
+
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    torch.jit.save(traced, out_path, _extra_files={"meta.json": json.dumps(meta)})
+
+    with torch.inference_mode():
+        error = (torch.jit.load(out_path, map_location=device)(x) - expected).abs().max().item()
+    logger.info(f"Saved {out_path}, max abs deviation from eager {error:.2e}")
+    assert error < 1e-3, f"The exported {kind} deviates from the eager model by {error}"
+
+    return meta
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("out_path", type=Path, help="Path of the exported TorchScript file")
+    parser.add_argument(
+        "--run_dir",
+        type=Path,
+        default=None,
+        help="Path to the enhancer run folder, if None, use the default model",
+    )
+    parser.add_argument("--kind", type=str, default="enhance", choices=list(KINDS), help="Pipeline to export")
+    parser.add_argument("--device", type=str, default="cpu", help="Device the artifact runs on")
+    parser.add_argument("--chunk_seconds", type=float, default=30.0, help="Fixed length of the chunks")
+    parser.add_argument("--chunks_overlap", type=float, default=1.0, help="Overlap between chunks in seconds")
+    parser.add_argument("--batch_size", type=int, default=1, help="Fixed number of chunks per forward pass")
+    parser.add_argument(
+        "--solver",
+        type=str,
+        default="midpoint",
+        choices=[m for m in SOLVER_METHODS if m not in ("heun_euler", "dopri5")],
+        help="Numerical solver, unrolled into the graph",
+    )
+    parser.add_argument("--nfe", type=int, default=32, help="Number of function evaluations")
+    parser.add_argument("--lambd", type=float, default=0.5, help="Denoise strength for enhancement (0.0 to 1.0)")
+    parser.add_argument("--tau", type=float, default=0.5, help="CFM prior temperature (0.0 to 1.0)")
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    meta = export(
+        args.out_path,
+        run_dir=args.run_dir,
+        kind=args.kind,
+        device=args.device,
+        chunk_seconds=args.chunk_seconds,
+        overlap_seconds=args.chunks_overlap,
+        batch_size=args.batch_size,
+        nfe=args.nfe,
+        solver=args.solver,
+        lambd=args.lambd,
+        tau=args.tau,
+    )
+
+    print(json.dumps(meta, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,25 @@
 import logging
-from functools import cache
+import pickle
+import threading
+import time
+import weakref
+from collections import defaultdict
+from contextlib import ExitStack
 
 import torch
 
-from ..inference import inference
+from ..checkpoint import assign_, drop_parametrizations_, load_flat, meta_parameters, save_flat
+from ..common import inference_profile
+from ..denoiser.denoiser import Denoiser
+from ..denoiser.hparams import HParams as DenoiserHParams
+from ..inference import inference, inference_stream, inference_stream_vocoded, remove_weight_norm_recursively
+from ..precision import PRECISIONS, bf16_supported, quantize_int8_, set_autocast_, spectral_distance
+from ..registry import ModelRegistry
 from .download import download
-from .train import Enhancer, HParams
+from .enhancer import Enhancer
+from .hparams import HParams
+from .lcfm.cfm import SOLVER_METHODS
+from .univnet import UnivNetStream
 
 import platform
 import pathlib
@@ -19,31 +33,517 @@ if platform.system() == 'Windows':
 logger = logging.getLogger(__name__)
 
 
+def _load_state_dict(path, prefix=""):
+    """
+    Read the model states of a DeepSpeed checkpoint, memory-mapped when possible so that only the tensors under
+    prefix are read from disk.
+
+    Returns:
+        state_dict: the tensors under prefix, with the prefix stripped
+    """
+    try:
+        state_dict = torch.load(str(path), map_location="cpu", mmap=True, weights_only=True)["module"]
+    except (RuntimeError, pickle.UnpicklingError) as e:
+        # Legacy (non-zip) checkpoints cannot be mapped, and DeepSpeed may pickle more than tensors
+        logger.debug(f"Cannot map {path}, loading it whole: {e}")
+        state_dict = torch.load(path, map_location="cpu")["module"]
+    return {k[len(prefix) :]: v for k, v in state_dict.items() if k.startswith(prefix)}
+
+
+def _checkpoint_path(run_dir):
+    return run_dir / "ds" / "G" / "default" / "mp_rank_00_model_states.pt"
+
+
+def _flat_path(run_dir):
+    """
+    Returns:
+        path: the flat file of the run if it is up to date (newer than the checkpoint), None otherwise
+    """
+    src_path = _checkpoint_path(run_dir)
+    path = src_path.with_suffix(".safetensors")
+    if path.exists() and path.stat().st_mtime >= src_path.stat().st_mtime:
+        return path
+    return None
+
+
+def _convert(run_dir):
+    """
+    Build the enhancer of a run from its DeepSpeed checkpoint with weight norm folded, and save it as the flat
+    file unless the run folder is read-only.
+
+    Returns:
+        enhancer: the converted enhancer
+    """
+    src_path = _checkpoint_path(run_dir)
+    path = src_path.with_suffix(".safetensors")
+
+    logger.info(f"Converting {src_path} to {path}")
+    with inference_profile():
+        enhancer = Enhancer(HParams.load(run_dir))
+    enhancer.load_state_dict(_load_state_dict(src_path))
+    remove_weight_norm_recursively(enhancer)
+    tensors = dict(enhancer.named_parameters(remove_duplicate=False))
+    tensors.update(enhancer.named_buffers(remove_duplicate=False))
+    try:
+        save_flat(tensors, path, metadata=dict(source=src_path.name, weight_norm="folded"))
+    except OSError as e:
+        logger.warning(f"Cannot write {path}, loading from {src_path} in place instead: {e}")
+
+    return enhancer
+
+
+def convert_checkpoint(run_dir=None):
+    """
+    Convert the DeepSpeed checkpoint of a run once into a flat file next to it (see resemble_enhance.checkpoint),
+    with weight norm folded and the non-persistent buffers included, so that the models can be built directly
+    on a read-only mapping of it, shared by every process.
+
+    Returns:
+        path: the flat file, reused as long as it is newer than the checkpoint, None if the run folder is read-only
+    """
+    if run_dir is None:
+        run_dir = download()
+    if _flat_path(run_dir) is None:
+        _convert(run_dir)
+    return _flat_path(run_dir)
+
+
 def load_enhancer(run_dir, device):
+    """
+    Returns:
+        enhancer: in eval mode with weight norm folded, on CPU its tensors are views of the mapped flat file
+            (converted first if needed)
+    """
     if run_dir is None:
         run_dir = download()
-    hp = HParams.load(run_dir)
-    enhancer = Enhancer(hp)
-    path = run_dir / "ds" / "G" / "default" / "mp_rank_00_model_states.pt"
-    state_dict = torch.load(path, map_location="cpu")["module"]
-    enhancer.load_state_dict(state_dict)
+    path = _flat_path(run_dir)
+    if path is None:
+        enhancer = _convert(run_dir)  # Already loaded, whether or not the flat file could be written
+    else:
+        tensors, _ = load_flat(path)
+        with meta_parameters():
+            enhancer = Enhancer(HParams.load(run_dir))
+        drop_parametrizations_(enhancer)  # Folded in the flat file
+        assign_(enhancer, tensors)
     enhancer.eval()
     enhancer.to(device)
     return enhancer
 
 
+def load_denoiser(run_dir, device):
+    """
+    Build only the denoiser of an enhancer run, with the denoiser.* tensors of its flat file if there is one,
+    read from the mapped DeepSpeed checkpoint otherwise, so that the rest of the enhancer is never built.
+    """
+    if run_dir is None:
+        run_dir = download()
+    hp = HParams.load(run_dir)
+    # Same hparams as the denoiser built by Enhancer.__init__
+    denoiser_run_dir = hp.denoiser_run_dir
+    denoiser_hp = DenoiserHParams() if denoiser_run_dir is None else DenoiserHParams.load(denoiser_run_dir)
+    path = _flat_path(run_dir)
+    if path is None:
+        denoiser = Denoiser(denoiser_hp)
+        denoiser.load_state_dict(_load_state_dict(_checkpoint_path(run_dir), prefix="denoiser."))
+    else:
+        tensors, _ = load_flat(path)
+        tensors = {k.removeprefix("denoiser."): v for k, v in tensors.items() if k.startswith("denoiser.")}
+        with meta_parameters():
+            denoiser = Denoiser(denoiser_hp)
+        assign_(denoiser, tensors)
+    denoiser.eval()
+    denoiser.to(device)
+    return denoiser
+
+
+def _set_precision_(model: Enhancer | Denoiser, device, precision):
+    """
+    Args:
+        precision: "fp32", "bf16" (autocast, fp32 if the device has no native bf16) or
+            "int8" (CPU only, dynamic quantization of the CFM and IRMAE convolutions)
+    """
+    assert precision in PRECISIONS, f"precision must be in {PRECISIONS}, got {precision}"
+
+    denoiser = model.denoiser if isinstance(model, Enhancer) else model
+
+    if precision == "bf16":
+        if bf16_supported(device):
+            set_autocast_(model, torch.bfloat16)
+            set_autocast_(denoiser, torch.bfloat16)
+        else:
+            logger.warning(f"{device} has no native bf16 support, using fp32")
+
+    if precision == "int8":
+        assert torch.device(device).type == "cpu", f"int8 is only supported on CPU, got {device}"
+        if isinstance(model, Enhancer):
+            ae = model.lcfm.ae
+            irms = list(ae.encoder)[-1 - ae.num_irms : -1]  # Folded into one matrix by the fused encode
+            quantize_int8_(model.lcfm, skip=irms)
+        # The vocoder convolutions are too narrow (96 channels at the audio rate) to gain from int8,
+        # and the denoiser UNet is made of Conv2d, both stay in fp32
+
+
+def _prepare_enhancer(run_dir, device, dtype, precision):
+    with inference_profile():
+        enhancer = load_enhancer(run_dir, device)
+    remove_weight_norm_recursively(enhancer)
+    enhancer.vocoder.set_lvc_impl_("matmul")
+    enhancer.vocoder.fused_kernel_predictors = True
+    enhancer.vocoder.set_polyphase_()
+    enhancer.lcfm.ae.fused_inference = True
+    enhancer.to(dtype=dtype)
+    _set_precision_(enhancer, device, precision)
+    return enhancer
+
+
+def _prepare_denoiser(run_dir, device, dtype, precision):
+    with inference_profile():
+        denoiser = load_denoiser(run_dir, device)
+    denoiser.to(dtype=dtype)
+    _set_precision_(denoiser, device, precision)
+    return denoiser
+
+
+_registry = ModelRegistry(_prepare_enhancer)
+_denoiser_registry = ModelRegistry(_prepare_denoiser)
+
+
+def get_enhancer(run_dir, device, dtype=torch.float32, precision="fp32"):
+    """
+    Returns a cached, ready-to-run enhancer (weight norm removed) for the given run.
+
+    Args:
+        precision: inference precision, see PRECISIONS
+    """
+    return _registry.get(run_dir, device, dtype, precision)
+
+
+def get_denoiser(run_dir, device, dtype=torch.float32, precision="fp32"):
+    """
+    Returns the denoiser of the given run, without building the rest of the enhancer unless it is already loaded.
+    """
+    enhancer = _registry.peek(run_dir, device, dtype, precision)
+    if enhancer is not None:
+        return enhancer.denoiser
+    return _denoiser_registry.get(run_dir, device, dtype, precision)
+
+
+_model_locks = weakref.WeakKeyDictionary()
+_model_locks_lock = threading.Lock()
+
+
+def _model_lock(model):
+    """
+    The lock that serializes the configuration and the forward passes of a model shared through the registries.
+    """
+    with _model_locks_lock:
+        if model not in _model_locks:
+            _model_locks[model] = threading.RLock()
+        return _model_locks[model]
+
+
+class _Configured:
+    """
+    A shared model run with per-call settings: configure is applied before every forward pass while holding the
+    locks of the model, so that callers sharing it never run with each other's settings.
+    """
+
+    def __init__(self, model, configure, modules, collect=None, forward=None):
+        """
+        Args:
+            collect: called with the model after each forward pass, still under its locks, returns counters
+                to sum into stats
+            forward: called instead of the model, e.g. one of its methods
+        """
+        self.model = model
+        self._configure = configure
+        self._collect = collect
+        self._forward = model if forward is None else forward
+        self._locks = [_model_lock(module) for module in modules]
+        self.stats = defaultdict(int)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)  # hp, autocast_dtype, peak_bytes_per_sample, ...
+
+    def __call__(self, x):
+        with ExitStack() as stack:
+            for lock in self._locks:
+                stack.enter_context(lock)
+            self._configure(self.model)
+            o = self._forward(x)
+            if self._collect is not None:
+                for k, v in self._collect(self.model).items():
+                    self.stats[k] += v
+            return o
+
+
+def _configured_denoiser(denoiser, tile_frames):
+    return _Configured(denoiser, lambda m: m.set_tiling_(tile_frames), [denoiser])
+
+
+def _configured_enhancer(
+    enhancer,
+    nfe,
+    solver,
+    lambd,
+    tau,
+    atol,
+    rtol,
+    tile_frames,
+    cache_conditioning=False,
+    features=False,
+):
+    """
+    Args:
+        features: output the vocoder features (Enhancer.features) instead of the waveform
+    """
+
+    def configure(m):
+        m.configurate_(
+            nfe=nfe,
+            solver=solver,
+            lambd=lambd,
+            tau=tau,
+            atol=atol,
+            rtol=rtol,
+            cache_conditioning=cache_conditioning,
+        )
+        m.denoiser.set_tiling_(tile_frames)
+
+    def collect(m):
+        return dict(nfe_used=m.lcfm.cfm.solver.nfe_used or 0)
+
+    # The denoiser may also be handed out on its own by get_denoiser, always locked after the enhancer
+    forward = enhancer.features if features else None
+    return _Configured(enhancer, configure, [enhancer, enhancer.denoiser], collect=collect, forward=forward)
+
+
+def warm(run_dir, device, dtype=torch.float32, precision="fp32"):
+    return _registry.warm(run_dir, device, dtype, precision)
+
+
+def warm_denoiser(run_dir, device, dtype=torch.float32, precision="fp32"):
+    return get_denoiser(run_dir, device, dtype, precision)
+
+
+def unload(run_dir=None, device=None, dtype=torch.float32, precision="fp32"):
+    _registry.unload(run_dir, device, dtype, precision)
+    _denoiser_registry.unload(run_dir, device, dtype, precision)
+
+
+@torch.inference_mode()
+def denoise(
+    dwav,
+    sr,
+    device,
+    run_dir=None,
+    batch_size=1,
+    chunk_seconds=30.0,
+    chunks_overlap=1.0,
+    silence_db=None,
+    precision="fp32",
+    tile_frames=None,
+):
+    """
+    Args:
+        tile_frames: run the denoiser UNet on tiles of this many STFT frames, see UNet.set_tiling_
+    """
+    denoiser = get_denoiser(run_dir, device, precision=precision)
+    return inference(
+        model=_configured_denoiser(denoiser, tile_frames),
+        dwav=dwav,
+        sr=sr,
+        device=device,
+        batch_size=batch_size,
+        chunk_seconds=chunk_seconds,
+        overlap_seconds=chunks_overlap,
+        silence_db=silence_db,
+    )
+
+
+@torch.inference_mode()
+def enhance(
+    chunk_seconds,
+    chunks_overlap,
+    dwav,
+    sr,
+    device,
+    nfe=32,
+    solver="midpoint",
+    lambd=0.5,
+    tau=0.5,
+    run_dir=None,
+    batch_size=1,
+    atol=None,
+    rtol=None,
+    silence_db=None,
+    precision="fp32",
+    tile_frames=None,
+    cache_conditioning=False,
+):
+    """
+    Args:
+        nfe: number of function evaluations, the upper bound for the adaptive solvers (heun_euler, dopri5)
+        atol: absolute error tolerance of the adaptive solvers, None for the default
+        rtol: relative error tolerance of the adaptive solvers, None for the default
+        silence_db: skip the model on chunks quieter than this level (dBFS), None to process everything
+        precision: "fp32", "bf16" or "int8", see _set_precision_
+        tile_frames: run the denoiser UNet on tiles of this many STFT frames to bound its memory, see
+            UNet.set_tiling_, None to run it on whole chunks
+        cache_conditioning: project the CFM condition once per chunk batch instead of once per function
+            evaluation, a few percent faster but holds the projections of every WN layer (~390 MB per 30 s chunk)
+            on top of what batch_size=None plans for
+    """
+    assert 0 < nfe <= 128, f"nfe must be in (0, 128], got {nfe}"
+    assert solver in SOLVER_METHODS, f"solver must be in {SOLVER_METHODS}, got {solver}"
+    assert 0 <= lambd <= 1, f"lambd must be in [0, 1], got {lambd}"
+    assert 0 <= tau <= 1, f"tau must be in [0, 1], got {tau}"
+    enhancer = get_enhancer(run_dir, device, precision=precision)
+    model = _configured_enhancer(enhancer, nfe, solver, lambd, tau, atol, rtol, tile_frames, cache_conditioning)
+    hwav, sr = inference(
+        model=model,
+        chunk_seconds=chunk_seconds,
+        overlap_seconds=chunks_overlap,
+        dwav=dwav,
+        sr=sr,
+        device=device,
+        batch_size=batch_size,
+        silence_db=silence_db,
+    )
+    logger.info(f"CFM used {model.stats['nfe_used']} function evaluations ({solver}, at most {nfe} per pass)")
+    return hwav, sr
+
+
+@torch.inference_mode()
+def check_precision(
+    dwav,
+    sr,
+    device,
+    precision,
+    run_dir=None,
+    seconds=10.0,
+    nfe=32,
+    solver="midpoint",
+    lambd=0.5,
+    tau=0.5,
+):
+    """
+    Enhance the first seconds of dwav in fp32 and in the given precision and compare the outputs.
+
+    Returns:
+        distance: spectral_distance between the two outputs in dB
+        speedup: fp32 time over the time in the given precision
+    """
+    dwav = dwav[: int(seconds * sr)]
+    outputs, elapsed = {}, {}
+    for p in ("fp32", precision):
+        warm(run_dir, device, precision=p)
+        start_time = time.perf_counter()
+        outputs[p], wav_rate = enhance(
+            chunk_seconds=seconds,
+            chunks_overlap=1.0,
+            dwav=dwav,
+            sr=sr,
+            device=device,
+            nfe=nfe,
+            solver=solver,
+            lambd=lambd,
+            tau=tau,
+            run_dir=run_dir,
+            precision=p,
+        )
+        elapsed[p] = time.perf_counter() - start_time
+    distance = spectral_distance(outputs["fp32"], outputs[precision], sr=wav_rate)
+    return dict(distance=distance, speedup=elapsed["fp32"] / elapsed[precision])
+
+
 @torch.inference_mode()
-def denoise(dwav, sr, device, run_dir=None):
-    enhancer = load_enhancer(run_dir, device)
-    return inference(model=enhancer.denoiser, dwav=dwav, sr=sr, device=device)
+def denoise_stream(
+    blocks,
+    sr,
+    device,
+    run_dir=None,
+    chunk_seconds=30.0,
+    chunks_overlap=1.0,
+    silence_db=None,
+    precision="fp32",
+    tile_frames=None,
+):
+    """
+    Args:
+        blocks: iterable of (t) or (t c) waveform blocks, e.g. from soundfile.blocks
+    Yields:
+        hwav: (t'), consecutive pieces of the denoised signal at hp.wav_rate
+    """
+    denoiser = get_denoiser(run_dir, device, precision=precision)
+    yield from inference_stream(
+        model=_configured_denoiser(denoiser, tile_frames),
+        blocks=blocks,
+        sr=sr,
+        device=device,
+        chunk_seconds=chunk_seconds,
+        overlap_seconds=chunks_overlap,
+        silence_db=silence_db,
+    )
 
 
 @torch.inference_mode()
-def enhance(chunk_seconds, chunks_overlap,dwav, sr, device, nfe=32, solver="midpoint", lambd=0.5, tau=0.5, run_dir=None):
+def enhance_stream(
+    blocks,
+    sr,
+    device,
+    nfe=32,
+    solver="midpoint",
+    lambd=0.5,
+    tau=0.5,
+    run_dir=None,
+    chunk_seconds=30.0,
+    chunks_overlap=1.0,
+    atol=None,
+    rtol=None,
+    silence_db=None,
+    precision="fp32",
+    tile_frames=None,
+    cache_conditioning=False,
+    stream_vocoder=False,
+):
+    """
+    Args:
+        blocks: iterable of (t) or (t c) waveform blocks, e.g. from soundfile.blocks
+        cache_conditioning: see enhance
+        stream_vocoder: merge the vocoder features of the chunks and vocode them once with a UnivNetStream, see
+            inference_stream_vocoded, instead of vocoding every chunk with its overlap and merging the waveforms.
+            Not supported with silence_db
+    Yields:
+        hwav: (t'), consecutive pieces of the enhanced signal at hp.wav_rate
+    """
     assert 0 < nfe <= 128, f"nfe must be in (0, 128], got {nfe}"
-    assert solver in ("midpoint", "rk4", "euler"), f"solver must be in ('midpoint', 'rk4', 'euler'), got {solver}"
+    assert solver in SOLVER_METHODS, f"solver must be in {SOLVER_METHODS}, got {solver}"
     assert 0 <= lambd <= 1, f"lambd must be in [0, 1], got {lambd}"
     assert 0 <= tau <= 1, f"tau must be in [0, 1], got {tau}"
-    enhancer = load_enhancer(run_dir, device)
-    enhancer.configurate_(nfe=nfe, solver=solver, lambd=lambd, tau=tau)
-    return inference(model=enhancer, chunk_seconds=chunk_seconds, overlap_seconds=chunks_overlap, dwav=dwav, sr=sr, device=device)
+    assert not stream_vocoder or silence_db is None, "silence_db is not supported with stream_vocoder"
+    enhancer = get_enhancer(run_dir, device, precision=precision)
+    model = _configured_enhancer(
+        enhancer, nfe, solver, lambd, tau, atol, rtol, tile_frames, cache_conditioning, features=stream_vocoder
+    )
+    if stream_vocoder:
+        yield from inference_stream_vocoded(
+            model=model,
+            vocoder=UnivNetStream(enhancer.vocoder),
+            blocks=blocks,
+            sr=sr,
+            device=device,
+            chunk_seconds=chunk_seconds,
+            overlap_seconds=chunks_overlap,
+        )
+    else:
+        yield from inference_stream(
+            model=model,
+            blocks=blocks,
+            sr=sr,
+            device=device,
+            chunk_seconds=chunk_seconds,
+            overlap_seconds=chunks_overlap,
+            silence_db=silence_db,
+        )
+    logger.info(f"CFM used {model.stats['nfe_used']} function evaluations ({solver}, at most {nfe} per pass)")
@@ -1,7 +1,7 @@
 import logging
 from dataclasses import dataclass
-from functools import partial
-from typing import Protocol
+from functools import cache, partial
+from typing import Protocol, Sequence
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -11,6 +11,7 @@ import torch.nn.functional as F
 from torch import Tensor, nn
 from tqdm import trange
 
+from ...common import randn_per_row
 from .wn import WN
 
 logger = logging.getLogger(__name__)
@@ -21,6 +22,86 @@ class VelocityField(Protocol):
         ...
 
 
+def _h(t, a):
+    return (a**t - 1) / (a - 1)
+
+
+@cache
+def _decay_constant(n):
+    """
+    Solve h(1/n) = 0.5 for the base of the exponential decay mapping.
+    """
+    return float(scipy.optimize.fsolve(lambda a: _h(1 / n, a) - 0.5, x0=0)[0])
+
+
+@cache
+def _time_schedule(n_steps, t0, t1, n):
+    """
+    Returns:
+        ts: (n_steps + 1), read-only, the mapped time steps from t0 to t1
+    """
+    ts = _h(np.linspace(t0, t1, n_steps + 1), a=_decay_constant(n))
+    ts.flags.writeable = False
+    return ts
+
+
+@dataclass(frozen=True)
+class _EmbeddedTableau:
+    """
+    Butcher tableau of an embedded Runge-Kutta pair, the error estimate is the difference of the two solutions.
+    """
+
+    c: tuple[float, ...]
+    a: tuple[tuple[float, ...], ...]
+    b: tuple[float, ...]  # Propagated (higher order) solution
+    b_err: tuple[float, ...]  # b minus the weights of the lower order solution
+    order: int  # Order of the error estimate, used for the step size control
+    fsal: bool  # The last stage is evaluated at the new solution and reused as the next first stage
+
+
+_HEUN_EULER = _EmbeddedTableau(
+    c=(0.0, 1.0),
+    a=((), (1.0,)),
+    b=(1 / 2, 1 / 2),
+    b_err=(1 / 2 - 1, 1 / 2),
+    order=1,
+    fsal=False,
+)
+
+_DOPRI5 = _EmbeddedTableau(
+    c=(0.0, 1 / 5, 3 / 10, 4 / 5, 8 / 9, 1.0, 1.0),
+    a=(
+        (),
+        (1 / 5,),
+        (3 / 40, 9 / 40),
+        (44 / 45, -56 / 15, 32 / 9),
+        (19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729),
+        (9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656),
+        (35 / 384, 0.0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84),
+    ),
+    b=(35 / 384, 0.0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84, 0.0),
+    b_err=(
+        35 / 384 - 5179 / 57600,
+        0.0,
+        500 / 1113 - 7571 / 16695,
+        125 / 192 - 393 / 640,
+        -2187 / 6784 + 92097 / 339200,
+        11 / 84 - 187 / 2100,
+        -1 / 40,
+    ),
+    order=4,
+    fsal=True,
+)
+
+_ADAPTIVE_TABLEAUS = {"heun_euler": _HEUN_EULER, "dopri5": _DOPRI5}
+
+SOLVER_METHODS = ("midpoint", "rk4", "euler", "heun_euler", "dopri5")
+
+# Default error tolerances of the adaptive methods
+DEFAULT_ATOL = 1e-2
+DEFAULT_RTOL = 1e-2
+
+
 class Solver:
     def __init__(
         self,
@@ -31,8 +112,11 @@ class Solver:
         mel_fn=None,
         time_mapping_divisor=4,
         verbose=False,
+        atol=DEFAULT_ATOL,
+        rtol=DEFAULT_RTOL,
     ):
-        self.configurate_(nfe=nfe, method=method)
+        self.nfe_used = None  # Function evaluations of the last solve
+        self.configurate_(nfe=nfe, method=method, atol=atol, rtol=rtol)
 
         self.verbose = verbose
         self.viz_every = viz_every
@@ -40,21 +124,48 @@ class Solver:
 
         self._camera = None
         self._mel_fn = mel_fn
+        self.time_mapping_divisor = time_mapping_divisor
         self._time_mapping = partial(self.exponential_decay_mapping, n=time_mapping_divisor)
 
-    def configurate_(self, nfe=None, method=None):
+    def configurate_(self, nfe=None, method=None, ts: Sequence[float] | None = None, atol=None, rtol=None):
+        """
+        Args:
+            nfe: number of function evaluations, the upper bound for the adaptive methods, resets any custom schedule
+            method: solver method, one of SOLVER_METHODS, heun_euler and dopri5 pick their own step sizes
+            ts: custom increasing time steps to integrate over, replaces the exponential decay schedule and sets nfe
+            atol: absolute error tolerance of the adaptive methods, None for DEFAULT_ATOL
+            rtol: relative error tolerance of the adaptive methods, None for DEFAULT_RTOL
+        """
         if nfe is None:
             nfe = self.nfe
 
         if method is None:
             method = self.method
 
-        if nfe == 1 and method in ("midpoint", "rk4"):
+        self.atol = DEFAULT_ATOL if atol is None else atol
+        self.rtol = DEFAULT_RTOL if rtol is None else rtol
+
+        # dopri5 falls back to heun_euler first, which itself needs more than 1 NFE
+        if nfe < 7 and method == "dopri5":
+            logger.warning(f"{nfe} NFE is too few for dopri5 (7 for the first step), using heun_euler instead.")
+            method = "heun_euler"
+
+        if nfe == 1 and method in ("midpoint", "rk4", "heun_euler"):
             logger.warning(f"1 NFE is not supported for {method}, using euler method instead.")
             method = "euler"
 
         self.nfe = nfe
         self.method = method
+        self._ts = None
+
+        if ts is not None:
+            assert not self.adaptive, f"Custom time steps are not supported for {method}"
+            ts = np.array(ts, dtype=np.float64)
+            assert ts.ndim == 1 and len(ts) >= 2, f"Expected at least 2 time steps, got {ts.shape}"
+            assert np.all(np.diff(ts) > 0), "Time steps must be strictly increasing"
+            ts.flags.writeable = False
+            self._ts = ts
+            self.nfe = (len(ts) - 1) * self._evals_per_step
 
     @property
     def time_mapping(self):
@@ -66,16 +177,16 @@ class Solver:
         Args:
             n: target step
         """
+        return _h(t, a=_decay_constant(n))
 
-        def h(t, a):
-            return (a**t - 1) / (a - 1)
-
-        # Solve h(1/n) = 0.5
-        a = float(scipy.optimize.fsolve(lambda a: h(1 / n, a) - 0.5, x0=0))
-
-        t = h(t, a=a)
-
-        return t
+    def get_schedule(self, t0=0.0, t1=1.0):
+        """
+        Returns:
+            ts: (n_steps + 1), read-only time steps, the custom schedule if one is set (t0 and t1 are then ignored)
+        """
+        if self._ts is not None:
+            return self._ts
+        return _time_schedule(self.n_steps, float(t0), float(t1), self.time_mapping_divisor)
 
     @torch.no_grad()
     def _maybe_camera_snap(self, *, ψt, t):
@@ -174,28 +285,123 @@ class Solver:
             self._camera = None
 
     @property
-    def n_steps(self):
-        n = self.nfe
+    def adaptive(self):
+        return self.method in _ADAPTIVE_TABLEAUS
+
+    @property
+    def _evals_per_step(self):
         if self.method == "euler":
-            pass
-        elif self.method == "midpoint":
-            n //= 2
+            return 1
+        elif self.method in ("midpoint", "heun_euler"):
+            return 2
         elif self.method == "rk4":
-            n //= 4
+            return 4
+        elif self.method == "dopri5":
+            return 6
         else:
             raise ValueError(f"Unknown method: {self.method}")
-        return n
 
-    def solve(self, f: VelocityField, ψ0: Tensor, t0=0.0, t1=1.0):
-        ts = self._time_mapping(np.linspace(t0, t1, self.n_steps + 1))
+    def _error_ratio(self, err, ψt, ψn):
+        """
+        Returns:
+            ratio: the largest RMS of the scaled error over the batch, the step is accepted if it is <= 1
+        """
+        scale = self.atol + self.rtol * torch.maximum(ψt.abs(), ψn.abs())
+        ratio = (err / scale).square().flatten(1).mean(dim=1).sqrt()
+        return ratio.max().item()
 
+    def _solve_adaptive(self, f: VelocityField, ψ0: Tensor, t0=0.0, t1=1.0):
+        """
+        Embedded Runge-Kutta with step size control. The batch shares one step sequence, picked for its hardest row.
+        When the nfe budget runs low, the remaining interval is split evenly over the steps that are left.
+        """
+        tableau = _ADAPTIVE_TABLEAUS[self.method]
+        n_stages = len(tableau.c)
+
+        # Start from the first step of the fixed schedule with the same budget
+        ts = _time_schedule(max(1, self.n_steps), float(t0), float(t1), self.time_mapping_divisor)
+        dt = float(ts[1] - ts[0])
+
+        t = float(t0)
+        ψt = ψ0
+        k1 = None
+        nfe = 0
+
+        while t1 - t > 1e-9 * abs(t1 - t0):
+            self._maybe_camera_snap(ψt=ψt, t=t)
+
+            if k1 is None:
+                k1 = f(t=t, ψt=ψt, dt=dt)
+                nfe += 1
+
+            # Stages 2..s, plus the next first stage when it is not shared
+            step_cost = n_stages - 1
+            next_cost = step_cost + (0 if tableau.fsal else 1)
+            steps_left = 1 + (self.nfe - nfe - step_cost) // next_cost
+
+            # Never take steps so small that t1 is out of reach, such steps are accepted whatever the error.
+            # Checked after the clamp, so the last affordable step (min_dt = t1 - t) is always forced
+            min_dt = (t1 - t) / max(1, steps_left)
+            dt = min(max(dt, min_dt), t1 - t)
+            forced = dt <= min_dt
+
+            ks = [k1]
+            for c, a in zip(tableau.c[1:], tableau.a[1:]):
+                ψs = ψt + dt * sum(ai * k for ai, k in zip(a, ks) if ai != 0)
+                ks.append(f(t=t + c * dt, ψt=ψs, dt=dt))
+            nfe += step_cost
+
+            if tableau.fsal:
+                ψn = ψs  # The last stage is evaluated at the propagated solution
+            else:
+                ψn = ψt + dt * sum(b * k for b, k in zip(tableau.b, ks) if b != 0)
+
+            err = dt * sum(b * k for b, k in zip(tableau.b_err, ks) if b != 0)
+            ratio = self._error_ratio(err, ψt, ψn)
+
+            if ratio <= 1 or forced:
+                t = t + dt
+                ψt = ψn
+                k1 = ks[-1] if tableau.fsal else None
+
+            factor = 5.0 if ratio == 0 else 0.9 * ratio ** (-1 / (tableau.order + 1))
+            dt = dt * min(5.0, max(0.2, factor))
+
+        self._maybe_camera_snap(ψt=ψt, t=t1)
+        self.nfe_used = nfe
+
+        return ψt
+
+    @property
+    def n_steps(self):
+        if self._ts is not None:
+            return len(self._ts) - 1
+        return self.nfe // self._evals_per_step
+
+    def solve(self, f: VelocityField, ψ0: Tensor, t0=0.0, t1=1.0, ts: Sequence[float] | None = None):
+        """
+        Args:
+            ts: explicit time steps for this call only, overrides the configured schedule
+        """
         if self.visualizing:
             self._reset_camera()
 
+        if ts is None and self.adaptive:
+            ψ1 = self._solve_adaptive(f=f, ψ0=ψ0, t0=t0, t1=t1)
+            self._maybe_dump_camera()
+            return ψ1
+
+        if ts is None:
+            ts = self.get_schedule(t0, t1)
+
+        assert not self.adaptive, f"Explicit time steps are not supported for {self.method}"
+
+        n_steps = len(ts) - 1
+
         if self.verbose:
-            steps = trange(self.n_steps, desc="CFM inference")
+            steps = trange(n_steps, desc="CFM inference")
         else:
-            steps = range(self.n_steps)
+            steps = range(n_steps)
 
         ψt = ψ0
 
@@ -206,6 +412,7 @@ class Solver:
             ψt = self._step(t=t, ψt=ψt, dt=dt, f=f)
 
         self._maybe_camera_snap(ψt=ψt, t=ts[-1])
+        self.nfe_used = n_steps * self._evals_per_step
 
         ψ1 = ψt
         del ψt
@@ -214,8 +421,8 @@ class Solver:
 
         return ψ1
 
-    def __call__(self, f: VelocityField, ψ0: Tensor, t0=0.0, t1=1.0):
-        return self.solve(f=f, ψ0=ψ0, t0=t0, t1=t1)
+    def __call__(self, f: VelocityField, ψ0: Tensor, t0=0.0, t1=1.0, ts: Sequence[float] | None = None):
+        return self.solve(f=f, ψ0=ψ0, t0=t0, t1=t1, ts=ts)
 
 
 class SinusodialTimeEmbedding(nn.Module):
@@ -253,6 +460,10 @@ class CFM(nn.Module):
     solver_nfe: int = 32
     solver_method: str = "midpoint"
     time_mapping_divisor: int = 4
+    # Project the condition once per sample() instead of once per NFE, a few percent faster but the projections
+    # of every WN layer (n_layers * 2 * hidden_dim floats per mel frame, ~390 MB per row of a 30 s chunk) are held
+    # for the whole sample(), on top of what auto_batch_size plans for
+    cache_conditioning: bool = False
 
     def __post_init__(self):
         super().__init__()
@@ -285,11 +496,9 @@ class CFM(nn.Module):
         shape = list(x.shape)
         shape[1] = self.output_dim
         if self.training:
-            g = None
+            ψ0 = torch.randn(shape, device=x.device, dtype=x.dtype)
         else:
-            g = torch.Generator(device=x.device)
-            g.manual_seed(0)  # deterministic sampling during eval
-        ψ0 = torch.randn(shape, device=x.device, dtype=x.dtype, generator=g)
+            ψ0 = randn_per_row(shape, device=x.device, dtype=x.dtype)  # deterministic sampling during eval
         return ψ0
 
     @property
@@ -311,6 +520,12 @@ class CFM(nn.Module):
         """
         return ψ1 - ψ0
 
+    def _to_g(self, *, ψt, t: float | Tensor):
+        if isinstance(t, (float, int)):
+            t = torch.full(ψt.shape[:1], t).to(ψt)
+        t = t.clamp(0, 1)  # [0, 1)
+        return self.emb(t)  # (b d)
+
     def _to_v(self, *, ψt, x, t: float | Tensor):
         """
         Args:
@@ -320,13 +535,28 @@ class CFM(nn.Module):
         Returns:
             v: (b c t)
         """
-        if isinstance(t, (float, int)):
-            t = torch.full(ψt.shape[:1], t).to(ψt)
-        t = t.clamp(0, 1)  # [0, 1)
-        g = self.emb(t)  # (b d)
+        g = self._to_g(ψt=ψt, t=t)
         v = self.net(ψt, l=x, g=g)
         return v
 
+    def _make_cached_v(self, x, max_cached_steps=4):
+        """
+        Returns a velocity field that projects x once and reuses the time projections of repeated t,
+        e.g. the two half steps of rk4.
+        """
+        lp = self.net.project_local(x)
+        gps = {}
+
+        def f(t, ψt, dt):
+            key = float(t)
+            if key not in gps:
+                if len(gps) >= max_cached_steps:
+                    gps.pop(next(iter(gps)))
+                gps[key] = self.net.project_global(self._to_g(ψt=ψt, t=t))
+            return self.net(ψt, lp=lp, gp=gps[key])
+
+        return f
+
     def compute_losses(self, x, y, ψ0) -> dict:
         """
         Args:
@@ -360,7 +590,10 @@ class CFM(nn.Module):
         """
         if ψ0 is None:
             ψ0 = self._sample_ψ0(x)
-        f = lambda t, ψt, dt: self._to_v(ψt=ψt, t=t, x=x)
+        if self.cache_conditioning:
+            f = self._make_cached_v(x)
+        else:
+            f = lambda t, ψt, dt: self._to_v(ψt=ψt, t=t, x=x)
         ψ1 = self.solver(f=f, ψ0=ψ0, t0=t0)
         return ψ1
 
@@ -1,12 +1,13 @@
 import logging
 from dataclasses import dataclass
 
+import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from torch import Tensor, nn
 from torch.nn.utils.parametrizations import weight_norm
 
-from ...common import Normalizer
+from ...common import Normalizer, diagnostics_enabled
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +18,21 @@ class IRMAEOutput:
     decoded: Tensor | None  # decoder output, include extra dim
 
 
+@torch.jit.script
+def _group_norm_gelu(x: Tensor, weight: Tensor, bias: Tensor, num_groups: int, eps: float, out: Tensor):
+    """
+    GELU(GroupNorm(x)), normalized in place in out and in its dtype, which may be wider than that of x.
+    """
+    b, c, t = x.shape
+    xg = x.view(b, num_groups, -1)
+    og = out.view(b, num_groups, -1)
+    torch.sub(xg, xg.mean(dim=-1, keepdim=True, dtype=out.dtype), out=og)
+    var = torch.linalg.vector_norm(og, dim=-1, keepdim=True).square_().div_(og.shape[-1])  # (b g 1)
+    scale = var.add_(eps).rsqrt_().repeat_interleave(c // num_groups, dim=1) * weight[:, None]  # (b c 1)
+    out.mul_(scale).add_(bias[:, None])
+    return F.gelu(out)
+
+
 class ResBlock(nn.Sequential):
     def __init__(self, channels, dilations=[1, 2, 4, 8]):
         wn = weight_norm
@@ -38,6 +54,20 @@ class ResBlock(nn.Sequential):
     def forward(self, x: Tensor):
         return x + super().forward(x)
 
+    def fused_forward(self, x: Tensor, workspace: Tensor):
+        """
+        Inference only, same as forward with every GroupNorm normalized in place in workspace before its GELU.
+
+        Args:
+            x: (b c t)
+            workspace: (b c t), scratch buffer, overwritten
+        """
+        h = x
+        for i in range(0, len(self), 3):
+            norm, conv = self[i], self[i + 2]
+            h = conv(_group_norm_gelu(h, norm.weight, norm.bias, norm.num_groups, norm.eps, workspace))
+        return h.add_(x)
+
 
 class IRMAE(nn.Module):
     def __init__(
@@ -60,6 +90,8 @@ class IRMAE(nn.Module):
         self.input_dim = input_dim
         super().__init__()
 
+        self.num_irms = num_irms
+
         self.encoder = nn.Sequential(
             nn.Conv1d(input_dim, hidden_dim, 3, padding="same"),
             *[ResBlock(hidden_dim) for _ in range(4)],
@@ -82,12 +114,49 @@ class IRMAE(nn.Module):
 
         self.estimator = Normalizer()
 
+        # Eval only, see _fused_encode and _fused_decode
+        self.fused_inference = False
+
+    def _run_fused(self, layers, x):
+        workspace = None
+        for layer in layers:
+            if isinstance(layer, ResBlock):
+                if workspace is None:
+                    # Shared by all the blocks, in fp32 under autocast where nn.GroupNorm also runs in fp32
+                    dtype = torch.promote_types(x.dtype, layer[0].weight.dtype)
+                    workspace = torch.empty_like(x, dtype=dtype)
+                x = layer.fused_forward(x, workspace)
+            else:
+                x = layer(x)
+        return x
+
+    def _fused_encode(self, x):
+        """
+        Same as encode without the statistics, with fused ResBlocks and the implicit rank minimization
+        matrices multiplied into a single 1x1 convolution.
+        """
+        layers = list(self.encoder)
+        irms = layers[-1 - self.num_irms : -1]
+        z = self._run_fused(layers[: -1 - self.num_irms], x)
+        weight = irms[0].weight.squeeze(-1)
+        for irm in irms[1:]:
+            weight = irm.weight.squeeze(-1) @ weight
+        return F.conv1d(z, weight.unsqueeze(-1)).tanh_()
+
+    def _fused_decode(self, z):
+        return self._run_fused(self.decoder, z)
+
     def encode(self, x):
         """
         Args:
             x: (b c t) tensor
         """
+        if self.fused_inference and not self.training:
+            return self._fused_encode(x)
+
         z = self.encoder(x)  # (b c t)
+        if not diagnostics_enabled(self):
+            return z
         _ = self.estimator(z)  # Estimate the glboal mean and std of z
         self.stats = {}
         self.stats["z_mean"] = z.mean().item()
@@ -102,6 +171,8 @@ class IRMAE(nn.Module):
         Args:
             z: (b c t) tensor
         """
+        if self.fused_inference and not self.training:
+            return self._fused_decode(z)
         return self.decoder(z)
 
     def forward(self, x, skip_decoding=False):
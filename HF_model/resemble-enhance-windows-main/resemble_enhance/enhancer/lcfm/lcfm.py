@@ -6,6 +6,7 @@ import torch
 import torch.nn as nn
 from torch import Tensor, nn
 
+from ...common import randn_per_row
 from .cfm import CFM
 from .irmae import IRMAE, IRMAEOutput
 
@@ -120,12 +121,17 @@ class LCFM(nn.Module):
             self.ae.eval()  # Always set to eval when training cfm
 
         if ψ0 is not None:
-            ψ0 = self._scale(self.ae.encode(ψ0))
             if self.training:
+                ψ0 = self._scale(self.ae.encode(ψ0))
                 tau = torch.rand_like(ψ0[:, :1, :1])
+                noise = torch.randn_like(ψ0)
             else:
                 tau = self._eval_tau
-            ψ0 = tau * torch.randn_like(ψ0) + (1 - tau) * ψ0
+                shape = (ψ0.shape[0], self.cfm.output_dim, ψ0.shape[2])
+                noise = randn_per_row(shape, device=ψ0.device, dtype=ψ0.dtype)
+                # At tau = 1 the prior is pure noise, the encoding would be multiplied by zero
+                ψ0 = noise if tau == 1 else self._scale(self.ae.encode(ψ0))
+            ψ0 = tau * noise + (1 - tau) * ψ0
 
         if y is None:
             if self.mode == self.Mode.AE:
@@ -34,18 +34,32 @@ class WNLayer(nn.Module):
 
         self.out = nn.Conv1d(hidden_dim, 2 * hidden_dim, kernel_size=1)
 
-    def forward(self, z, l, g):
+    def project_global(self, g):
+        if g.dim() == 2:
+            g = g.unsqueeze(-1)
+        return self.gconv(g)
+
+    def forward(self, z, l, g, lp=None, gp=None):
+        """
+        Args:
+            lp: precomputed self.lconv(l), replaces l
+            gp: precomputed self.project_global(g), replaces g
+        """
         identity = z
 
-        if g is not None:
-            if g.dim() == 2:
-                g = g.unsqueeze(-1)
-            z = z + self.gconv(g)
+        if gp is None and g is not None:
+            gp = self.project_global(g)
+
+        if gp is not None:
+            z = z + gp
 
         z = self.dconv(z)
 
-        if l is not None:
-            z = z + self.lconv(l)
+        if lp is None and l is not None:
+            lp = self.lconv(l)
+
+        if lp is not None:
+            z = z + lp
 
         z = _fused_tanh_sigmoid(z)
 
@@ -98,23 +112,50 @@ class WN(nn.Module):
 
         self.end = nn.Conv1d(hidden_dim, output_dim, 1)
 
-    def forward(self, z, l=None, g=None):
+    def project_local(self, l):
+        """
+        Args:
+            l: local condition (b c t)
+        Returns:
+            lp: per-layer local projections, [(b 2h t)] * n_layers
+        """
+        l = self.local_norm(l)
+        return [layer.lconv(l) for layer in self.layers]
+
+    def project_global(self, g):
+        """
+        Args:
+            g: global condition (b d)
+        Returns:
+            gp: per-layer global projections, [(b h 1)] * n_layers
+        """
+        return [layer.project_global(g) for layer in self.layers]
+
+    def forward(self, z, l=None, g=None, lp=None, gp=None):
         """
         Args:
             z: input (b c t)
             l: local condition (b c t)
             g: global condition (b d)
+            lp: precomputed self.project_local(l), replaces l when the same condition is used repeatedly
+            gp: precomputed self.project_global(g), replaces g
         """
         z = self.start(z)
 
-        if l is not None:
+        if lp is None and l is not None:
             l = self.local_norm(l)
 
         # Skips
         s_list = []
 
-        for layer in self.layers:
-            z, s = layer(z, l, g)
+        for i, layer in enumerate(self.layers):
+            z, s = layer(
+                z,
+                l,
+                g,
+                lp=None if lp is None else lp[i],
+                gp=None if gp is None else gp[i],
+            )
             s_list.append(s)
 
         s_list = torch.stack(s_list, dim=0).sum(dim=0)
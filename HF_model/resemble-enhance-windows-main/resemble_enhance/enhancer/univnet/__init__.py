@@ -1 +1,2 @@
+from .streaming import UnivNetStream
 from .univnet import UnivNet
@@ -4,6 +4,7 @@ import math
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from torch import nn
 from torch.nn.utils.parametrizations import weight_norm
 
@@ -78,8 +79,78 @@ class UpActDown(nn.Module):
         self.upsample = UpSample1d(up_ratio, up_kernel_size)
         self.downsample = DownSample1d(down_ratio, down_kernel_size)
 
+        # Eval only, see _polyphase_forward
+        self.polyphase = False
+
+    @property
+    def supports_polyphase(self):
+        return (
+            self.up_ratio == 2
+            and self.down_ratio == 2
+            and self.upsample.kernel_size % 2 == 0
+            and self.downsample.lowpass.kernel_size % 2 == 0
+        )
+
+    def set_polyphase_(self, enabled=True):
+        assert not enabled or self.supports_polyphase, "Only 2x resampling with even kernels has a polyphase form"
+        self.polyphase = enabled
+
+    @staticmethod
+    def _phase_taps(filter):
+        """
+        For an even kernel of size k centered like the 2x alias-free filters, tap i touches phase n % 2 at offset
+        n // 2 of the interleaved signal, with n = i - k / 2 + 1.
+        """
+        n = torch.arange(filter.numel(), device=filter.device) - filter.numel() // 2 + 1
+        phase, offset = n % 2, torch.div(n, 2, rounding_mode="floor")
+        pad = int(offset.abs().max())
+        return phase, offset, pad
+
+    def _polyphase_filters(self):
+        """
+        Split the 2x up and down filters into their even/odd phases.
+
+        Returns:
+            up: (2 1 2p+1), taps of the even and odd upsampled phases on the input
+            down: (1 2 2p'+1), taps of the output on the even and odd upsampled phases
+            up_pad: p, padding of the input on both sides
+            down_pad: p', padding of the phases on both sides
+        """
+        f = self.upsample.filter.flatten()
+        phase, offset, up_pad = self._phase_taps(f)
+        up = f.new_zeros(2, 1, 2 * up_pad + 1)
+        up[phase, 0, up_pad - offset] = self.up_ratio * f  # u[2q + r] = 2 sum_i f[i] x[q - offset[i]]
+
+        g = self.downsample.lowpass.filter.flatten()
+        phase, offset, down_pad = self._phase_taps(g)
+        down = g.new_zeros(1, 2, 2 * down_pad + 1)
+        down[0, phase, down_pad + offset] = g  # y[p] = sum_i g[i] u_phase[i][p + offset[i]]
+
+        return up, down, up_pad, down_pad
+
+    def _polyphase_forward(self, x):
+        """
+        Same as forward, computed on the two phases of the upsampled signal: the upsampler becomes a 1 -> 2 channel
+        depthwise conv at the input rate and the downsampler a 2 -> 1 channel one, so neither the zero-stuffed
+        transposed conv output nor the padded full-rate copies are built.
+        """
+        B, C, T = x.shape
+        up, down, up_pad, down_pad = self._polyphase_filters()
+
+        u = F.conv1d(F.pad(x, (up_pad, up_pad), mode="replicate"), up.repeat(C, 1, 1), groups=C)  # (B, 2C, T)
+        u = self.act(u.view(B, C, 2 * T)).view(B, C, 2, T)
+
+        # The downsampler pads the interleaved signal with its first (even) and last (odd) samples
+        left = u[:, :, :1, :1].expand(B, C, 2, down_pad)
+        right = u[:, :, 1:, -1:].expand(B, C, 2, down_pad)
+        u = torch.cat([left, u, right], dim=-1).view(B, 2 * C, T + 2 * down_pad)
+
+        return F.conv1d(u, down.repeat(C, 1, 1), groups=C)  # (B, C, T)
+
     def forward(self, x):
         # x: [B,C,T]
+        if self.polyphase and not self.training:
+            return self._polyphase_forward(x)
         x = self.upsample(x)
         x = self.act(x)
         x = self.downsample(x)
@@ -94,16 +94,63 @@ class KernelPredictor(torch.nn.Module):
             )
         )
 
-    def forward(self, c):
+    def trunk(self, c):
         """
         Args:
             c (Tensor): the conditioning sequence (batch, cond_channels, cond_length)
+        Returns:
+            (Tensor): the hidden sequence of the kernel and bias convs (batch, kpnet_hidden_channels, cond_length)
         """
-        batch, _, cond_length = c.shape
         c = self.input_conv(c)
         for residual_conv in self.residual_convs:
             residual_conv.to(c.device)
             c = c + residual_conv(c)
+        return c
+
+    def layer_kernel(self, h, i, out=None):
+        """Predict the kernel of a single layer, as an im2col matmul that can write into a reused buffer.
+        Args:
+            h (Tensor): the output of trunk (batch, kpnet_hidden_channels, cond_length)
+            i (int): the layer index
+            out (Tensor): optional buffer (batch, in_channels * out_channels * kernel_size, cond_length)
+        Returns:
+            (Tensor): the kernel (batch, in_channels, out_channels, kernel_size, cond_length)
+        """
+        batch, _, cond_length = h.shape
+        n = self.conv_in_channels * self.conv_out_channels * self.conv_kernel_size
+
+        conv = self.kernel_conv
+        weight = conv.weight[i * n : (i + 1) * n].to(h.dtype)  # (n, hidden, kpnet_conv_size), h may be autocast
+        padding = conv.padding[0]
+
+        h = F.pad(h, (padding, padding)).unfold(2, weight.shape[-1], 1)  # (batch, hidden, cond_length, size)
+        h = h.transpose(2, 3).reshape(batch, -1, cond_length)  # (batch, hidden * size, cond_length)
+
+        if out is None:
+            out = h.new_empty(batch, n, cond_length)
+        for j in range(batch):
+            torch.mm(weight.reshape(n, -1), h[j], out=out[j])  # (n, cond_length)
+        k = out.add_(conv.bias[i * n : (i + 1) * n, None].to(h.dtype))
+
+        return k.view(batch, self.conv_in_channels, self.conv_out_channels, self.conv_kernel_size, cond_length)
+
+    def hidden_bias(self, h):
+        """
+        Args:
+            h (Tensor): the output of trunk (batch, kpnet_hidden_channels, cond_length)
+        Returns:
+            (Tensor): the biases of all layers (batch, conv_layers, out_channels, cond_length)
+        """
+        batch, _, cond_length = h.shape
+        return self.bias_conv(h).view(batch, self.conv_layers, self.conv_out_channels, cond_length)
+
+    def forward(self, c):
+        """
+        Args:
+            c (Tensor): the conditioning sequence (batch, cond_channels, cond_length)
+        """
+        batch, _, cond_length = c.shape
+        c = self.trunk(c)
         k = self.kernel_conv(c)
         b = self.bias_conv(c)
         kernels = k.contiguous().view(
@@ -145,6 +192,7 @@ class LVCBlock(torch.nn.Module):
         super().__init__()
 
         self.add_extra_noise = add_extra_noise
+        self.lvc_impl = "einsum"
 
         self.cond_hop_length = cond_hop_length
         self.conv_layers = len(dilations)
@@ -201,11 +249,13 @@ class LVCBlock(torch.nn.Module):
                 )
             )
 
-    def forward(self, x, c):
+    def forward(self, x, c, h=None, kernel_buffer=None):
         """forward propagation of the location-variable convolutions.
         Args:
             x (Tensor): the input sequence (batch, in_channels, in_length)
             c (Tensor): the conditioning sequence (batch, cond_channels, cond_length)
+            h (Tensor): optional precomputed kernel_predictor.trunk(c), the kernels are then predicted one layer
+                at a time (into kernel_buffer if given) instead of all at once
 
         Returns:
             Tensor: the output sequence (batch, in_channels, in_length)
@@ -217,7 +267,10 @@ class LVCBlock(torch.nn.Module):
         # Add one amp block just after the upsampling
         x = self.amp_block(x)  # (B, c_g, stride * L')
 
-        kernels, bias = self.kernel_predictor(c)
+        if h is None:
+            kernels, bias = self.kernel_predictor(c)
+        else:
+            kernels, bias = None, self.kernel_predictor.hidden_bias(h)
 
         if self.add_extra_noise:
             # Add extra noise to part of the feature
@@ -228,18 +281,89 @@ class LVCBlock(torch.nn.Module):
         for i, conv in enumerate(self.conv_blocks):
             output = conv(x)  # (B, c_g, stride * L')
 
-            k = kernels[:, i, :, :, :, :]  # (B, 2 * c_g, c_g, kernel_size, cond_length)
+            if kernels is None:
+                k = self.kernel_predictor.layer_kernel(h, i, out=kernel_buffer)
+            else:
+                k = kernels[:, i, :, :, :, :]  # (B, 2 * c_g, c_g, kernel_size, cond_length)
             b = bias[:, i, :, :]  # (B, 2 * c_g, cond_length)
 
-            output = self.location_variable_convolution(
-                output, k, b, hop_size=self.cond_hop_length
-            )  # (B, 2 * c_g, stride * L'): LVC
+            output = self._lvc(output, k, b, hop_size=self.cond_hop_length)  # (B, 2 * c_g, stride * L'): LVC
             x = x + torch.sigmoid(output[:, :in_channels, :]) * torch.tanh(
                 output[:, in_channels:, :]
             )  # (B, c_g, stride * L'): GAU
 
         return x
 
+    LVC_IMPLS = ("einsum", "matmul")
+
+    def set_lvc_impl_(self, impl):
+        """
+        Args:
+            impl: "einsum" (the reference 6-D unfold) or "matmul" (batched matmul per kernel tap)
+        """
+        assert impl in self.LVC_IMPLS, f"impl must be in {self.LVC_IMPLS}, got {impl}"
+        self.lvc_impl = impl
+
+    def _lvc(self, x, kernel, bias, hop_size):
+        if self.lvc_impl == "matmul":
+            return self.location_variable_convolution_matmul(x, kernel, bias, hop_size=hop_size)
+        return self.location_variable_convolution(x, kernel, bias, hop_size=hop_size)
+
+    @staticmethod
+    def location_variable_convolution_matmul(x, kernel, bias, dilation=1, hop_size=256):
+        """Same as location_variable_convolution, computed as one batched matmul per kernel tap over the
+        hop-sized frames, so neither the unfolded input nor a channels-last copy is materialized.
+        Equal up to float rounding (the taps are summed in a different order).
+        Args:
+            x (Tensor): the input sequence (batch, in_channels, in_length).
+            kernel (Tensor): the local convolution kernel (batch, in_channel, out_channels, kernel_size, kernel_length)
+            bias (Tensor): the bias for the local convolution (batch, out_channels, kernel_length)
+            dilation (int): the dilation of convolution, only 1 matches the reference implementation.
+            hop_size (int): the hop_size of the conditioning sequence.
+        Returns:
+            (Tensor): the output sequence after performing local convolution. (batch, out_channels, in_length).
+        """
+        batch, in_channels, in_length = x.shape
+        batch, _, out_channels, kernel_size, kernel_length = kernel.shape
+
+        assert in_length == (
+            kernel_length * hop_size
+        ), f"length of (x, kernel) is not matched, {in_length} != {kernel_length} * {hop_size}"
+
+        padding = dilation * int((kernel_size - 1) / 2)
+        x = F.pad(x, (padding, padding), "constant", 0)  # (batch, in_channels, in_length + 2*padding)
+
+        return LVCBlock.location_variable_convolution_matmul_padded(x, kernel, bias, dilation, hop_size)
+
+    @staticmethod
+    def location_variable_convolution_matmul_padded(x, kernel, bias, dilation=1, hop_size=256):
+        """Same as location_variable_convolution_matmul on an input that already has its padding of context on both
+        sides, which lets the streaming vocoder run it on a slice of a longer sequence.
+        Args:
+            x (Tensor): the input sequence with its context (batch, in_channels, kernel_length * hop_size + 2*padding).
+            kernel (Tensor): the local convolution kernel (batch, in_channel, out_channels, kernel_size, kernel_length)
+            bias (Tensor): the bias for the local convolution (batch, out_channels, kernel_length)
+        Returns:
+            (Tensor): the output sequence (batch, out_channels, kernel_length * hop_size).
+        """
+        batch, in_channels, _ = x.shape
+        batch, _, out_channels, kernel_size, kernel_length = kernel.shape
+        in_length = kernel_length * hop_size
+
+        kernel = kernel.permute(0, 4, 3, 2, 1)  # (batch, kernel_length, kernel_size, out_channels, in_channels)
+
+        # Start from the bias, (batch, kernel_length, out_channels, 1)
+        o = bias.transpose(1, 2).unsqueeze(-1)
+
+        for k in range(kernel_size):
+            xk = x[..., k * dilation : k * dilation + in_length]  # (batch, in_channels, in_length)
+            xk = xk.reshape(batch, in_channels, kernel_length, hop_size).transpose(1, 2)  # (batch, l, in, hop)
+            o = o + torch.matmul(kernel[:, :, k], xk)  # (batch, kernel_length, out_channels, hop_size)
+
+        o = o.transpose(1, 2).reshape(batch, out_channels, in_length)
+
+        return o
+
     def location_variable_convolution(self, x, kernel, bias, dilation=1, hop_size=256):
         """perform location-variable convolution operation on the input sequence (x) using the local convolution kernl.
         Time: 414 μs ± 309 ns per loop (mean ± std. dev. of 7 runs, 1000 loops each), test on NVIDIA V100.
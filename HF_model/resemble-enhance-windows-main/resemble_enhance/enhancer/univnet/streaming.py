@@ -0,0 +1,533 @@
+"""
+Stateful streaming versions of the UnivNet layers, see UnivNetStream.
+
+Every stage takes the next samples of its input and returns the next samples of its output that later input can
+no longer change, and keeps only the left context that it still needs. The edge padding of a layer (zeros, reflect
+or replicate) is applied to the first samples as they arrive and to the last ones on flush, so the outputs of the
+calls put end to end are the layer applied to the whole input.
+"""
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor, nn
+
+from .alias_free_torch import DownSample1d, LowPassFilter1d, UpSample1d
+from .amp import AMPBlock, SnakeBeta, UpActDown
+from .lvcnet import LVCBlock
+
+_PADDING_MODES = {"zeros": "constant", "constant": "constant", "reflect": "reflect", "replicate": "replicate"}
+
+
+def _empty(x: Tensor, channels=None):
+    """
+    Returns:
+        (b channels 0), channels defaults to the channels of x
+    """
+    return x.new_empty(x.shape[0], x.shape[1] if channels is None else channels, 0)
+
+
+class _Stage:
+    def __call__(self, x: Tensor) -> Tensor:
+        """
+        Args:
+            x: (b c t), the next samples of the input, t may be 0
+        Returns:
+            y: (b c' t'), the next samples of the output
+        """
+        raise NotImplementedError
+
+    def flush(self, x: Tensor) -> Tensor:
+        """
+        Same as __call__ for the last samples of the input, returns the rest of the output.
+        """
+        return self(x)
+
+
+class _Pointwise(_Stage):
+    def __init__(self, fn):
+        self.fn = fn
+
+    def __call__(self, x):
+        return self.fn(x)
+
+
+class _Sequential(_Stage):
+    def __init__(self, stages):
+        self.stages = stages
+
+    def __call__(self, x):
+        for stage in self.stages:
+            x = stage(x)
+        return x
+
+    def flush(self, x):
+        for stage in self.stages:
+            x = stage.flush(x)
+        return x
+
+
+class _Residual(_Stage):
+    """
+    x + inner(x), for an inner stage whose output is aligned with its input.
+    """
+
+    def __init__(self, inner: _Stage):
+        self.inner = inner
+        self._skip = None  # Input samples waiting for their inner output
+
+    def _add(self, x, y):
+        self._skip = x if self._skip is None else torch.cat([self._skip, x], dim=-1)
+        n = y.shape[-1]
+        o, self._skip = self._skip[..., :n] + y, self._skip[..., n:]
+        return o
+
+    def __call__(self, x):
+        return self._add(x, self.inner(x))
+
+    def flush(self, x):
+        o = self._add(x, self.inner.flush(x))
+        assert self._skip.shape[-1] == 0, f"{self._skip.shape[-1]} samples have no inner output"
+        return o
+
+
+class _Pad(_Stage):
+    """
+    F.pad(x, (left, right), mode) of the whole input.
+    """
+
+    def __init__(self, left, right, mode):
+        self.left = left
+        self.right = right
+        self.mode = _PADDING_MODES[mode]
+        self._head = None  # First samples, until there are enough of them to pad the left edge
+        self._tail = None  # Last samples, to pad the right edge on flush
+
+    def _edge_length(self, pad):
+        if pad == 0 or self.mode == "constant":
+            return 0
+        return pad + 1 if self.mode == "reflect" else 1
+
+    def _pad(self, x, pad):
+        return F.pad(x, pad, self.mode) if self.mode != "constant" else F.pad(x, pad, self.mode, 0)
+
+    def __call__(self, x):
+        keep = self._edge_length(self.right)
+        self._tail = x if self._tail is None else torch.cat([self._tail, x], dim=-1)
+        self._tail = self._tail[..., max(0, self._tail.shape[-1] - keep) :]
+
+        if self._head is False:
+            return x
+
+        self._head = x if self._head is None else torch.cat([self._head, x], dim=-1)
+        if self._head.shape[-1] < self._edge_length(self.left) or self._head.shape[-1] == 0:
+            return _empty(x)
+
+        x, self._head = self._pad(self._head, (self.left, 0)), False
+        return x
+
+    def flush(self, x):
+        if self._head is not False:
+            # Shorter than the left edge, pad the whole input at once like F.pad
+            x = x if self._head is None else torch.cat([self._head, x], dim=-1)
+            return self._pad(x, (self.left, self.right))
+
+        x = self(x)
+        n = self._tail.shape[-1]
+        return torch.cat([x, self._pad(self._tail, (0, self.right))[..., n:]], dim=-1)
+
+
+class _Conv(_Stage):
+    """
+    A convolution without padding: output i is computed from input [i * stride, i * stride + span).
+    """
+
+    def __init__(self, conv, span, stride=1, channels=None):
+        """
+        Args:
+            conv: the convolution, called on complete windows only
+            channels: number of output channels, the same as the input if None
+        """
+        self.conv = conv
+        self.span = span
+        self.stride = stride
+        self.channels = channels
+        self._buffer = None
+
+    def __call__(self, x):
+        self._buffer = x if self._buffer is None else torch.cat([self._buffer, x], dim=-1)
+        n = max(0, (self._buffer.shape[-1] - self.span) // self.stride + 1)
+        if n == 0:
+            return _empty(x, self.channels)
+        y = self.conv(self._buffer[..., : (n - 1) * self.stride + self.span])
+        self._buffer = self._buffer[..., n * self.stride :]
+        return y
+
+
+class _ConvTranspose(_Stage):
+    """
+    A transposed convolution without padding, by overlap-add: output samples are final once every input sample
+    whose kernel reaches them has arrived.
+    """
+
+    def __init__(self, conv_transpose, stride, bias=None, channels=None):
+        """
+        Args:
+            conv_transpose: the transposed convolution without bias
+            bias: (c' 1), added to the final samples
+        """
+        self.conv_transpose = conv_transpose
+        self.stride = stride
+        self.bias = bias
+        self.channels = channels
+        self._overlap = None  # Partial sums past the final samples
+
+    def _add_bias(self, y):
+        return y if self.bias is None else y + self.bias
+
+    def __call__(self, x):
+        if x.shape[-1] == 0:
+            return _empty(x, self.channels)
+        y = self.conv_transpose(x)  # ((t - 1) * stride + kernel_size)
+        if self._overlap is not None:
+            y[..., : self._overlap.shape[-1]] += self._overlap
+        n = x.shape[-1] * self.stride
+        assert y.shape[-1] >= n, "Kernels shorter than the stride are not supported"
+        self._overlap = y[..., n:]
+        return self._add_bias(y[..., :n])
+
+    def flush(self, x):
+        y = self(x)
+        if self._overlap is None:
+            return y
+        return torch.cat([y, self._add_bias(self._overlap)], dim=-1)
+
+
+class _Trim(_Stage):
+    """
+    x[..., left : t - right] of the whole input.
+    """
+
+    def __init__(self, left, right, flushed=0):
+        """
+        Args:
+            flushed: number of samples that the input always gets on flush, up to that many of the right samples
+                are only known on flush and do not have to be held back
+        """
+        self.left = left
+        self.right = right
+        self.held = max(0, right - flushed)
+        self._buffer = None
+
+    def __call__(self, x):
+        self._buffer = x if self._buffer is None else torch.cat([self._buffer, x], dim=-1)
+        skip = min(self.left, self._buffer.shape[-1])
+        self._buffer, self.left = self._buffer[..., skip:], self.left - skip
+        n = max(0, self._buffer.shape[-1] - self.held)
+        y, self._buffer = self._buffer[..., :n], self._buffer[..., n:]
+        return y
+
+    def flush(self, x):
+        self.held = self.right
+        return self(x)  # The right samples are left in the buffer
+
+
+def _padding(conv: nn.Conv1d):
+    (kernel_size,), (dilation,) = conv.kernel_size, conv.dilation
+    if conv.padding == "same":
+        total = dilation * (kernel_size - 1)
+        return total // 2, total - total // 2
+    if conv.padding == "valid":
+        return 0, 0
+    return conv.padding[0], conv.padding[0]
+
+
+def _conv1d(conv: nn.Conv1d):
+    (kernel_size,), (dilation,), (stride,) = conv.kernel_size, conv.dilation, conv.stride
+    left, right = _padding(conv)
+    weight, bias = conv.weight, conv.bias  # Computed once if weight norm is still applied
+
+    def fn(x):
+        return F.conv1d(x, weight, bias, stride=stride, dilation=dilation, groups=conv.groups)
+
+    stages = [_Pad(left, right, conv.padding_mode)] if left > 0 or right > 0 else []
+    stages.append(_Conv(fn, span=dilation * (kernel_size - 1) + 1, stride=stride, channels=conv.out_channels))
+    return _Sequential(stages)
+
+
+def _conv_transpose1d(conv: nn.ConvTranspose1d):
+    (stride,), (padding,), (output_padding,) = conv.stride, conv.padding, conv.output_padding
+    assert conv.dilation == (1,), f"Only undilated transposed convolutions are supported, got {conv.dilation}"
+
+    weight = conv.weight
+
+    def fn(x):
+        return F.conv_transpose1d(x, weight, stride=stride, groups=conv.groups)
+
+    # The output of length (t - 1) * stride + kernel_size - 2 * padding + output_padding starts at padding
+    bias = None if conv.bias is None else conv.bias[:, None]
+    return _Sequential(
+        [
+            _ConvTranspose(fn, stride, bias=bias, channels=conv.out_channels),
+            _Trim(padding, padding - output_padding, flushed=conv.kernel_size[0] - stride),
+        ]
+    )
+
+
+def _upsample1d(up: UpSample1d):
+    def fn(x):
+        weight = up.ratio * up.filter.expand(x.shape[1], -1, -1)
+        return F.conv_transpose1d(x, weight, stride=up.stride, groups=x.shape[1])
+
+    return _Sequential(
+        [
+            _Pad(up.pad, up.pad, "replicate"),
+            _ConvTranspose(fn, up.stride),
+            _Trim(up.pad_left, up.pad_right, flushed=up.pad * up.stride + up.kernel_size - up.stride),
+        ]
+    )
+
+
+def _lowpass1d(lowpass: LowPassFilter1d):
+    def fn(x):
+        return F.conv1d(x, lowpass.filter.expand(x.shape[1], -1, -1), stride=lowpass.stride, groups=x.shape[1])
+
+    stages = [_Pad(lowpass.pad_left, lowpass.pad_right, lowpass.padding_mode)] if lowpass.padding else []
+    stages.append(_Conv(fn, span=lowpass.kernel_size, stride=lowpass.stride))
+    return _Sequential(stages)
+
+
+def stream_module(module: nn.Module) -> _Stage:
+    """
+    The streaming stage of a vocoder layer in eval. UpActDown always runs the full-rate reference path, its
+    polyphase form pads the two phases together and has no per-stage equivalent.
+    """
+    if isinstance(module, nn.Conv1d):
+        return _conv1d(module)
+    if isinstance(module, nn.ConvTranspose1d):
+        return _conv_transpose1d(module)
+    if isinstance(module, UpSample1d):
+        return _upsample1d(module)
+    if isinstance(module, DownSample1d):
+        return _lowpass1d(module.lowpass)
+    if isinstance(module, LowPassFilter1d):
+        return _lowpass1d(module)
+    if isinstance(module, UpActDown):
+        return _Sequential([stream_module(module.upsample), _Pointwise(module.act), stream_module(module.downsample)])
+    if isinstance(module, AMPBlock):
+        return _Residual(_Sequential([stream_module(layer) for layer in module]))
+    if isinstance(module, nn.Sequential):
+        return _Sequential([stream_module(layer) for layer in module])
+    if isinstance(module, (SnakeBeta, nn.LeakyReLU, nn.Tanh, nn.Dropout, nn.Identity)):
+        return _Pointwise(module)
+    raise NotImplementedError(f"No streaming version of {type(module).__name__}")
+
+
+class _KernelPredictorStream(_Stage):
+    """
+    Returns the kernels (b l c_in c_out k t) and biases (b l c_out t) of the conditioning frames that are final.
+    """
+
+    def __init__(self, predictor):
+        self.predictor = predictor
+        self.trunk = _Sequential(
+            [stream_module(predictor.input_conv)] + [_Residual(stream_module(c)) for c in predictor.residual_convs]
+        )
+        self.kernel_conv = stream_module(predictor.kernel_conv)
+        self.bias_conv = stream_module(predictor.bias_conv)
+
+    def _reshape(self, k, b):
+        p = self.predictor
+        batch, _, t = k.shape
+        k = k.view(batch, p.conv_layers, p.conv_in_channels, p.conv_out_channels, p.conv_kernel_size, t)
+        b = b.view(batch, p.conv_layers, p.conv_out_channels, t)
+        return k, b
+
+    def __call__(self, c):
+        h = self.trunk(c)
+        return self._reshape(self.kernel_conv(h), self.bias_conv(h))
+
+    def flush(self, c):
+        h = self.trunk.flush(c)
+        return self._reshape(self.kernel_conv.flush(h), self.bias_conv.flush(h))
+
+
+class _LVC(_Stage):
+    """
+    The location-variable convolution of one layer of an LVCBlock, with the kernels pushed as they are predicted.
+    Samples are output as soon as their frame has a kernel, a frame may be split across calls.
+    """
+
+    def __init__(self, kernel_size, hop_size):
+        self.hop_size = hop_size
+        self.padding = (kernel_size - 1) // 2
+        self.pad = _Pad(self.padding, self.padding, "zeros")
+        self._buffer = None
+        self._kernels = None  # (b c_in c_out k t), the kernels of the frames from the buffer on
+        self._bias = None  # (b c_out t)
+        self._done = 0  # Samples of the first frame that are already output
+
+    def push(self, kernel, bias):
+        if self._kernels is None:
+            self._kernels, self._bias = kernel, bias
+        else:
+            self._kernels = torch.cat([self._kernels, kernel], dim=-1)
+            self._bias = torch.cat([self._bias, bias], dim=-1)
+
+    def _step(self):
+        """
+        Convolve the rest of the first frame if it is partly done or incomplete, as many whole frames as possible
+        otherwise.
+        """
+        available = self._buffer.shape[-1] - 2 * self.padding
+        frames = min(self._kernels.shape[-1], available // self.hop_size)
+        if self._done > 0 or frames == 0:
+            frames, length = 1, min(self.hop_size - self._done, available)
+        else:
+            length = self.hop_size
+
+        o = LVCBlock.location_variable_convolution_matmul_padded(
+            self._buffer[..., : frames * length + 2 * self.padding],
+            self._kernels[..., :frames],
+            self._bias[..., :frames],
+            hop_size=length,
+        )
+
+        self._buffer = self._buffer[..., frames * length :]
+        self._done += frames * length
+        frames = self._done // self.hop_size
+        self._kernels, self._bias = self._kernels[..., frames:], self._bias[..., frames:]
+        self._done %= self.hop_size
+
+        return o
+
+    def _convolve(self, x):
+        self._buffer = x if self._buffer is None else torch.cat([self._buffer, x], dim=-1)
+        outputs = [_empty(x, self._kernels.shape[2])]
+        while self._kernels.shape[-1] > 0 and self._buffer.shape[-1] > 2 * self.padding:
+            outputs.append(self._step())
+        return torch.cat(outputs, dim=-1)
+
+    def __call__(self, x):
+        return self._convolve(self.pad(x))
+
+    def flush(self, x):
+        o = self._convolve(self.pad.flush(x))
+        assert self._kernels.shape[-1] == 0, f"{self._kernels.shape[-1]} frames have no input"
+        return o
+
+
+def _gate(o):
+    c = o.shape[1] // 2
+    return torch.sigmoid(o[:, :c]) * torch.tanh(o[:, c:])
+
+
+class _LVCBlockStream:
+    def __init__(self, block: LVCBlock):
+        self.kernel_predictor = _KernelPredictorStream(block.kernel_predictor)
+        self.pre = _Sequential([stream_module(block.convt_pre), stream_module(block.amp_block)])
+        self.lvcs = [_LVC(block.conv_kernel_size, block.cond_hop_length) for _ in block.conv_blocks]
+        self.layers = _Sequential(
+            [
+                _Residual(_Sequential([stream_module(conv), lvc, _Pointwise(_gate)]))
+                for conv, lvc in zip(block.conv_blocks, self.lvcs)
+            ]
+        )
+
+    def _push_kernels(self, kernels, bias):
+        for i, lvc in enumerate(self.lvcs):
+            lvc.push(kernels[:, i], bias[:, i])
+
+    def __call__(self, x, c):
+        self._push_kernels(*self.kernel_predictor(c))
+        return self.layers(self.pre(x))
+
+    def flush(self, x, c):
+        self._push_kernels(*self.kernel_predictor.flush(c))
+        return self.layers.flush(self.pre.flush(x))
+
+
+class UnivNetStream:
+    """
+    Stateful streaming vocoder: acoustic frames go in as they arrive and waveform samples come out as soon as no
+    later frame can change them, each layer keeping only the left context that it still needs. Given the same noise,
+    the pieces put end to end match UnivNet.forward on the whole sequence (up to float rounding, the LVC runs as
+    matmuls and UpActDown at full rate).
+
+    The weights are read when the stream is built. The samples of a frame are out once latency_frames more frames
+    have arrived (~170 ms), most of which is the right context of conv_pre and of the first block, whose layers run
+    at only 7 samples per frame.
+    """
+
+    latency_frames = 18
+
+    def __init__(self, vocoder, npad=10, seed=0):
+        """
+        Args:
+            vocoder: a UnivNet in eval
+            npad: silent frames added on flush, as UnivNet.forward does
+            seed: seed of the noise of each row when it is not given
+        """
+        assert not vocoder.training, "The streaming vocoder only runs in eval"
+        self.vocoder = vocoder
+        self.npad = npad
+        self.seed = seed
+        self.pre = stream_module(vocoder.conv_pre)
+        self.blocks = [_LVCBlockStream(block) for block in vocoder.blocks]
+        self.post = stream_module(vocoder.conv_post)
+        self._generators = None
+        self._last = None  # The last frames, for the shape of the padding
+        self._frames = 0  # Number of frames received
+        self._samples = 0  # Number of samples returned
+
+    def _sample_noise(self, x):
+        """
+        Draw the noise frame by frame from one generator per row, so it does not depend on how the frames are split.
+        """
+        if self._generators is None:
+            self._generators = [torch.Generator(device=x.device).manual_seed(self.seed) for _ in range(len(x))]
+        shape = (x.shape[2], self.vocoder.d_noise)
+        return torch.stack(
+            [torch.randn(shape, generator=g, device=x.device, dtype=x.dtype).t() for g in self._generators]
+        )
+
+    def _run(self, x, z, flush):
+        if z is None:
+            z = self._sample_noise(x)
+        assert z.shape == (x.shape[0], self.vocoder.d_noise, x.shape[2]), f"Expected noise of {x.shape[2]} frames"
+
+        h = self.pre.flush(z) if flush else self.pre(z)
+        for block in self.blocks:
+            h = block.flush(h, x) if flush else block(h, x)
+        h = self.post.flush(h) if flush else self.post(h)
+
+        return h.squeeze(1)  # (b t')
+
+    @torch.inference_mode()
+    def push(self, x: Tensor, z: Tensor | None = None):
+        """
+        Args:
+            x: (b c t), the next acoustic frames
+            z: (b d_noise t), optional noise of these frames
+        Returns:
+            wav: (b t'), the next samples
+        """
+        d_input = self.vocoder.d_input
+        assert x.ndim == 3 and x.shape[1] == d_input, f"Expected (b {d_input} t), got {x.shape}"
+        self._last = x
+        self._frames += x.shape[2]
+        wav = self._run(x, z, flush=False)
+        self._samples += wav.shape[-1]
+        return wav
+
+    @torch.inference_mode()
+    def flush(self, z: Tensor | None = None):
+        """
+        Args:
+            z: (b d_noise npad), optional noise of the padding frames
+        Returns:
+            wav: (b t'), the remaining samples, up to scale_factor samples per frame received
+        """
+        assert self._last is not None, "No frames were pushed"
+        x = self._last.new_zeros(*self._last.shape[:2], self.npad)
+        wav = self._run(x, z, flush=True)
+        return wav[..., : self._frames * self.vocoder.scale_factor - self._samples]
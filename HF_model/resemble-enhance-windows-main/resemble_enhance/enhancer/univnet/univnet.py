@@ -4,7 +4,9 @@ import torch.nn.functional as F
 from torch import Tensor, nn
 from torch.nn.utils.parametrizations import weight_norm
 
+from ...common import randn_per_row
 from ..hparams import HParams
+from .amp import UpActDown
 from .lvcnet import LVCBlock
 from .mrstft import MRSTFTLoss
 
@@ -60,15 +62,91 @@ class UnivNet(nn.Module):
 
         self.mrstft = MRSTFTLoss(hp)
 
+        # Eval only: run the kernel predictor trunks of all blocks as one grouped pass and predict the
+        # LVC kernels one layer at a time into a shared buffer, instead of all layers of a block at once
+        self.fused_kernel_predictors = False
+
     @property
     def eps(self):
         return 1e-5
 
-    def forward(self, x: Tensor, y: Tensor | None = None, npad=10):
+    def _fused_trunks(self, x):
+        """
+        Same as stacking block.kernel_predictor.trunk(x) of every block, with the convolutions of all
+        blocks concatenated (the input conv) or grouped (the residual convs).
+
+        Returns:
+            h: (b n d t), n = number of blocks, d = kpnet_hidden_channels
+        """
+        predictors = [block.kernel_predictor for block in self.blocks]
+        n = len(predictors)
+
+        def fused_conv(convs, h, groups):
+            weight = torch.cat([conv.weight for conv in convs])
+            bias = torch.cat([conv.bias for conv in convs])
+            return F.conv1d(h, weight, bias, padding=convs[0].padding, groups=groups)
+
+        act = predictors[0].input_conv[1]
+
+        h = act(fused_conv([p.input_conv[0] for p in predictors], x, groups=1))
+
+        for j in range(len(predictors[0].residual_convs)):
+            layers = [p.residual_convs[j] for p in predictors]
+            r = act(fused_conv([layer[1] for layer in layers], h, groups=n))
+            r = act(fused_conv([layer[3] for layer in layers], r, groups=n))
+            h = h + r
+
+        return h.unflatten(1, (n, -1))
+
+    def set_lvc_impl_(self, impl):
+        """
+        Select the location-variable convolution of every block, see LVCBlock.LVC_IMPLS.
+        """
+        for block in self.blocks:
+            block.set_lvc_impl_(impl)
+
+    def set_polyphase_(self, enabled=True):
+        """
+        Run the anti-aliased activations of the AMP blocks on the two phases of the upsampled signal in eval,
+        see UpActDown._polyphase_forward.
+        """
+        for module in self.modules():
+            if isinstance(module, UpActDown):
+                module.set_polyphase_(enabled)
+
+    def _generate(self, x: Tensor, z: Tensor):
+        """
+        Args:
+            x: (b c t), acoustic features
+            z: (b d_noise t), noise
+        Returns:
+            z: (b t * scale_factor), waveform
+        """
+        z = self.conv_pre(z)  # (b c t)
+
+        if self.fused_kernel_predictors and not self.training:
+            hs = self._fused_trunks(x).unbind(1)
+            predictor = self.blocks[0].kernel_predictor
+            n = predictor.conv_in_channels * predictor.conv_out_channels * predictor.conv_kernel_size
+            kernel_buffer = hs[0].new_empty(x.shape[0], n, x.shape[2])
+            for block, h in zip(self.blocks, hs):
+                z = block(z, x, h=h, kernel_buffer=kernel_buffer)  # (b c t)
+            del kernel_buffer
+        else:
+            for block in self.blocks:
+                z = block(z, x)  # (b c t)
+
+        z = self.conv_post(z)  # (b 1 t)
+        z = z.squeeze(1)  # (b t)
+
+        return z
+
+    def forward(self, x: Tensor, y: Tensor | None = None, npad=10, z: Tensor | None = None):
         """
         Args:
             x: (b c t), acoustic features
             y: (b t), waveform
+            z: (b d_noise t + npad), optional noise, sampled if not given
         Returns:
             z: (b t), waveform
         """
@@ -78,17 +156,18 @@ class UnivNet(nn.Module):
         assert npad >= 0, "npad must be positive or zero"
 
         x = F.pad(x, (0, npad), "constant", 0)
-        z = torch.randn(x.shape[0], self.d_noise, x.shape[2]).to(x)
-        z = self.conv_pre(z)  # (b c t)
+        if z is not None:
+            assert z.shape == (x.shape[0], self.d_noise, x.shape[2]), f"Expected noise of {x.shape[2]} frames"
+        elif self.training:
+            z = torch.randn(x.shape[0], self.d_noise, x.shape[2]).to(x)
+        else:
+            z = randn_per_row((x.shape[0], self.d_noise, x.shape[2]), device=x.device, dtype=x.dtype)
 
-        for block in self.blocks:
-            z = block(z, x)  # (b c t)
-
-        z = self.conv_post(z)  # (b 1 t)
-        z = z[..., : -self.scale_factor * npad]
-        z = z.squeeze(1)  # (b t)
+        z = self._generate(x, z)
+        z = z[..., : z.shape[-1] - self.scale_factor * npad]
 
         if y is not None:
             self.losses = self.mrstft(z, y)
 
         return z
+
@@ -1,104 +1,232 @@
 import logging
+import os
 import time
 import gc
+import itertools
+from functools import cache
+from typing import Iterable
 
 import torch
 import torch.nn.functional as F
 from torch.nn.utils.parametrize import remove_parametrizations
-from torchaudio.functional import resample
-from torchaudio.transforms import MelSpectrogram
-from tqdm import trange
+from tqdm import tqdm
 
 from .hparams import HParams
+from .precision import autocast
+from .resample import StreamingResampler, resample
+from .spectral import SpectralFrontend
 
 logger = logging.getLogger(__name__)
 
 
-@torch.inference_mode()
-def inference_chunk(model, dwav, sr, device, npad=441):
-    assert model.hp.wav_rate == sr, f"Expected {model.hp.wav_rate} Hz, got {sr} Hz"
-    del sr
+# Peak activation footprint per input sample of the models that do not declare one (see peak_bytes_per_sample)
+_PEAK_BYTES_PER_SAMPLE = 5 * 1024
 
-    length = dwav.shape[-1]
-    abs_max = dwav.abs().max().clamp(min=1e-7)
 
+@torch.inference_mode()
+def inference_chunk(model, dwav, sr, device, npad=441, silence_db=None):
     assert dwav.dim() == 1, f"Expected 1D waveform, got {dwav.dim()}D"
-    dwav = dwav.to(device)
-    dwav = dwav / abs_max  # Normalize
-    dwav = F.pad(dwav, (0, npad))
-    hwav = model(dwav[None])[0].cpu()  # (T,)
-    hwav = hwav[:length]  # Trim padding
-    hwav = hwav * abs_max  # Unnormalize
+    return inference_chunks(model, dwav[None], sr, device, npad=npad, silence_db=silence_db)[0]
+
+
+def _active_span(dwav, sr, silence_db, frame_seconds=0.02, margin_seconds=0.2):
+    """
+    Args:
+        dwav: (t)
+        silence_db: frames with an RMS below this level (dBFS) are silent
+    Returns:
+        span: (start, end) of the non-silent part plus a margin, None if the whole chunk is silent
+    """
+    frame_length = max(1, int(sr * frame_seconds))
+    margin = int(sr * margin_seconds)
 
-    return hwav
+    frames = F.pad(dwav, (0, -len(dwav) % frame_length)).view(-1, frame_length)
+    rms_db = 10 * torch.log10(frames.square().mean(dim=-1) + 1e-12)
+    active = (rms_db > silence_db).nonzero()
 
+    if len(active) == 0:
+        return None
 
-def compute_corr(x, y):
-    return torch.fft.ifft(torch.fft.fft(x) * torch.fft.fft(y).conj()).abs()
+    start = max(0, active[0].item() * frame_length - margin)
+    end = min(len(dwav), (active[-1].item() + 1) * frame_length + margin)
 
+    return start, end
 
-def compute_offset(chunk1, chunk2, sr=44100):
+
+@torch.inference_mode()
+def inference_chunks(model, dwavs, sr, device, npad=441, silence_db=None):
     """
     Args:
-        chunk1: (T,)
-        chunk2: (T,)
+        dwavs: (b t), equal-length chunks, each one is normalized on its own
+        silence_db: if set, silent chunks are output as zeros without running the model
+            and leading/trailing silence of the others is trimmed (see _active_span)
     Returns:
-        offset: int, offset in samples such that chunk1 ~= chunk2.roll(-offset)
+        hwavs: (b t)
+    """
+    assert model.hp.wav_rate == sr, f"Expected {model.hp.wav_rate} Hz, got {sr} Hz"
+
+    length = dwavs.shape[-1]
+
+    if silence_db is not None:
+        spans = [_active_span(dwav, sr, silence_db) for dwav in dwavs]
+        if any(span != (0, length) for span in spans):
+            hwavs = torch.zeros_like(dwavs)
+            full = [i for i, span in enumerate(spans) if span == (0, length)]
+            if full:
+                hwavs[full] = inference_chunks(model, dwavs[full], sr, device, npad=npad)
+            for i, span in enumerate(spans):
+                if span is not None and span != (0, length):
+                    start, end = span
+                    hwavs[i, start:end] = inference_chunks(model, dwavs[i : i + 1, start:end], sr, device, npad=npad)
+            n_silent = sum(span is None for span in spans)
+            logger.debug(f"Skipped {n_silent} silent and trimmed {len(spans) - len(full) - n_silent} chunks")
+            return hwavs
+
+    del sr
+    abs_max = dwavs.abs().max(dim=-1, keepdim=True).values.clamp(min=1e-7)
+
+    assert dwavs.dim() == 2, f"Expected 2D batch of waveforms, got {dwavs.dim()}D"
+    dwavs = dwavs.to(device)
+    dwavs = dwavs / abs_max.to(device)  # Normalize
+    dwavs = F.pad(dwavs, (0, npad))
+    with autocast(model, device):
+        hwavs = model(dwavs)
+    hwavs = hwavs.to(dwavs.dtype).cpu()  # (b t)
+    hwavs = hwavs[:, :length]  # Trim padding
+    hwavs = hwavs * abs_max  # Unnormalize
+
+    return hwavs
+
+
+def _available_memory(device):
+    device = torch.device(device)
+    if device.type == "cuda":
+        return torch.cuda.mem_get_info(device)[0]
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def auto_batch_size(device, chunk_length, max_batch_size=8, bytes_per_sample=_PEAK_BYTES_PER_SAMPLE):
+    """
+    Pick how many chunks fit in half of the currently available memory.
+
+    Args:
+        bytes_per_sample: peak memory of a forward pass per input sample
     """
+    available = _available_memory(device)
+    if available is None:
+        return 1
+    batch_size = int(available // 2 // (chunk_length * bytes_per_sample))
+    return max(1, min(batch_size, max_batch_size))
+
+
+def compute_corr(x, y):
+    return torch.fft.ifft(torch.fft.fft(x) * torch.fft.fft(y).conj()).abs()
+
+
+@cache
+def _get_offset_mel_fn(sr, device):
     hop_length = sr // 200  # 5 ms resolution
     win_length = hop_length * 4
     n_fft = 2 ** (win_length - 1).bit_length()
 
-    mel_fn = MelSpectrogram(
-        sample_rate=sr,
+    frontend = SpectralFrontend(
         n_fft=n_fft,
-        win_length=win_length,
         hop_length=hop_length,
+        win_length=win_length,
+        sample_rate=sr,
         n_mels=80,
         f_min=0.0,
         f_max=sr // 2,
     )
 
-    spec1 = mel_fn(chunk1).log1p()
-    spec2 = mel_fn(chunk2).log1p()
+    return frontend.to(device)
 
-    corr = compute_corr(spec1, spec2)  # (F, T)
-    corr = corr.mean(dim=0)  # (T,)
 
-    argmax = corr.argmax().item()
+@cache
+def _get_fades(overlap_length, hop_length, device):
+    """
+    Returns:
+        fadein: (overlap + hop,)
+        fadeout: (overlap + hop,)
+    """
+    fadein = torch.linspace(0, 1, overlap_length, device=device)
+    fadein = torch.cat([fadein, torch.ones(hop_length, device=device)])
+    fadeout = torch.linspace(1, 0, overlap_length, device=device)
+    fadeout = torch.cat([torch.ones(hop_length, device=device), fadeout])
+    return fadein, fadeout
 
-    if argmax > len(corr) // 2:
-        argmax -= len(corr)
 
-    offset = -argmax * hop_length
+def compute_offsets(regions1, regions2, sr=44100, block_size=32):
+    """
+    Args:
+        regions1: (n t)
+        regions2: (n t)
+        block_size: number of regions per batched FFT, large batches fall out of cache
+    Returns:
+        offsets: (n), offsets in samples such that regions1[i] ~= regions2[i].roll(-offsets[i])
+    """
+    if len(regions1) > block_size:
+        return torch.cat(
+            [
+                compute_offsets(regions1[i : i + block_size], regions2[i : i + block_size], sr=sr)
+                for i in range(0, len(regions1), block_size)
+            ]
+        )
+
+    mel_fn = _get_offset_mel_fn(sr, regions1.device)
+
+    spec1 = mel_fn.mel(regions1, power=2.0).log1p()  # (n F T)
+    spec2 = mel_fn.mel(regions2, power=2.0).log1p()  # (n F T)
 
-    return offset
+    corr = compute_corr(spec1, spec2)  # (n F T)
+    corr = corr.mean(dim=1)  # (n T)
+
+    argmax = corr.argmax(dim=-1)  # (n)
+    argmax = torch.where(argmax > corr.shape[-1] // 2, argmax - corr.shape[-1], argmax)
+
+    offsets = -argmax * mel_fn.hop_length
+
+    return offsets
+
+
+def compute_offset(chunk1, chunk2, sr=44100):
+    """
+    Args:
+        chunk1: (T,)
+        chunk2: (T,)
+    Returns:
+        offset: int, offset in samples such that chunk1 ~= chunk2.roll(-offset)
+    """
+    return compute_offsets(chunk1[None], chunk2[None], sr=sr)[0].item()
 
 
 def merge_chunks(chunks, chunk_length, hop_length, sr=44100, length=None):
     signal_length = (len(chunks) - 1) * hop_length + chunk_length
     overlap_length = chunk_length - hop_length
-    signal = torch.zeros(signal_length, device=chunks[0].device)
+    device = chunks[0].device
+    signal = torch.zeros(signal_length, device=device)
+
+    fadein, fadeout = _get_fades(overlap_length, hop_length, device)
+
+    offsets = [0] * len(chunks)
 
-    fadein = torch.linspace(0, 1, overlap_length, device=chunks[0].device)
-    fadein = torch.cat([fadein, torch.ones(hop_length, device=chunks[0].device)])
-    fadeout = torch.linspace(1, 0, overlap_length, device=chunks[0].device)
-    fadeout = torch.cat([torch.ones(hop_length, device=chunks[0].device), fadeout])
+    if len(chunks) > 1 and overlap_length > 0:
+        # Align every boundary at once: tail of the previous chunk vs head of the current one
+        pads = [max(0, overlap_length - len(chunk)) for chunk in chunks]
+        pre_regions = [F.pad(chunk[-overlap_length:], (pad, 0)) for chunk, pad in zip(chunks[:-1], pads[:-1])]
+        cur_regions = [F.pad(chunk[:overlap_length], (0, pad)) for chunk, pad in zip(chunks[1:], pads[1:])]
+        offsets[1:] = compute_offsets(torch.stack(pre_regions), torch.stack(cur_regions), sr=sr).tolist()
 
     for i, chunk in enumerate(chunks):
-        start = i * hop_length
+        start = i * hop_length - offsets[i]
         end = start + chunk_length
 
         if len(chunk) < chunk_length:
             chunk = F.pad(chunk, (0, chunk_length - len(chunk)))
 
-        if i > 0:
-            pre_region = chunks[i - 1][-overlap_length:]
-            cur_region = chunk[:overlap_length]
-            offset = compute_offset(pre_region, cur_region, sr=sr)
-            start -= offset
-            end -= offset
-
         if i == 0:
             chunk = chunk * fadeout
         elif i == len(chunks) - 1:
@@ -113,6 +241,97 @@ def merge_chunks(chunks, chunk_length, hop_length, sr=44100, length=None):
     return signal
 
 
+class _StreamingMerger:
+    """
+    Incremental version of `merge_chunks`: a chunk is only added once the next one has been aligned to it
+    (or the stream has ended), and samples are released as soon as no later chunk can overlap them.
+    """
+
+    def __init__(self, chunk_length, hop_length, sr=44100):
+        self.chunk_length = chunk_length
+        self.hop_length = hop_length
+        self.overlap_length = chunk_length - hop_length
+        self.sr = sr
+        self._prev = None  # Last chunk, waiting for its successor to decide the fades
+        self._prev_start = 0
+        self._index = 0  # Index of the next chunk
+        self._signal = torch.zeros(0)  # Output samples from self._signal_start on
+        self._signal_start = 0
+
+    def _add(self, chunk, start, fadein, fadeout):
+        if len(chunk) < self.chunk_length:
+            chunk = F.pad(chunk, (0, self.chunk_length - len(chunk)))
+
+        fades = _get_fades(self.overlap_length, self.hop_length, chunk.device)
+        if fadein:
+            chunk = chunk * fades[0]
+        if fadeout:
+            chunk = chunk * fades[1]
+
+        # Offsets never reach back past the released samples, clip just in case
+        skip = max(0, self._signal_start - start)
+        chunk, start = chunk[skip:], start + skip
+
+        end = start + len(chunk) - self._signal_start
+        if end > len(self._signal):
+            self._signal = F.pad(self._signal.to(chunk), (0, end - len(self._signal)))
+        self._signal[start - self._signal_start : end] += chunk
+
+    def _release(self, until):
+        n = max(0, until - self._signal_start)
+        out, self._signal = self._signal[:n], self._signal[n:]
+        self._signal_start += len(out)
+        return out
+
+    def push(self, chunk):
+        """
+        Args:
+            chunk: (t), the next enhanced chunk, t <= chunk_length
+        Returns:
+            out: (t'), samples that are final
+        """
+        i = self._index
+        self._index += 1
+
+        if self._prev is None:
+            self._prev = chunk
+            return self._release(0)
+
+        offset = 0
+        if self.overlap_length > 0:
+            pre = self._prev[-self.overlap_length :]
+            cur = chunk[: self.overlap_length]
+            pre = F.pad(pre, (max(0, self.overlap_length - len(pre)), 0))
+            cur = F.pad(cur, (0, max(0, self.overlap_length - len(cur))))
+            offset = compute_offsets(pre[None], cur[None], sr=self.sr)[0].item()
+
+        self._add(self._prev, self._prev_start, fadein=i > 1, fadeout=True)
+
+        self._prev = chunk
+        self._prev_start = i * self.hop_length - offset
+
+        # Alignment shifts a chunk by at most half the overlap plus one mel hop (sr // 200)
+        margin = self.overlap_length + self.sr // 200
+        return self._release(min(self._prev_start, (i + 1) * self.hop_length - margin))
+
+    def flush(self, length):
+        """
+        Args:
+            length: total length of the merged signal
+        Returns:
+            out: (t'), the remaining samples up to length
+        """
+        if self._prev is not None:
+            # A single chunk is faded out like the first chunk in merge_chunks
+            self._add(self._prev, self._prev_start, fadein=self._index > 1, fadeout=self._index == 1)
+            self._prev = None
+
+        if self._signal_start + len(self._signal) < length:
+            self._signal = F.pad(self._signal, (0, length - self._signal_start - len(self._signal)))
+
+        return self._release(length)
+
+
 def remove_weight_norm_recursively(module):
     for _, module in module.named_modules():
         try:
@@ -121,20 +340,27 @@ def remove_weight_norm_recursively(module):
             pass
 
 
-def inference(model, dwav, sr, device, chunk_seconds: float = 30.0, overlap_seconds: float = 1.0):
-    remove_weight_norm_recursively(model)
-
+def inference(
+    model,
+    dwav,
+    sr,
+    device,
+    chunk_seconds: float = 30.0,
+    overlap_seconds: float = 1.0,
+    batch_size: int | None = 1,
+    silence_db: float | None = None,
+):
+    """
+    Args:
+        batch_size: number of full-length chunks per forward pass, None to pick it from the available memory.
+            Chunks are normalized and sampled independently, so the output matches the sequential path, except
+            with the adaptive CFM solvers (heun_euler, dopri5) whose step sizes are shared by the chunks of a batch.
+        silence_db: if set, chunks quieter than this level (dBFS RMS over 20 ms frames) are output as zeros
+            and the model only runs on the non-silent span of the others
+    """
     hp: HParams = model.hp
 
-    dwav = resample(
-        dwav,
-        orig_freq=sr,
-        new_freq=hp.wav_rate,
-        lowpass_filter_width=64,
-        rolloff=0.9475937167399596,
-        resampling_method="sinc_interp_kaiser",
-        beta=14.769656459379492,
-    )
+    dwav = resample(dwav, orig_freq=sr, new_freq=hp.wav_rate)
 
     del sr  # We are now using hp.wav_rate as the sampling rate
     sr = hp.wav_rate
@@ -148,11 +374,32 @@ def inference(model, dwav, sr, device, chunk_seconds: float = 30.0, overlap_seco
     overlap_length = int(sr * overlap_seconds)
     hop_length = chunk_length - overlap_length
 
+    starts = list(range(0, dwav.shape[-1], hop_length))
+
+    # Only full-length chunks are batched, the shorter tail chunks run one by one without extra padding
+    full_starts = [start for start in starts if start + chunk_length <= dwav.shape[-1]]
+    tail_starts = starts[len(full_starts) :]
+
+    if batch_size is None:
+        bytes_per_sample = getattr(model, "peak_bytes_per_sample", _PEAK_BYTES_PER_SAMPLE)
+        batch_size = auto_batch_size(device, chunk_length, bytes_per_sample=bytes_per_sample)
+        logger.info(f"Using batch size {batch_size}")
+
+    assert batch_size > 0, f"batch_size must be positive, got {batch_size}"
+
     chunks = []
 
-    for start in trange(0, dwav.shape[-1], hop_length):
-        new_chunk = inference_chunk(model, dwav[start : start + chunk_length], sr, device)
+    pbar = tqdm(total=len(starts))
+
+    for i in range(0, len(full_starts), batch_size):
+        batch = torch.stack([dwav[start : start + chunk_length] for start in full_starts[i : i + batch_size]])
+        chunks.extend(inference_chunks(model, batch, sr, device, silence_db=silence_db).unbind(0))
+        pbar.update(len(batch))
+
+    for start in tail_starts:
+        new_chunk = inference_chunk(model, dwav[start : start + chunk_length], sr, device, silence_db=silence_db)
         chunks.append(new_chunk)
+        pbar.update(1)
 
         # Delete the processed segment to free up memory
         # del new_chunk
@@ -162,6 +409,8 @@ def inference(model, dwav, sr, device, chunk_seconds: float = 30.0, overlap_seco
         # Force garbage collection at this point (optional and may slow down processing)
         # gc.collect()
 
+    pbar.close()
+
     hwav = merge_chunks(chunks, chunk_length, hop_length, sr=sr,length=dwav.shape[-1])
     # Clean up chunks to free memory after merging
     
@@ -175,3 +424,190 @@ def inference(model, dwav, sr, device, chunk_seconds: float = 30.0, overlap_seco
     logger.info(f"Elapsed time: {elapsed_time:.3f} s, {hwav.shape[-1] / elapsed_time / 1000:.3f} kHz")
 
     return hwav, sr
+
+
+def _as_mono(block):
+    block = torch.as_tensor(block, dtype=torch.float32)
+    if block.dim() == 2:
+        block = block.mean(dim=-1)  # (frames channels), as yielded by soundfile.blocks
+    assert block.dim() == 1, f"Expected 1D or 2D block, got {block.dim()}D"
+    return block
+
+
+def inference_stream(
+    model,
+    blocks: Iterable,
+    sr,
+    device,
+    chunk_seconds: float = 30.0,
+    overlap_seconds: float = 1.0,
+    silence_db: float | None = None,
+):
+    """
+    Streaming version of `inference`, only one chunk of input and about one chunk of output are held at a time.
+
+    Args:
+        blocks: iterable of waveform blocks at sr, either (t) or (t c), of any length
+        silence_db: see `inference`
+    Yields:
+        hwav: (t'), consecutive pieces of the output at hp.wav_rate, together they match `inference`
+    """
+    hp: HParams = model.hp
+
+    resampler = StreamingResampler(sr, hp.wav_rate)
+
+    del sr  # We are now using hp.wav_rate as the sampling rate
+    sr = hp.wav_rate
+
+    chunk_length = int(sr * chunk_seconds)
+    overlap_length = int(sr * overlap_seconds)
+    hop_length = chunk_length - overlap_length
+
+    merger = _StreamingMerger(chunk_length, hop_length, sr=sr)
+    buffer = torch.zeros(0)
+
+    for block in itertools.chain(blocks, [None]):
+        if block is None:
+            buffer = torch.cat([buffer, resampler.flush()])
+        else:
+            buffer = torch.cat([buffer, resampler(_as_mono(block))])
+
+        # Full chunks are processed as soon as they are available, shorter tail chunks only at the end
+        while len(buffer) >= chunk_length or (block is None and len(buffer) > 0):
+            hwav = merger.push(inference_chunk(model, buffer[:chunk_length], sr, device, silence_db=silence_db))
+            if len(hwav) > 0:
+                yield hwav
+            buffer = buffer[hop_length:]
+
+    hwav = merger.flush(resampler.output_length)
+    if len(hwav) > 0:
+        yield hwav
+
+
+class _FrameMerger:
+    """
+    Frame-domain counterpart of `_StreamingMerger` for a streaming vocoder: the features of consecutive chunks are
+    crossfaded over their overlap with the fades of `merge_chunks`, and so is the level of each chunk as a per-frame
+    gain. The frames of all chunks are on the same grid, so no offset has to be searched.
+    """
+
+    def __init__(self, hop_frames, overlap_frames):
+        self.hop_frames = hop_frames
+        self.overlap_frames = overlap_frames
+        self._tail = None  # (h, gain) of the last chunk from where the next one starts, waiting for it
+
+    def push(self, h, gain):
+        """
+        Args:
+            h: (d t), features of the next chunk, which starts hop_frames after the previous one
+            gain: (t), its level
+        Returns:
+            h: (d t'), gain: (t'), the frames that are final, up to where the next chunk will start
+        """
+        if self._tail is not None:
+            # Like merge_chunks, the previous chunk fades out over the overlap even if it ends before
+            n = min(self.overlap_frames, h.shape[-1])
+            tail_h, tail_gain = (F.pad(x, (0, n - x.shape[-1])) for x in self._tail)
+            fadein = torch.linspace(0, 1, self.overlap_frames, device=h.device)[:n]
+            h = torch.cat([tail_h * (1 - fadein) + h[:, :n] * fadein, h[:, n:]], dim=-1)
+            gain = torch.cat([tail_gain * (1 - fadein) + gain[:n] * fadein, gain[n:]])
+
+        self._tail = h[:, self.hop_frames :], gain[self.hop_frames :]
+
+        return h[:, : self.hop_frames], gain[: self.hop_frames]
+
+    def flush(self):
+        """
+        Returns:
+            h: (d t'), gain: (t'), the rest of the last chunk
+        """
+        tail, self._tail = self._tail, None
+        return tail
+
+
+def inference_stream_vocoded(
+    model,
+    vocoder,
+    blocks: Iterable,
+    sr,
+    device,
+    chunk_seconds: float = 30.0,
+    overlap_seconds: float = 1.0,
+):
+    """
+    Version of `inference_stream` for a model that outputs the input features of a streaming vocoder: the features
+    of the chunks are merged frame by frame (see _FrameMerger) and vocoded as they become final, so every frame is
+    vocoded once instead of once per chunk that covers it, and no waveforms have to be aligned.
+
+    Args:
+        model: maps (b t) waveforms at hp.wav_rate, t a multiple of hp.hop_size, to (b d t // hp.hop_size) features
+        vocoder: streaming vocoder, push(h) with h (b d t) and flush() return the next (b t') samples, t' up to
+            t * hp.hop_size, see UnivNetStream
+        blocks: iterable of waveform blocks at sr, either (t) or (t c), of any length
+    Yields:
+        hwav: (t'), consecutive pieces of the output at hp.wav_rate
+    """
+    hp: HParams = model.hp
+
+    resampler = StreamingResampler(sr, hp.wav_rate)
+
+    del sr  # We are now using hp.wav_rate as the sampling rate
+    sr = hp.wav_rate
+
+    # Chunks start on the frame grid
+    chunk_length = int(sr * chunk_seconds) // hp.hop_size * hp.hop_size
+    overlap_length = int(sr * overlap_seconds) // hp.hop_size * hp.hop_size
+    hop_length = chunk_length - overlap_length
+    assert 0 < hop_length and overlap_length <= hop_length, "The overlap must be at most half of a chunk"
+
+    merger = _FrameMerger(hop_length // hp.hop_size, overlap_length // hp.hop_size)
+    buffer = torch.zeros(0)
+    gains = torch.zeros(0)  # Gains of the samples that the vocoder has yet to output
+    length = None  # Number of output samples, known at the end of the input
+    n_out = 0
+
+    def features(chunk):
+        abs_max = chunk.abs().max().clamp(min=1e-7)
+        x = F.pad(chunk / abs_max, (0, -len(chunk) % hp.hop_size))  # Normalize
+        with autocast(model, device):
+            h = model(x[None].to(device))[0]  # (d t)
+        return h, abs_max.to(h.device).expand(h.shape[-1])
+
+    def release(hwav):
+        nonlocal gains, n_out
+        hwav = hwav.float().cpu()
+        hwav, gains = hwav * gains[: len(hwav)], gains[len(hwav) :]  # Unnormalize
+        if length is not None:
+            hwav = hwav[: length - n_out]
+        n_out += len(hwav)
+        return hwav
+
+    def vocode(h, gain):
+        nonlocal gains
+        if h.shape[-1] == 0:
+            return torch.zeros(0)
+        gains = torch.cat([gains, gain.float().cpu().repeat_interleave(hp.hop_size)])
+        with autocast(model, device):
+            return release(vocoder.push(h[None])[0])
+
+    for block in itertools.chain(blocks, [None]):
+        if block is None:
+            buffer = torch.cat([buffer, resampler.flush()])
+            length = resampler.output_length
+        else:
+            buffer = torch.cat([buffer, resampler(_as_mono(block))])
+
+        # Full chunks are processed as soon as they are available, shorter tail chunks only at the end
+        while len(buffer) >= chunk_length or (block is None and len(buffer) > 0):
+            hwav = vocode(*merger.push(*features(buffer[:chunk_length])))
+            if len(hwav) > 0:
+                yield hwav
+            buffer = buffer[hop_length:]
+
+    tail = merger.flush()
+    if tail is not None:
+        hwav = vocode(*tail)
+        with autocast(model, device):
+            hwav = torch.cat([hwav, release(vocoder.flush()[0])])
+        if len(hwav) > 0:
+            yield hwav
@@ -0,0 +1,129 @@
+import logging
+from contextlib import nullcontext
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor, nn
+
+from .spectral import SpectralFrontend
+
+logger = logging.getLogger(__name__)
+
+PRECISIONS = ("fp32", "bf16", "int8")
+
+
+def bf16_supported(device):
+    device = torch.device(device)
+    if device.type == "cuda":
+        return torch.cuda.is_bf16_supported()
+    if device.type == "cpu":
+        # Without native bf16 instructions (avx512_bf16 / amx) oneDNN emulates it and is slower than fp32
+        if not torch.backends.mkldnn.is_available():
+            return False
+        try:
+            return torch.ops.mkldnn._is_mkldnn_bf16_supported()
+        except (AttributeError, RuntimeError) as e:  # A private op, it may go away in a later torch
+            logger.warning(f"Cannot check the native bf16 support of the CPU, assuming there is none: {e}")
+            return False
+    return False
+
+
+def autocast(model: nn.Module, device):
+    """
+    The autocast context of a model set up by set_autocast_, a no-op otherwise.
+    """
+    dtype = getattr(model, "autocast_dtype", None)
+    if dtype is None:
+        return nullcontext()
+    return torch.autocast(device_type=torch.device(device).type, dtype=dtype)
+
+
+def set_autocast_(model: nn.Module, dtype: torch.dtype | None):
+    """
+    Run the forward passes of model under autocast to dtype in inference_chunks, None to disable.
+    """
+    model.autocast_dtype = dtype
+
+
+class ConvAsLinear(nn.Module):
+    """
+    A stride 1, zero-padded Conv1d computed as a Linear over im2col frames, so that it can be dynamically quantized.
+    """
+
+    def __init__(self, conv: nn.Conv1d):
+        super().__init__()
+        assert self.supports(conv), f"Unsupported convolution: {conv}"
+        self.kernel_size = conv.kernel_size[0]
+        self.dilation = conv.dilation[0]
+        self.padding = self.dilation * (self.kernel_size - 1) // 2
+
+        self.linear = nn.Linear(conv.in_channels * self.kernel_size, conv.out_channels, bias=conv.bias is not None)
+        with torch.no_grad():
+            # (o i k) -> (o k i), matching the tap-major frames
+            self.linear.weight.copy_(conv.weight.transpose(1, 2).flatten(1))
+            if conv.bias is not None:
+                self.linear.bias.copy_(conv.bias)
+
+    @staticmethod
+    def supports(conv: nn.Module):
+        if type(conv) is not nn.Conv1d:
+            return False
+        k, d = conv.kernel_size[0], conv.dilation[0]
+        same = conv.padding == "same" or conv.padding == (d * (k - 1) // 2,)
+        return conv.stride == (1,) and conv.groups == 1 and conv.padding_mode == "zeros" and k % 2 == 1 and same
+
+    def forward(self, x: Tensor):
+        """
+        Args:
+            x: (b c t)
+        Returns:
+            y: (b c' t)
+        """
+        t = x.shape[-1]
+        if self.kernel_size > 1:
+            x = F.pad(x, (self.padding, self.padding))
+            x = torch.cat([x[..., i * self.dilation : i * self.dilation + t] for i in range(self.kernel_size)], dim=1)
+        return self.linear(x.transpose(1, 2)).transpose(1, 2).contiguous()  # Contiguous like a conv output
+
+
+def quantize_int8_(module: nn.Module, skip=()):
+    """
+    Replace the supported Conv1d layers of module (see ConvAsLinear.supports) by dynamically quantized int8 Linears.
+
+    Args:
+        skip: modules to leave untouched, along with their children, e.g. those whose weights are read directly
+    """
+    skip = {id(m) for m in skip}
+
+    def convert_(parent):
+        for name, child in parent.named_children():
+            if id(child) in skip:
+                continue
+            if ConvAsLinear.supports(child):
+                setattr(parent, name, ConvAsLinear(child))
+            else:
+                convert_(child)
+
+    convert_(module)
+    torch.ao.quantization.quantize_dynamic(module, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    return module
+
+
+def spectral_distance(x: Tensor, y: Tensor, sr=44100):
+    """
+    Multi-resolution log-magnitude STFT distance in dB, averaged over time-frequency bins.
+
+    Args:
+        x: (t) or (b t)
+        y: (t) or (b t)
+    """
+    length = min(x.shape[-1], y.shape[-1])
+    x = x[..., :length].float().reshape(-1, length)
+    y = y[..., :length].float().reshape(-1, length)
+    distances = []
+    for hop_length in (sr // 400, sr // 200, sr // 100):
+        n_fft = 2 ** (4 * hop_length - 1).bit_length()
+        frontend = SpectralFrontend(n_fft, hop_length, 4 * hop_length).to(x.device)
+        db = lambda w: 20 * frontend.stft(w).abs().clamp_min(1e-5).log10()
+        distances.append((db(x) - db(y)).abs().mean())
+    return torch.stack(distances).mean().item()
@@ -0,0 +1,86 @@
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Hashable
+
+import torch
+from torch import nn
+
+logger = logging.getLogger(__name__)
+
+
+ModelLoader = Callable[[Path | None, str, torch.dtype, str], nn.Module]
+
+
+class ModelRegistry:
+    """
+    A process-wide, thread-safe LRU cache of prepared inference models.
+
+    Models are keyed by (run_dir, device, dtype, precision), the loader is called at most once per key
+    until the entry is evicted or unloaded.
+    """
+
+    def __init__(self, loader: ModelLoader, capacity: int = 2):
+        assert capacity > 0, f"capacity must be positive, got {capacity}"
+        self.loader = loader
+        self.capacity = capacity
+        self._models: OrderedDict[Hashable, nn.Module] = OrderedDict()
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def make_key(run_dir, device, dtype=torch.float32, precision="fp32"):
+        if run_dir is not None:
+            run_dir = Path(run_dir).resolve()
+        return (run_dir, str(torch.device(device)), dtype, precision)
+
+    def get(self, run_dir, device, dtype=torch.float32, precision="fp32") -> nn.Module:
+        key = self.make_key(run_dir, device, dtype, precision)
+
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+
+            logger.info(f"Loading model for {key}")
+            model = self.loader(*key)
+            self._models[key] = model
+
+            while len(self._models) > self.capacity:
+                evicted, _ = self._models.popitem(last=False)
+                logger.info(f"Evicted model for {evicted}")
+
+            return model
+
+    def peek(self, run_dir, device, dtype=torch.float32, precision="fp32") -> nn.Module | None:
+        """
+        Returns the model if it is loaded, None otherwise, without loading it or changing its LRU position.
+        """
+        with self._lock:
+            return self._models.get(self.make_key(run_dir, device, dtype, precision))
+
+    def warm(self, run_dir, device, dtype=torch.float32, precision="fp32") -> nn.Module:
+        """
+        Load the model ahead of the first request.
+        """
+        return self.get(run_dir, device, dtype, precision)
+
+    def unload(self, run_dir=None, device=None, dtype=torch.float32, precision="fp32"):
+        """
+        Drop a single model, or every model if no device is given.
+        """
+        with self._lock:
+            if device is None:
+                self._models.clear()
+            else:
+                self._models.pop(self.make_key(run_dir, device, dtype, precision), None)
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def __contains__(self, key):
+        with self._lock:
+            return self.make_key(*key) in self._models
+
+    def __len__(self):
+        with self._lock:
+            return len(self._models)
@@ -0,0 +1,139 @@
+import math
+from functools import cache
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+from torchaudio.functional.functional import _get_sinc_resample_kernel
+
+# Same Kaiser-windowed sinc settings as the resample() calls in inference and the dataset
+KAISER_KWARGS = dict(
+    lowpass_filter_width=64,
+    rolloff=0.9475937167399596,
+    resampling_method="sinc_interp_kaiser",
+    beta=14.769656459379492,
+)
+
+
+@cache
+def get_resample_kernel(orig_freq: int, new_freq: int, device=torch.device("cpu"), dtype=torch.float32):
+    """
+    The Kaiser-windowed sinc kernel of resample(), computed once per rate pair. It is a polyphase filter bank:
+    one filter per output phase, applied with a stride of one input period.
+
+    Returns:
+        kernel: (new 1 k), new = new_freq // gcd, must not be modified in place
+        width: left context of the filters in input samples
+    """
+    gcd = math.gcd(orig_freq, new_freq)
+    return _get_sinc_resample_kernel(orig_freq, new_freq, gcd, **KAISER_KWARGS, device=device, dtype=dtype)
+
+
+def _apply_kernel(x: Tensor, kernel: Tensor, stride: int) -> Tensor:
+    """
+    Args:
+        x: (n t), padded input
+        kernel: (new 1 k), see get_resample_kernel
+        stride: orig_freq // gcd
+    Returns:
+        y: (n new * frames), the phases of each frame interleaved
+    """
+    y = F.conv1d(x[:, None], kernel, stride=stride)  # (n new frames)
+    return y.transpose(1, 2).flatten(1)
+
+
+def resample(x: Tensor, orig_freq: int, new_freq: int) -> Tensor:
+    """
+    Same as torchaudio's resample() with KAISER_KWARGS, with the kernel cached.
+
+    Args:
+        x: (... t)
+    Returns:
+        y: (... t'), t' = ceil(t * new_freq / orig_freq)
+    """
+    orig_freq, new_freq = int(orig_freq), int(new_freq)
+    if orig_freq == new_freq:
+        return x
+    kernel, width = get_resample_kernel(orig_freq, new_freq, x.device, x.dtype)
+    stride = orig_freq // math.gcd(orig_freq, new_freq)
+
+    shape = x.shape
+    x = x.reshape(-1, shape[-1])
+    y = _apply_kernel(F.pad(x, (width, width + stride)), kernel, stride)
+    y = y[:, : math.ceil(new_freq * shape[-1] / orig_freq)]
+    return y.reshape(*shape[:-1], y.shape[-1])
+
+
+class StreamingResampler:
+    """
+    Block-wise version of torchaudio's resample() that carries the filter context across blocks,
+    the concatenated output is identical to resampling the whole signal at once.
+    """
+
+    def __init__(self, orig_freq: int, new_freq: int, device="cpu", dtype=torch.float32):
+        self.gcd = math.gcd(int(orig_freq), int(new_freq))
+        self.orig_freq = int(orig_freq) // self.gcd
+        self.new_freq = int(new_freq) // self.gcd
+
+        if self.orig_freq == self.new_freq:
+            self.kernel, self.width = None, 0
+        else:
+            self.kernel, self.width = get_resample_kernel(int(orig_freq), int(new_freq), torch.device(device), dtype)
+
+        self._buffer = torch.zeros(self.width, device=device, dtype=dtype)  # Left zero padding
+        self._length = 0  # Input samples seen so far
+        self._emitted = 0  # Output samples returned so far
+
+    @property
+    def kernel_size(self):
+        return 2 * self.width + self.orig_freq
+
+    def _emit(self):
+        n_frames = max(0, (len(self._buffer) - self.kernel_size) // self.orig_freq + 1)
+        if n_frames == 0:
+            return self._buffer.new_zeros(0)
+        x = self._buffer[: (n_frames - 1) * self.orig_freq + self.kernel_size]
+        y = _apply_kernel(x[None], self.kernel, self.orig_freq)[0]  # (new * n_frames)
+        self._buffer = self._buffer[n_frames * self.orig_freq :]
+        return y
+
+    def __call__(self, x: Tensor) -> Tensor:
+        """
+        Args:
+            x: (t), next block of the input
+        Returns:
+            y: (t'), every output sample whose filter support is complete
+        """
+        assert x.dim() == 1, f"Expected 1D waveform, got {x.dim()}D"
+        x = x.to(self._buffer)
+        self._length += len(x)
+
+        if self.kernel is None:
+            self._emitted += len(x)
+            return x
+
+        self._buffer = torch.cat([self._buffer, x])
+        y = self._emit()
+        self._emitted += len(y)
+        return y
+
+    def flush(self) -> Tensor:
+        """
+        Returns:
+            y: (t'), the remaining output samples, after which the stream is complete
+        """
+        if self.kernel is None:
+            return self._buffer.new_zeros(0)
+
+        self._buffer = F.pad(self._buffer, (0, self.width + self.orig_freq))
+        y = self._emit()
+        y = y[: max(0, self.output_length - self._emitted)]
+        self._emitted += len(y)
+        return y
+
+    @property
+    def output_length(self):
+        """
+        Total output length for the input seen so far, as computed by torchaudio.
+        """
+        return math.ceil(self.new_freq * self._length / self.orig_freq)
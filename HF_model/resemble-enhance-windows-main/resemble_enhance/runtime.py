@@ -0,0 +1,99 @@
+"""
+Runner for the TorchScript files written by resemble_enhance.enhancer.export.
+
+It only depends on torch, so it starts without the training stack (deepspeed, torchaudio, ...) and can be copied
+next to an exported file on its own.
+"""
+
+import json
+
+import torch
+import torch.nn.functional as F
+
+
+class ExportedModel:
+    """
+    An exported denoiser or enhancer: the waveform is cut into the fixed chunks the graph was traced on,
+    each chunk is normalized on its own, and the outputs are merged with linear crossfades.
+    """
+
+    def __init__(self, path, device=None):
+        """
+        Args:
+            device: None for the device the model was exported on, the graph may still create tensors there
+        """
+        extra_files = {"meta.json": ""}
+        self.module = torch.jit.load(str(path), map_location=device, _extra_files=extra_files)
+        self.meta = json.loads(extra_files["meta.json"])
+        self.device = torch.device(self.meta["device"] if device is None else device)
+
+    @property
+    def wav_rate(self) -> int:
+        return self.meta["wav_rate"]
+
+    @property
+    def chunk_length(self) -> int:
+        return self.meta["chunk_length"]
+
+    @property
+    def hop_length(self) -> int:
+        return self.meta["chunk_length"] - self.meta["overlap_length"]
+
+    def _fades(self):
+        overlap_length = self.meta["overlap_length"]
+        fadein = torch.cat([torch.linspace(0, 1, overlap_length), torch.ones(self.hop_length)])
+        fadeout = torch.cat([torch.ones(self.hop_length), torch.linspace(1, 0, overlap_length)])
+        return fadein, fadeout
+
+    def _run(self, chunks):
+        """
+        Args:
+            chunks: (b chunk_length), b <= batch_size
+        Returns:
+            hwavs: (b chunk_length)
+        """
+        n, batch_size = len(chunks), self.meta["batch_size"]
+        chunks = F.pad(chunks, (0, 0, 0, batch_size - n))  # The graph has a fixed batch size
+
+        abs_max = chunks.abs().max(dim=-1, keepdim=True).values.clamp(min=1e-7)
+        x = F.pad(chunks / abs_max, (0, self.meta["npad"])).to(self.device)
+        hwavs = self.module(x).float().cpu()[:, : self.chunk_length]
+
+        return (hwavs * abs_max)[:n]
+
+    @torch.inference_mode()
+    def __call__(self, dwav, sr):
+        """
+        Args:
+            dwav: (t), mono waveform at wav_rate, resample it beforehand
+        Returns:
+            hwav: (t)
+        """
+        assert sr == self.wav_rate, f"Expected {self.wav_rate} Hz, got {sr} Hz, resample the input first"
+        assert dwav.dim() == 1, f"Expected 1D waveform, got {dwav.dim()}D"
+
+        length = dwav.shape[-1]
+        starts = list(range(0, max(length, 1), self.hop_length))
+        chunks = [dwav[start : start + self.chunk_length].float() for start in starts]
+
+        batch_size = self.meta["batch_size"]
+        hwavs = []
+        for i in range(0, len(chunks), batch_size):
+            batch = chunks[i : i + batch_size]
+            batch = torch.stack([F.pad(c, (0, self.chunk_length - len(c))) for c in batch])
+            hwavs.extend(self._run(batch).unbind(0))
+
+        fadein, fadeout = self._fades()
+        signal = torch.zeros((len(hwavs) - 1) * self.hop_length + self.chunk_length)
+        for i, (start, hwav) in enumerate(zip(starts, hwavs)):
+            if i > 0:
+                hwav = hwav * fadein
+            if i < len(hwavs) - 1:
+                hwav = hwav * fadeout
+            signal[start : start + self.chunk_length] += hwav
+
+        return signal[:length]
+
+
+def load(path, device=None):
+    return ExportedModel(path, device=device)
@@ -0,0 +1,105 @@
+import torch
+from torch import Tensor, nn
+from torchaudio.functional import melscale_fbanks
+
+
+class SpectralFrontend(nn.Module):
+    """
+    STFT analysis/synthesis with the Hann window and the optional mel filterbank built once, as non-persistent
+    buffers so that they follow the module across devices without showing up in checkpoints.
+
+    The magnitude, phase and mel views of a waveform are all taken from a single STFT.
+    """
+
+    def __init__(
+        self,
+        n_fft: int,
+        hop_length: int,
+        win_length: int | None = None,
+        center: bool = True,
+        pad_mode: str = "reflect",
+        sample_rate: int | None = None,
+        n_mels: int | None = None,
+        f_min: float = 0.0,
+        f_max: float | None = None,
+        norm: str | None = None,
+        mel_scale: str = "htk",
+    ):
+        super().__init__()
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.win_length = n_fft if win_length is None else win_length
+        self.center = center
+        self.pad_mode = pad_mode
+
+        self.window: Tensor
+        self.register_buffer("window", torch.hann_window(self.win_length), persistent=False)
+
+        fb = None
+        if n_mels is not None:
+            assert sample_rate is not None, "sample_rate is required for the mel filterbank"
+            f_max = sample_rate / 2 if f_max is None else f_max
+            fb = melscale_fbanks(n_fft // 2 + 1, f_min, f_max, n_mels, sample_rate, norm, mel_scale)  # (f m)
+
+        self.fb: Tensor | None
+        self.register_buffer("fb", fb, persistent=False)
+
+    @property
+    def stft_cfg(self) -> dict:
+        return dict(n_fft=self.n_fft, hop_length=self.hop_length, win_length=self.win_length)
+
+    def stft(self, x: Tensor):
+        """
+        Args:
+            x: (b t)
+        Returns:
+            s: (b f t'), complex
+        """
+        window = self.window.to(x.device)
+        return torch.stft(
+            x.float(),
+            **self.stft_cfg,
+            window=window,
+            center=self.center,
+            pad_mode=self.pad_mode,
+            return_complex=True,
+        )
+
+    def istft(self, s: Tensor, length: int | None = None):
+        """
+        Args:
+            s: (b f t'), complex
+        Returns:
+            x: (b t)
+        """
+        window = self.window.to(s.device)
+        return torch.istft(s, **self.stft_cfg, window=window, center=self.center, length=length)
+
+    def magphase(self, x: Tensor, drop_last=False):
+        """
+        Args:
+            x: (b t)
+            drop_last: drop the last frame
+        Returns:
+            mag: (b f t') in [0, inf)
+            cos: (b f t') in [-1, 1]
+            sin: (b f t') in [-1, 1]
+        """
+        s = self.stft(x)
+        if drop_last:
+            s = s[..., :-1]
+        phi = s.angle()
+        return s.abs(), phi.cos(), phi.sin()
+
+    def mel(self, x: Tensor, power=1.0):
+        """
+        Same as torchaudio's MelSpectrogram with the same configuration.
+
+        Args:
+            x: (b t)
+        Returns:
+            mel: (b m t')
+        """
+        assert self.fb is not None, "Built without a mel filterbank"
+        spec = self.stft(x).abs().pow(power)  # (b f t')
+        return torch.matmul(spec.transpose(-1, -2), self.fb).transpose(-1, -2)
@@ -0,0 +1,131 @@
+import math
+import mmap
+import struct
+from pathlib import Path
+
+import numpy as np
+import soundfile
+import torch
+
+# RIFF header (12) + fmt chunk (8 + 16) + fact chunk (8 + 4) + data chunk header (8)
+_HEADER_SIZE = 56
+
+
+def open_blocks(path, block_seconds=10.0, raw_sr=None, raw_channels=1, raw_dtype="float32"):
+    """
+    Open an audio file for block-wise reading without loading it into memory.
+
+    WAV and the other formats supported by soundfile are read through soundfile, headerless .raw files are
+    memory-mapped with numpy and need raw_sr.
+
+    Returns:
+        sr: sampling rate
+        length: number of frames
+        blocks: generator of (t c) float32 tensors
+    """
+    path = Path(path)
+
+    if path.suffix.lower() == ".raw":
+        assert raw_sr is not None, "raw_sr is required for .raw input"
+        data = np.memmap(path, dtype=raw_dtype, mode="r")
+        data = data[: len(data) // raw_channels * raw_channels].reshape(-1, raw_channels)
+        block_length = max(1, int(block_seconds * raw_sr))
+
+        def blocks():
+            for i in range(0, len(data), block_length):
+                yield torch.from_numpy(np.array(data[i : i + block_length], dtype=np.float32))
+
+        return raw_sr, len(data), blocks()
+
+    info = soundfile.info(str(path))
+    block_length = max(1, int(block_seconds * info.samplerate))
+
+    def blocks():
+        for block in soundfile.blocks(str(path), blocksize=block_length, dtype="float32", always_2d=True):
+            yield torch.from_numpy(block)
+
+    return info.samplerate, info.frames, blocks()
+
+
+def resampled_length(length, orig_freq, new_freq):
+    """
+    Output length of torchaudio's resample() for an input of the given length.
+    """
+    if orig_freq == new_freq:
+        return length
+    gcd = math.gcd(int(orig_freq), int(new_freq))
+    return math.ceil(new_freq // gcd * length / (orig_freq // gcd))
+
+
+class MemmapWavWriter:
+    """
+    Writes a mono float32 WAV of known length through a memory map of the preallocated file.
+
+    Written pages are flushed and dropped from the page cache mapping every flush_every samples,
+    so the resident memory does not grow with the file length.
+    """
+
+    def __init__(self, path, length, sr, flush_every=1 << 20):
+        self.path = Path(path)
+        self.length = length
+        self.flush_every = flush_every
+        self._pos = 0
+        self._flushed = 0
+
+        data_size = length * 4
+        assert _HEADER_SIZE + data_size < 2**32, "Output is too long for a WAV file"
+
+        with open(self.path, "wb") as f:
+            f.write(b"RIFF" + struct.pack("<I", _HEADER_SIZE - 8 + data_size) + b"WAVE")
+            # WAVE_FORMAT_IEEE_FLOAT, mono, 32 bits
+            f.write(b"fmt " + struct.pack("<IHHIIHH", 16, 3, 1, sr, sr * 4, 4, 32))
+            f.write(b"fact" + struct.pack("<II", 4, length))
+            f.write(b"data" + struct.pack("<I", data_size))
+            f.truncate(_HEADER_SIZE + data_size)
+
+        self._file = open(self.path, "r+b")
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        self._data = np.frombuffer(self._mmap, dtype="<f4", count=length, offset=_HEADER_SIZE)
+
+    def write(self, x):
+        """
+        Args:
+            x: (t), the next samples
+        """
+        x = torch.as_tensor(x).detach().cpu().numpy()
+        assert self._pos + len(x) <= self.length, f"Writing past the end: {self._pos + len(x)} > {self.length}"
+        self._data[self._pos : self._pos + len(x)] = x
+        self._pos += len(x)
+        if self._pos - self._flushed >= self.flush_every:
+            self._flush()
+
+    def _flush(self):
+        self._mmap.flush()
+        if hasattr(mmap, "MADV_DONTNEED"):
+            # Align down to whole pages, the partially written page stays mapped
+            end = (_HEADER_SIZE + self._pos * 4) // mmap.PAGESIZE * mmap.PAGESIZE
+            if end > 0:
+                self._mmap.madvise(mmap.MADV_DONTNEED, 0, end)
+        self._flushed = self._pos
+
+    def close(self):
+        if self._mmap.closed:
+            return
+        assert self._pos == self.length, f"Expected {self.length} samples, got {self._pos}"
+        self._mmap.flush()
+        del self._data
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+        else:
+            # Leave no half-written file behind
+            del self._data
+            self._mmap.close()
+            self._file.close()
+            self.path.unlink(missing_ok=True)
@@ -0,0 +1,23 @@
+import pytest
+import torch
+
+from resemble_enhance.enhancer.univnet.amp import SnakeBeta, UpActDown
+
+
+@pytest.mark.parametrize("length", [1, 2, 7, 16, 101])
+@pytest.mark.parametrize("channels", [1, 4, 32])
+@torch.no_grad()
+def test_polyphase_matches_reference(channels, length):
+    torch.manual_seed(0)
+    act = SnakeBeta(channels)
+    act.log_alpha.normal_(std=0.5)
+    act.log_beta.normal_(std=0.5)
+    module = UpActDown(act=act).eval()
+    x = torch.randn(2, channels, length)
+
+    expected = module(x)
+    module.set_polyphase_()
+    actual = module(x)
+
+    assert actual.shape == expected.shape == x.shape
+    torch.testing.assert_close(actual, expected, rtol=1e-5, atol=1e-5)
@@ -0,0 +1,45 @@
+import math
+
+import pytest
+import torch
+
+from resemble_enhance.enhancer.lcfm.cfm import CFM, Solver
+
+_VELOCITY_FIELDS = {
+    "stiff": lambda t, ψt: -50 * (ψt - math.cos(30 * t)),
+    "oscillating": lambda t, ψt: 100 * math.cos(100 * t) * torch.ones_like(ψt),
+}
+
+
+@pytest.mark.parametrize("field", list(_VELOCITY_FIELDS))
+@pytest.mark.parametrize("method", ["heun_euler", "dopri5"])
+@pytest.mark.parametrize("nfe", [8, 16, 32, 64, 128])
+def test_adaptive_solver_stays_within_nfe(field, method, nfe):
+    solver = Solver(method=method, nfe=nfe, atol=1e-3, rtol=1e-3)
+    calls = 0
+
+    def f(t, ψt, dt):
+        nonlocal calls
+        calls += 1
+        return _VELOCITY_FIELDS[field](float(t), ψt)
+
+    ψ1 = solver(f=f, ψ0=torch.ones(2, 1, 4))
+
+    assert solver.nfe_used == calls
+    assert solver.nfe_used <= nfe
+    assert torch.isfinite(ψ1).all()
+
+
+@pytest.mark.parametrize("method", ["midpoint", "rk4", "dopri5"])
+def test_cached_conditioning_matches_uncached(method):
+    torch.manual_seed(0)
+    cfm = CFM(cond_dim=8, output_dim=4, solver_nfe=8, solver_method=method).eval()
+    x = torch.randn(2, 8, 16)
+    ψ0 = torch.randn(2, 4, 16)
+
+    cfm.cache_conditioning = False
+    expected = cfm.sample(x, ψ0=ψ0)
+    cfm.cache_conditioning = True
+    actual = cfm.sample(x, ψ0=ψ0)
+
+    torch.testing.assert_close(actual, expected, rtol=1e-4, atol=1e-5)
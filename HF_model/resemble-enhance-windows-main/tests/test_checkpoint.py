@@ -0,0 +1,68 @@
+import threading
+
+import torch
+from torch import nn
+from torch.nn.utils.parametrizations import weight_norm
+
+from resemble_enhance.checkpoint import assign_, drop_parametrizations_, load_flat, meta_parameters, save_flat
+from resemble_enhance.inference import remove_weight_norm_recursively
+
+
+class _Net(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.conv = weight_norm(nn.Conv1d(2, 4, 3, padding=1))
+        self.norm = nn.GroupNorm(2, 4)
+        self.window: torch.Tensor
+        self.register_buffer("window", torch.hann_window(8), persistent=False)
+
+    def forward(self, x):
+        return self.norm(self.conv(x)) * self.window
+
+
+def test_flat_file_matches_deepspeed_checkpoint(tmp_path):
+    torch.manual_seed(0)
+    ds_path = tmp_path / "mp_rank_00_model_states.pt"
+    torch.save({"module": _Net().state_dict()}, ds_path)
+
+    expected = _Net().eval()
+    expected.load_state_dict(torch.load(ds_path, map_location="cpu")["module"])
+
+    # The steps of convert_checkpoint and load_enhancer
+    converted = _Net()
+    converted.load_state_dict(torch.load(ds_path, map_location="cpu")["module"])
+    remove_weight_norm_recursively(converted)
+    tensors = dict(converted.named_parameters(remove_duplicate=False))
+    tensors.update(converted.named_buffers(remove_duplicate=False))
+    flat_path = tmp_path / "mp_rank_00_model_states.safetensors"
+    save_flat(tensors, flat_path, metadata=dict(weight_norm="folded"))
+
+    tensors, metadata = load_flat(flat_path)
+    with meta_parameters():
+        actual = _Net()
+    drop_parametrizations_(actual)
+    assign_(actual, tensors)
+    actual.eval()
+
+    assert metadata == dict(weight_norm="folded")
+    assert not any(p.is_meta for p in actual.parameters())
+    torch.testing.assert_close(actual.conv.weight, expected.conv.weight)
+    torch.testing.assert_close(actual.window, expected.window)
+
+    x = torch.randn(3, 2, 8)
+    with torch.no_grad():
+        torch.testing.assert_close(actual(x), expected(x))
+
+
+def test_meta_parameters_is_thread_local():
+    built = {}
+    thread = threading.Thread(target=lambda: built.update(other=nn.Linear(4, 4)))
+
+    with meta_parameters():
+        thread.start()
+        thread.join()
+        built["current"] = nn.Linear(4, 4)
+
+    assert built["current"].weight.is_meta
+    assert not built["other"].weight.is_meta
+    assert not nn.Linear(4, 4).weight.is_meta
@@ -0,0 +1,128 @@
+from types import SimpleNamespace
+
+import pytest
+import torch
+import torch.nn.functional as F
+
+from resemble_enhance.common import randn_per_row
+from resemble_enhance.enhancer.hparams import HParams
+from resemble_enhance.enhancer.univnet import UnivNet, UnivNetStream
+from resemble_enhance.inference import inference, inference_stream, inference_stream_vocoded
+
+SR = 44_100
+
+
+class _StubModel:
+    """
+    Maps each row on its own, with some context across samples so that misaligned chunks would show.
+    """
+
+    hp = SimpleNamespace(wav_rate=SR)
+
+    def __call__(self, x):
+        return torch.tanh(3 * x) + 0.1 * x.roll(1, dims=-1)
+
+
+class _StubFeatures:
+    """
+    Features of each frame on its own, so that the frames shared by overlapping chunks get the same features.
+    """
+
+    hp = SimpleNamespace(wav_rate=SR, hop_size=420)
+
+    def __init__(self, dim):
+        self.weight = torch.randn(dim, self.hp.hop_size, generator=torch.Generator().manual_seed(0)) / 20
+
+    def __call__(self, x):
+        return self.weight @ x.unflatten(-1, (-1, self.hp.hop_size)).transpose(1, 2)  # (b d t)
+
+
+def _test_signal(length, silent=None):
+    g = torch.Generator().manual_seed(0)
+    t = torch.arange(length) / SR
+    dwav = 0.3 * torch.sin(2 * torch.pi * 220 * t) + 0.05 * torch.randn(length, generator=g)
+    if silent is not None:
+        dwav[silent[0] : silent[1]] = 0
+    return dwav
+
+
+@pytest.mark.parametrize("silence_db", [None, -60.0])
+@pytest.mark.parametrize("batch_size", [2, 3])
+def test_batched_matches_sequential(batch_size, silence_db):
+    # 0.5 s chunks with a 17640 sample hop, 6 full chunks, a tail chunk and a silent stretch covering a chunk
+    dwav = _test_signal(int(3.7 * SR), silent=(int(1.0 * SR), int(1.9 * SR)))
+    kwargs = dict(model=_StubModel(), dwav=dwav, sr=SR, device="cpu", chunk_seconds=0.5, overlap_seconds=0.1)
+
+    expected, _ = inference(batch_size=1, silence_db=silence_db, **kwargs)
+    actual, sr = inference(batch_size=batch_size, silence_db=silence_db, **kwargs)
+
+    assert sr == SR
+    assert actual.shape == dwav.shape
+    torch.testing.assert_close(actual, expected, rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.parametrize(
+    "length",
+    [
+        10_000,  # A single chunk
+        3 * 17_640,  # An exact multiple of the hop
+        3 * 17_640 + 1_234,  # A short tail chunk
+    ],
+)
+@pytest.mark.parametrize("block_length", [4_096, 30_000])
+def test_stream_matches_inference(length, block_length):
+    dwav = _test_signal(length)
+    kwargs = dict(model=_StubModel(), sr=SR, device="cpu", chunk_seconds=0.5, overlap_seconds=0.1)
+
+    expected, _ = inference(dwav=dwav, **kwargs)
+    actual = torch.cat(list(inference_stream(blocks=dwav.split(block_length), **kwargs)))
+
+    assert actual.shape == expected.shape
+    torch.testing.assert_close(actual, expected, rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.parametrize(
+    "length",
+    [
+        10_000,  # A single chunk
+        3 * 17_640,  # An exact multiple of the hop
+        3 * 17_640 + 1_234,  # A short tail chunk
+    ],
+)
+@pytest.mark.parametrize("level", [1.0, 0.25])
+@torch.inference_mode()
+def test_stream_vocoded_matches_whole_features(length, level):
+    torch.manual_seed(0)
+    hp = HParams(univnet_nc=16)
+    vocoder = UnivNet(hp, d_input=hp.num_mels + hp.vocoder_extra_dim).eval()
+    model = _StubFeatures(vocoder.d_input)
+
+    # Every frame peaks at the same level, so the gains of all chunks are equal and the crossfades are no-ops
+    dwav = _test_signal(length).clamp(-0.5, 0.5)
+    dwav[::420] = 1
+    dwav = level * dwav
+
+    stream = UnivNetStream(vocoder)
+    h = model(F.pad(dwav / level, (0, -length % 420))[None])
+    expected = level * torch.cat([stream.push(h), stream.flush()], dim=-1)[0, :length]
+
+    hwavs = inference_stream_vocoded(
+        model=model,
+        vocoder=UnivNetStream(vocoder),
+        blocks=dwav.split(4_096),
+        sr=SR,
+        device="cpu",
+        chunk_seconds=0.5,
+        overlap_seconds=0.1,
+    )
+    actual = torch.cat(list(hwavs))
+
+    assert actual.shape == (length,)
+    torch.testing.assert_close(actual, expected, rtol=1e-4, atol=1e-5)
+
+
+def test_randn_per_row_is_not_shared():
+    noise = randn_per_row((2, 3, 4))
+    noise.zero_()
+    assert randn_per_row((2, 3, 4)).abs().sum() > 0
+    torch.testing.assert_close(randn_per_row((1, 3, 4))[0], randn_per_row((2, 3, 4))[1])
@@ -0,0 +1,18 @@
+import torch
+
+from resemble_enhance.enhancer.lcfm.irmae import IRMAE
+
+
+@torch.inference_mode()
+def test_fused_matches_reference():
+    torch.manual_seed(0)
+    ae = IRMAE(input_dim=16, output_dim=20, latent_dim=8, hidden_dim=64).eval()
+    x = torch.randn(2, 16, 37)
+    z = torch.randn(2, 8, 37)
+
+    expected_latent, expected_decoded = ae.encode(x), ae.decode(z)
+    ae.fused_inference = True
+    latent, decoded = ae.encode(x), ae.decode(z)
+
+    torch.testing.assert_close(latent, expected_latent, rtol=1e-4, atol=1e-5)
+    torch.testing.assert_close(decoded, expected_decoded, rtol=1e-4, atol=1e-5)
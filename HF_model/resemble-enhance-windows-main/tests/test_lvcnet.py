@@ -0,0 +1,68 @@
+import pytest
+import torch
+
+from resemble_enhance.enhancer.hparams import HParams
+from resemble_enhance.enhancer.univnet import UnivNet
+from resemble_enhance.enhancer.univnet.lvcnet import LVCBlock
+
+
+@pytest.mark.parametrize(
+    "batch, in_channels, out_channels, kernel_size, kernel_length, hop_size",
+    [
+        (2, 8, 16, 3, 5, 4),
+        (1, 4, 8, 5, 3, 7),
+        (1, 8, 16, 3, 1, 4),  # A single frame, the padding covers the whole context
+        (3, 2, 4, 3, 2, 1),
+    ],
+)
+def test_matmul_matches_einsum(batch, in_channels, out_channels, kernel_size, kernel_length, hop_size):
+    g = torch.Generator().manual_seed(0)
+    x = torch.randn(batch, in_channels, kernel_length * hop_size, generator=g)
+    kernel = torch.randn(batch, in_channels, out_channels, kernel_size, kernel_length, generator=g)
+    bias = torch.randn(batch, out_channels, kernel_length, generator=g)
+
+    block = LVCBlock(in_channels, cond_channels=4, stride=1, cond_hop_length=hop_size)
+    expected = block.location_variable_convolution(x, kernel, bias, hop_size=hop_size)
+    actual = LVCBlock.location_variable_convolution_matmul(x, kernel, bias, hop_size=hop_size)
+
+    torch.testing.assert_close(actual, expected, rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize("n_frames, npad", [(4, 0), (8, 10)])  # The reflect padding needs 4 frames
+@torch.no_grad()
+def test_univnet_matmul_matches_einsum(n_frames, npad):
+    torch.manual_seed(0)
+    hp = HParams()
+    vocoder = UnivNet(hp, d_input=hp.num_mels + hp.vocoder_extra_dim).eval()
+    x = torch.randn(2, vocoder.d_input, n_frames)
+
+    vocoder.set_lvc_impl_("einsum")
+    expected = vocoder(x, npad=npad)
+    vocoder.set_lvc_impl_("matmul")
+    actual = vocoder(x, npad=npad)
+
+    assert actual.shape == (2, n_frames * vocoder.scale_factor)
+    torch.testing.assert_close(actual, expected, rtol=1e-4, atol=1e-5)
+
+
+@torch.no_grad()
+def test_fused_kernel_predictors_match_per_block():
+    torch.manual_seed(0)
+    hp = HParams()
+    vocoder = UnivNet(hp, d_input=hp.num_mels + hp.vocoder_extra_dim).eval()
+    x = torch.randn(2, vocoder.d_input, 6)
+
+    hs = vocoder._fused_trunks(x)
+    assert hs.shape[1] == len(vocoder.blocks)
+
+    for block, h in zip(vocoder.blocks, hs.unbind(1)):
+        predictor = block.kernel_predictor
+        kernels, bias = predictor(x)
+        torch.testing.assert_close(h, predictor.trunk(x), rtol=1e-4, atol=1e-5)
+        torch.testing.assert_close(predictor.hidden_bias(h), bias, rtol=1e-4, atol=1e-5)
+        for i in range(predictor.conv_layers):
+            torch.testing.assert_close(predictor.layer_kernel(h, i), kernels[:, i], rtol=1e-4, atol=1e-5)
+
+    expected = vocoder(x)
+    vocoder.fused_kernel_predictors = True
+    torch.testing.assert_close(vocoder(x), expected, rtol=1e-4, atol=1e-5)
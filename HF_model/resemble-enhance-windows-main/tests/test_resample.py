@@ -0,0 +1,21 @@
+import pytest
+import torch
+import torchaudio
+
+from resemble_enhance.resample import KAISER_KWARGS, StreamingResampler, resample
+
+
+@pytest.mark.parametrize("orig_freq", [16_000, 22_050, 44_100, 48_000])
+def test_resample_matches_torchaudio(orig_freq):
+    x = torch.randn(2, orig_freq // 2 + 7, generator=torch.Generator().manual_seed(0))
+    expected = torchaudio.functional.resample(x, orig_freq, 44_100, **KAISER_KWARGS)
+    torch.testing.assert_close(resample(x, orig_freq, 44_100), expected)
+
+
+@pytest.mark.parametrize("orig_freq", [16_000, 48_000])
+def test_streaming_matches_one_shot(orig_freq):
+    x = torch.randn(orig_freq + 13, generator=torch.Generator().manual_seed(0))
+    resampler = StreamingResampler(orig_freq, 44_100)
+    blocks = [resampler(block) for block in x.split(orig_freq // 7)]
+    blocks.append(resampler.flush())
+    torch.testing.assert_close(torch.cat(blocks), resample(x, orig_freq, 44_100))
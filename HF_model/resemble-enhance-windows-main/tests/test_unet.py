@@ -0,0 +1,44 @@
+import pytest
+import torch
+from torch import nn
+
+from resemble_enhance.denoiser.unet import PreactResBlock, UNet
+
+
+def _tiled_and_untiled(net, x, batch_size):
+    expected = net(x)
+    net.set_tiling_(tile_frames=256, halo_frames=128, batch_size=batch_size)
+    actual = net(x)
+    assert actual.shape == expected.shape == x.shape
+    return actual, expected
+
+
+@pytest.mark.parametrize("batch_size", [1, 2])
+@pytest.mark.parametrize("width", [1024, 1000])
+@torch.inference_mode()
+def test_tiled_convolutions_match_untiled(width, batch_size):
+    torch.manual_seed(0)
+    net = UNet(input_dim=3, output_dim=3).eval()
+    for module in net.modules():
+        if isinstance(module, PreactResBlock):
+            module[0] = module[3] = nn.Identity()  # Only GroupNorm sees more than the halo
+    x = torch.randn(2, 3, 64, width) * torch.linspace(0.5, 2.0, width)
+
+    actual, expected = _tiled_and_untiled(net, x, batch_size)
+
+    torch.testing.assert_close(actual, expected, rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.parametrize("width", [1024, 1000])
+@torch.inference_mode()
+def test_tiled_is_close_to_untiled(width):
+    torch.manual_seed(0)
+    net = UNet(input_dim=3, output_dim=3).eval()
+    x = torch.randn(2, 3, 64, width)
+
+    actual, expected = _tiled_and_untiled(net, x, batch_size=2)
+
+    # GroupNorm normalizes over each tile instead of the whole input, so tiling is only approximate: ~31 dB here
+    # on a stationary input, and less when the level changes across the tiles
+    snr = 10 * torch.log10(expected.square().sum() / (actual - expected).square().sum())
+    assert snr > 25, f"Tiled output is {snr:.1f} dB off the untiled one"
@@ -0,0 +1,43 @@
+import pytest
+import torch
+
+from resemble_enhance.enhancer.hparams import HParams
+from resemble_enhance.enhancer.univnet import UnivNet, UnivNetStream
+
+
+def _vocoder():
+    torch.manual_seed(0)
+    hp = HParams(univnet_nc=16)  # The kernel predictors of the default width output 221184 channels per frame
+    return UnivNet(hp, d_input=hp.num_mels + hp.vocoder_extra_dim).eval()
+
+
+@pytest.mark.parametrize("n_frames, npad", [(30, 10), (24, 0)])
+@pytest.mark.parametrize("frames_per_push", [1, 4, 7, 30])
+@torch.inference_mode()
+def test_stream_matches_forward(n_frames, npad, frames_per_push):
+    vocoder = _vocoder()
+    x = torch.randn(2, vocoder.d_input, n_frames)
+    z = torch.randn(2, vocoder.d_noise, n_frames + npad)
+    expected = vocoder(x, npad=npad, z=z)
+
+    stream = UnivNetStream(vocoder, npad=npad)
+    wavs = [
+        stream.push(x[..., i : i + frames_per_push], z[..., i : min(i + frames_per_push, n_frames)])
+        for i in range(0, n_frames, frames_per_push)
+    ]
+    wavs.append(stream.flush(z[..., n_frames:]))
+    actual = torch.cat(wavs, dim=-1)
+
+    assert actual.shape == expected.shape == (2, n_frames * vocoder.scale_factor)
+    torch.testing.assert_close(actual, expected, rtol=1e-4, atol=1e-5)
+
+
+@torch.inference_mode()
+def test_stream_latency():
+    vocoder = _vocoder()
+    stream = UnivNetStream(vocoder)
+    n_samples = 0
+    for i in range(1, 41):
+        n_samples += stream.push(torch.randn(1, vocoder.d_input, 1)).shape[-1]
+        # The samples of a frame come out once the right context of every layer has arrived
+        assert n_samples >= (i - UnivNetStream.latency_frames) * vocoder.scale_factor